@@ -0,0 +1,90 @@
+# bench/eligibility_memory.py
+"""
+Память и скорость EligibilityIndex на синтетическом чате.
+
+    python bench/eligibility_memory.py [--users 100000] [--chats 10]
+
+Печатает размер общей таблицы пользователей и битсетов чатов,
+время выборки eligible и (для сравнения) размер тех же данных
+в виде set'ов, как их собирали запросы к БД до индекса.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.eligibility import EligibilityIndex
+
+
+class _Repo:
+    """Стенд-ин репозитория: только то, что нужно индексу."""
+
+    def __init__(self, ids, opted, excluded):
+        self._ids, self._opted, self._excluded = ids, opted, excluded
+
+    def iter_user_pages(self, page_size=1000):
+        for i in range(0, len(self._ids), page_size):
+            yield [
+                {"user_id": uid, "is_opted_out": uid in self._opted}
+                for uid in self._ids[i : i + page_size]
+            ]
+
+    def list_excluded_ids(self, chat_id):
+        return self._excluded
+
+
+def _set_bytes(s: set) -> int:
+    return sys.getsizeof(s) + sum(sys.getsizeof(x) for x in s)
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--chats", type=int, default=10)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    ids = sorted(rnd.sample(range(10**8, 8 * 10**9), args.users))
+    opted = set(rnd.sample(ids, args.users // 20))
+    excluded = set(rnd.sample(ids, args.users // 100))
+
+    index = EligibilityIndex(_Repo(ids, opted, excluded))
+    t0 = time.perf_counter()
+    await index.warm_up()
+    t_load = time.perf_counter() - t0
+
+    for chat_id in range(args.chats):
+        await index.eligible_mask(-chat_id)
+    for uid in rnd.sample(ids, 1000):
+        index.set_present(0, uid, False)
+
+    t0 = time.perf_counter()
+    n = 0
+    async for page in index.eligible_pages(0):
+        n += len(page)
+    t_pages = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i in range(1000):
+        index.set_opted_out(ids[i * 7 % len(ids)], bool(i & 1))
+    t_upd = (time.perf_counter() - t0) / 1000
+
+    mem = index.memory_bytes()
+    sets = _set_bytes(set(ids) - opted) + _set_bytes(excluded)
+    print(f"users={args.users:,} chats={args.chats} eligible={n:,}")
+    print(f"memory: users table {mem['users'] / 1024:,.0f} KiB, "
+          f"chat bitsets {mem['chats'] / 1024:,.0f} KiB "
+          f"({mem['chats'] / args.chats / 1024:,.1f} KiB/chat)")
+    print(f"memory: same data as Python sets ~{sets / 1024:,.0f} KiB per callall")
+    print(f"warm-up {t_load * 1000:,.0f} ms, eligible pages {t_pages * 1000:,.1f} ms, "
+          f"opt-out update {t_upd * 1e6:,.1f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
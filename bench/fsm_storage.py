@@ -0,0 +1,71 @@
+# bench/fsm_storage.py
+"""
+Сравнение FSM-хранилищ: MemoryStorage vs SQLiteStorage.
+
+    python bench/fsm_storage.py [--keys 10000] [--rounds 3]
+
+Для каждого хранилища меряем set_state/set_data/get_state/get_data
+по --keys разным ключам и печатаем операций в секунду.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from utils.sqlite_storage import SQLiteStorage
+
+
+async def run(storage, keys: list[StorageKey]) -> dict[str, float]:
+    out: dict[str, float] = {}
+    ops = {
+        "set_state": lambda k: storage.set_state(k, "Form:step"),
+        "set_data": lambda k: storage.set_data(k, {"game": "codenames", "n": 10}),
+        "get_state": lambda k: storage.get_state(k),
+        "get_data": lambda k: storage.get_data(k),
+    }
+    for name, op in ops.items():
+        t0 = time.perf_counter()
+        for k in keys:
+            await op(k)
+        dt = time.perf_counter() - t0
+        out[name] = len(keys) / dt if dt else float("inf")
+    return out
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keys", type=int, default=10_000)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    keys = [
+        StorageKey(bot_id=1, chat_id=-100 - (i % 50), user_id=i)
+        for i in range(args.keys)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": MemoryStorage(),
+            "sqlite": SQLiteStorage(os.path.join(tmp, "fsm.sqlite3")),
+        }
+        for name, storage in backends.items():
+            best: dict[str, float] = {}
+            for _ in range(args.rounds):
+                for op, rate in (await run(storage, keys)).items():
+                    best[op] = max(best.get(op, 0.0), rate)
+            await storage.close()
+            line = "  ".join(f"{op}={rate:,.0f}/s" for op, rate in best.items())
+            print(f"{name:7s} {line}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
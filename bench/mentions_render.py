@@ -0,0 +1,128 @@
+# bench/mentions_render.py
+"""
+Рендер тегов «Позвать всех»: HTML (<a href="tg://user?id=...">, html.escape,
+parse_mode=HTML) против текста с готовыми сущностями (utils/entities.py).
+
+    python bench/mentions_render.py [--mentions 10000] [--per-batch 15] [--repeat 5]
+
+Оба пути идут через настоящие TaggingService._render_line / _render_entities
+со стенд-ином репозитория (без сети и БД). Печатает время рендера и сборки
+сообщений, число сообщений и суммарный размер JSON-тела sendMessage.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repo.supabase_repo import Preset
+from services.presets import PresetSnapshot
+from services.tagging import TaggingService
+from utils.entities import as_dicts, pack
+
+CHAT_ID = -1001234567890
+
+PHRASES = [
+    "Го в **Codenames**, шифруем по-взрослому!",
+    "Бункер ждёт: **спорим**, кто останется?",
+    "Рисуем в **Gartic** — кто угадает моего кота?",
+    "Мафия не спит, а ты? **Заходи**!",
+    "Двери открыты — **ищем выход** вместе 🚪",
+]
+NAMES = ["Аня", "Дима <3", "Лёша & Co", "🦊 Лиса", "Екатерина Великая", "Vasya", "Ω-mega"]
+
+
+class _Presets:
+    """Стенд-ин PresetStore: фразы отрендерены заранее, как в проде."""
+
+    def __init__(self, preset: Preset) -> None:
+        self.snapshot = PresetSnapshot.build("bench", [preset])
+
+
+class _Repo:
+    """Стенд-ин: профили пользователей и «последние фразы» в памяти."""
+
+    def __init__(self, n: int) -> None:
+        rnd = random.Random(1)
+        self.users = {}
+        for uid in range(1, n + 1):
+            if rnd.random() < 0.5:
+                self.users[uid] = {"username": f"user_{uid}"}
+            else:
+                self.users[uid] = {"first_name": rnd.choice(NAMES)}
+        self.settings = {}
+
+    def get_user_public(self, uid):
+        return self.users.get(uid)
+
+    def get_app_setting(self, key):
+        return self.settings.get(key)
+
+    def set_app_setting(self, key, value):
+        self.settings[key] = value
+
+
+def run_html(svc: TaggingService, preset: Preset, ids, per_batch: int):
+    deck = svc._new_deck(preset)
+    lines = [svc._render_line(preset, deck, i, uid) for i, uid in enumerate(ids)]
+    bodies = []
+    for k in range(0, len(lines), per_batch):
+        text = "\n".join(lines[k : k + per_batch])
+        chunks = svc._split_by_lines(text) if len(text) > 4096 else [text]
+        bodies += [{"chat_id": CHAT_ID, "text": t, "parse_mode": "HTML"} for t in chunks]
+    return bodies
+
+
+def run_entities(svc: TaggingService, preset: Preset, ids, per_batch: int):
+    deck = svc._new_deck(preset)
+    lines = [svc._render_entities(preset, deck, i, uid) for i, uid in enumerate(ids)]
+    bodies = []
+    for k in range(0, len(lines), per_batch):
+        for text, ents in pack(lines[k : k + per_batch]):
+            bodies.append({"chat_id": CHAT_ID, "text": text, "entities": as_dicts(ents)})
+    return bodies
+
+
+def measure(fn, repeat: int):
+    best = float("inf")
+    bodies = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        bodies = fn()
+        best = min(best, time.perf_counter() - t0)
+    payload = sum(len(json.dumps(b, ensure_ascii=False).encode()) for b in bodies)
+    return best, len(bodies), payload
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mentions", type=int, default=10_000)
+    ap.add_argument("--per-batch", type=int, default=15)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    repo = _Repo(args.mentions)
+    preset = Preset(game_key="bench", title="Bench", invite_lines=PHRASES)
+    svc = TaggingService(bot=None, repo=repo, presets=_Presets(preset))
+    ids = list(range(1, args.mentions + 1))
+
+    rows = [
+        ("html", lambda: run_html(svc, preset, ids, args.per_batch)),
+        ("entities", lambda: run_entities(svc, preset, ids, args.per_batch)),
+        # без per_batch: упаковка только по лимитам сообщения
+        ("html/max", lambda: run_html(svc, preset, ids, len(ids))),
+        ("entities/max", lambda: run_entities(svc, preset, ids, len(ids))),
+    ]
+    print(f"{args.mentions:,} mentions, per_batch={args.per_batch}")
+    for name, fn in rows:
+        dt, n, payload = measure(fn, args.repeat)
+        print(f"{name:13s}: {dt * 1000:8.1f} ms  {n:5d} messages  {payload / 1024:8.1f} KiB payload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# bench/replay_updates.py
+"""
+Прогон записанного трафика (RECORD_UPDATES, utils/recorder.py) через
+настоящий Dispatcher из main.build_dispatcher — с LocalRepo вместо Supabase
+и подставной сессией Bot API вместо Telegram.
+
+    python bench/replay_updates.py data/updates-20250101.jsonl.gz [...]
+        [--speed 1|10|max] [--concurrency 1] [--api-latency-ms 0]
+        [--real-limits] [--limit N] [--seed 1]
+
+--speed 1 — в темпе записи, 10 — вдесятеро быстрее (апдейты идут
+параллельно, как при polling), max — без пауз, не больше --concurrency
+апдейтов одновременно (по умолчанию 1: прогон детерминирован).
+При max паузы между тегами и общий бюджет Bot API снимаются, если не
+указан --real-limits: меряем хендлеры, а не лимиты Telegram.
+
+session_id в колбэках из записи подменяются на сессии, открытые в прогоне
+(по чату и игре). Печатает задержку обработки по классам апдейтов — в
+записи и в прогоне — и число вызовов Bot API по методам.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, ChatMemberOwner, Message, Update, User
+
+import main as app
+import seed_invites
+import services.batcher as batcher
+from config import Settings
+from repo.local_repo import LocalRepo
+from utils.recorder import read_records
+
+BOT_TOKEN = "42:REPLAY"
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API без сети: отвечает правдоподобными объектами и считает
+    вызовы по методам. Все участники — владельцы чата: проверки прав и
+    присутствия проходят, как у ведущего в проде.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "GetMe":
+            return User(**BOT_USER)
+        if name == "GetChatMember":
+            user = User(id=method.user_id, is_bot=False, first_name=str(method.user_id))
+            return ChatMemberOwner(user=user, is_anonymous=False)
+        if name.startswith(("Send", "Edit")) and getattr(method, "chat_id", None) is not None:
+            return Message.model_validate(
+                {
+                    "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": Chat(id=method.chat_id, type="supergroup"),
+                    "from": BOT_USER,
+                    "text": getattr(method, "text", None),
+                },
+                context={"bot": bot},
+            )
+        return True
+
+
+class Replayer:
+    def __init__(self, dp, bot: Bot, repo: LocalRepo) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.repo = repo
+        self.sessions: Dict[str, str] = {}  # session_id из записи -> из прогона
+        self.recorded: Dict[str, List[float]] = defaultdict(list)
+        self.replayed: Dict[str, List[float]] = defaultdict(list)
+        self.errors = 0
+
+    def _remap(self, raw: Dict[str, Any]) -> None:
+        """Подменяет session_id записи в callback_data на сессию прогона."""
+        cq = raw.get("callback_query")
+        if not cq or not cq.get("data"):
+            return
+        m = _UUID.search(cq["data"])
+        chat = (cq.get("message") or {}).get("chat", {}).get("id")
+        if m is None or chat is None:
+            return
+        recorded = m.group(0)
+        local = self.sessions.get(recorded)
+        if local is None:
+            parts = cq["data"].split(":")
+            game = parts[2] if parts[0] == "callall" and len(parts) > 2 else None
+            s = self.repo.get_active_session(chat, game) if game else self.repo.get_latest_active_session(chat)
+            if s is None:
+                return
+            local = self.sessions[recorded] = s["session_id"]
+        cq["data"] = cq["data"].replace(recorded, local)
+
+    async def feed(self, rec: Dict[str, Any]) -> None:
+        kind = rec.get("kind", "other")
+        self.recorded[kind].append(rec.get("ms", 0.0))
+        raw = rec["update"]
+        self._remap(raw)
+        update = Update.model_validate(raw, context={"bot": self.bot})
+        t0 = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.debug("update %s failed: %r", raw.get("update_id"), e)
+        self.replayed[kind].append((time.perf_counter() - t0) * 1000)
+
+    async def run(self, records, speed: Optional[float], concurrency: int) -> float:
+        tasks: List[asyncio.Task] = []
+        sem = asyncio.Semaphore(concurrency)
+        t_start = time.perf_counter()
+        ts0: Optional[float] = None
+
+        async def limited(rec):
+            try:
+                await self.feed(rec)
+            finally:
+                sem.release()
+
+        for rec in records:
+            if speed is None:
+                await sem.acquire()
+                tasks.append(asyncio.create_task(limited(rec)))
+                continue
+            if ts0 is None:
+                ts0 = rec["ts"]
+            delay = (rec["ts"] - ts0) / speed - (time.perf_counter() - t_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.feed(rec)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - t_start
+
+
+def _pct(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+
+async def amain(args) -> None:
+    random.seed(args.seed)
+    speed = None if args.speed == "max" else float(args.speed)
+    unlimited = speed is None and not args.real_limits
+
+    settings = Settings.from_env().model_copy(
+        update={
+            "bot_token": BOT_TOKEN,
+            "fsm_storage": "memory",
+            "record_updates": "",
+            "loop_lag_ms": 0,
+            "session_lifetime": 0,
+            **({"tag_send_rate": 1e9} if unlimited else {}),
+        }
+    )
+    if unlimited:
+        batcher.PAUSE_MIN = batcher.PAUSE_START = 0.0
+
+    presets = seed_invites.generate_all(list(seed_invites.GAMES), 100, seed_invites.DEFAULT_SEED, 1)
+    repo = LocalRepo(presets.values())
+    session = FakeSession(args.api_latency_ms / 1000)
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    dp, deps = app.build_dispatcher(settings, bot, repo)
+    await app.load_state(deps)
+    await deps["presets"].reload(force=True)
+    background = app.start_background(settings, deps)
+
+    records = read_records(args.files)
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+
+    rp = Replayer(dp, bot, repo)
+    try:
+        wall = await rp.run(records, speed, args.concurrency)
+        if deps["callback_queue"] is not None:
+            await deps["callback_queue"].drain()
+        await deps["tag_scheduler"].drain()
+    finally:
+        for t in background:
+            t.cancel()
+
+    total = sum(len(v) for v in rp.replayed.values())
+    print(f"{total} updates in {wall:.2f}s ({total / max(wall, 1e-9):.0f}/s), speed={args.speed}, errors={rp.errors}")
+    print(f"{'kind':10s} {'n':>6s}  {'rec p50':>8s} {'rec p99':>8s}  {'run p50':>8s} {'run p99':>8s}  (ms)")
+    for kind in sorted(rp.replayed):
+        rec, run = rp.recorded[kind], rp.replayed[kind]
+        print(
+            f"{kind:10s} {len(run):6d}  {_pct(rec, .5):8.1f} {_pct(rec, .99):8.1f}  "
+            f"{_pct(run, .5):8.1f} {_pct(run, .99):8.1f}"
+        )
+    print("Bot API calls: " + ", ".join(f"{k}={v}" for k, v in session.calls.most_common()))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--speed", default="1", help="1, N (кратно быстрее записи) или max")
+    ap.add_argument("--concurrency", type=int, default=1, help="апдейтов одновременно при --speed max")
+    ap.add_argument("--api-latency-ms", type=float, default=0.0)
+    ap.add_argument("--real-limits", action="store_true", help="при max не снимать паузы и бюджет Bot API")
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
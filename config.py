@@ -5,6 +5,33 @@ class Settings(BaseModel):
     bot_token: str
     supabase_url: str
     supabase_service_key: str
+    # FSM-хранилище: "sqlite" (файл, переживает рестарт, общий для процессов)
+    # или "memory" — прежнее поведение, состояние теряется при рестарте
+    fsm_storage: str = "sqlite"
+    fsm_db_path: str = "data/fsm.sqlite3"
+    fsm_ttl: int = 24 * 3600
+    # обычные сообщения в группах — мимо роутеров (utils/prefilter.py)
+    prefilter: bool = True
+    # открытая сессия закрывается сама через столько секунд (0 — никогда)
+    session_lifetime: int = 6 * 3600
+    # нажатия в шапке: "async" — ответ сразу, применение в очереди сессии;
+    # "sync" — как раньше, ответ после записи в БД и перерисовки
+    callback_mode: str = "async"
+    # теги «Позвать всех»: "html" или "entities" (текст + MessageEntity, без HTML)
+    tag_render: str = "html"
+    # общий пул «Позвать всех»: воркеров и запросов к Bot API в секунду на все чаты
+    tag_workers: int = 8
+    tag_send_rate: float = 20.0
+    # тегнутых за последние ping_window сек: "defer" — звать в конце созыва,
+    # "skip" — не звать, "off" — не учитывать
+    ping_window: int = 3600
+    ping_policy: str = "defer"
+    # блокировка event loop'а дольше стольких мс — WARNING со стеком (0 — сторож выключен)
+    loop_lag_ms: int = 100
+    # Telegram user_id владельцев бота (через запятую) — им доступен /profile
+    owner_ids: list[int] = []
+    # запись входящих апдейтов (gzip JSONL, strftime-шаблон пути); "" — не писать
+    record_updates: str = ""
 
     @classmethod
     def from_env(cls) -> "Settings":
@@ -12,6 +39,20 @@ class Settings(BaseModel):
             bot_token=os.getenv("BOT_TOKEN", ""),
             supabase_url=os.getenv("SUPABASE_URL", ""),
             supabase_service_key=os.getenv("SUPABASE_SERVICE_KEY", ""),
+            fsm_storage=os.getenv("FSM_STORAGE", "sqlite").lower(),
+            fsm_db_path=os.getenv("FSM_DB_PATH", "data/fsm.sqlite3"),
+            fsm_ttl=int(os.getenv("FSM_TTL", str(24 * 3600))),
+            prefilter=os.getenv("PREFILTER", "1") not in {"0", "false", "no"},
+            session_lifetime=int(os.getenv("SESSION_LIFETIME", str(6 * 3600))),
+            callback_mode=os.getenv("CALLBACK_MODE", "async").lower(),
+            tag_render=os.getenv("TAG_RENDER", "html").lower(),
+            tag_workers=int(os.getenv("TAG_WORKERS", "8")),
+            tag_send_rate=float(os.getenv("TAG_SEND_RATE", "20")),
+            ping_window=int(os.getenv("PING_WINDOW", "3600")),
+            ping_policy=os.getenv("PING_POLICY", "defer").lower(),
+            loop_lag_ms=int(os.getenv("LOOP_LAG_MS", "100")),
+            owner_ids=[int(x) for x in os.getenv("BOT_OWNER_IDS", "").replace(" ", "").split(",") if x],
+            record_updates=os.getenv("RECORD_UPDATES", ""),
         )
 
 settings = Settings.from_env()
\ No newline at end of file
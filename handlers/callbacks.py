@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+import html
+from typing import Awaitable, Callable, Optional, Tuple
+
 from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.exceptions import TelegramBadRequest
@@ -7,9 +11,9 @@ from aiogram.exceptions import TelegramBadRequest
 # --- УСТОЙЧИВЫЕ ИМПОРТЫ ---
 # Пытаемся сначала из корня проекта, затем из пакета repo/
 try:
-    from supabase_repo import SupabaseRepo  # если supabase_repo.py лежит в корне
+    from supabase_repo import SupabaseRepo, Preset  # если supabase_repo.py лежит в корне
 except ModuleNotFoundError:
-    from repo.supabase_repo import SupabaseRepo  # если файл в repo/supabase_repo.py
+    from repo.supabase_repo import SupabaseRepo, Preset  # если файл в repo/supabase_repo.py
 
 # Точно так же с сервисами
 try:
@@ -21,6 +25,26 @@ try:
     from tagging import TaggingService
 except ModuleNotFoundError:
     from services.tagging import TaggingService
+
+try:
+    from cooldowns import CooldownService
+except ModuleNotFoundError:
+    from services.cooldowns import CooldownService
+
+try:
+    from presets import PresetStore
+except ModuleNotFoundError:
+    from services.presets import PresetStore
+
+try:
+    from callback_queue import SessionQueue
+except ModuleNotFoundError:
+    from services.callback_queue import SessionQueue
+
+try:
+    from tag_scheduler import TagScheduler
+except ModuleNotFoundError:
+    from services.tag_scheduler import TagScheduler
 # --------------------------
 
 router = Router()
@@ -30,7 +54,7 @@ router = Router()
 async def is_admin_or_leader(bot, repo: SupabaseRepo, chat_id: int, user_id: int) -> bool:
     # сначала — «ведущий» из базы
     try:
-        if repo.is_leader(chat_id, user_id):
+        if await asyncio.to_thread(repo.is_leader, chat_id, user_id):
             return True
     except Exception:
         pass
@@ -44,6 +68,72 @@ async def is_admin_or_leader(bot, repo: SupabaseRepo, chat_id: int, user_id: int
         return False
 
 
+# =========================
+# Применение нажатий: сразу или через очередь сессии
+# =========================
+class CallbackError(Exception):
+    """Нажатие не применилось; текст показываем пользователю."""
+
+
+async def _report(call: CallbackQuery, text: str) -> None:
+    """Колбэк уже отвечен — сообщаем об ошибке ответом на шапку."""
+    if not call.message or not call.from_user:
+        return
+    user = call.from_user
+    mention = f'<a href="tg://user?id={user.id}">{html.escape(user.first_name or "игрок")}</a>'
+    try:
+        await call.message.reply(f"{mention}, {html.escape(text)}", parse_mode="HTML")
+    except Exception:
+        pass
+
+
+async def _apply_or_queue(
+    call: CallbackQuery,
+    callback_queue: Optional[SessionQueue],
+    session_id: str,
+    apply: Callable[[], Awaitable[None]],
+    ack: Optional[str] = None,
+) -> None:
+    """
+    Без очереди (CALLBACK_MODE=sync) — применяем сразу и отвечаем по результату.
+    С очередью — отвечаем сразу, изменение применит воркер сессии,
+    ошибку сообщим ответом на шапку.
+    """
+    if callback_queue is None:
+        try:
+            await apply()
+        except CallbackError as e:
+            await call.answer(str(e), show_alert=True)
+            return
+        await call.answer(ack)
+        return
+
+    async def on_error(e: BaseException) -> None:
+        text = str(e) if isinstance(e, CallbackError) else "Не удалось применить нажатие, попробуйте ещё раз."
+        await _report(call, text)
+
+    if not callback_queue.submit(session_id, apply, on_error):
+        await call.answer("Слишком много нажатий, попробуйте через пару секунд.", show_alert=True)
+        return
+    await call.answer(ack)
+
+
+async def _require_admin(call: CallbackQuery, repo: SupabaseRepo, chat_id: int) -> None:
+    """Проверка прав внутри apply: колбэк к этому моменту может быть уже отвечен."""
+    if not await is_admin_or_leader(call.message.bot, repo, chat_id, call.from_user.id):
+        raise CallbackError("Нет прав.")
+
+
+async def _load_session(repo: SupabaseRepo, presets: PresetStore, session_id: str) -> Tuple[dict, Preset]:
+    session = await asyncio.to_thread(repo.get_session, session_id)
+    if not session:
+        raise CallbackError("Сессия не найдена.")
+    preset = presets.get(session["game_key"])
+    if not preset:
+        raise CallbackError("Пресет не найден.")
+    return session, preset
+
+
 # =========================
 # RSVP
 # =========================
@@ -52,6 +142,9 @@ async def cb_rsvp(
     call: CallbackQuery,
     repo: SupabaseRepo,
     session_service: SessionService,
+    cooldowns: CooldownService,
+    presets: PresetStore,
+    callback_queue: Optional[SessionQueue] = None,
 ):
     """
     Формат callback_data: rsvp:<status>:<session_id>
@@ -73,44 +166,49 @@ async def cb_rsvp(
         await call.answer()
         return
 
-    # пишем RSVP
-    try:
-        repo.upsert_rsvp(session_id, user.id, status)
-    except Exception:
-        await call.answer("Не удалось сохранить ответ, попробуйте ещё раз.", show_alert=True)
-        return
+    chat_id = call.message.chat.id if call.message else None
 
-    # «Не сегодня» — ставим кулдаун 6ч
-    if status == "no" and call.message and call.message.chat:
-        try:
-            repo.set_no_cooldown(
-                chat_id=call.message.chat.id,
-                user_id=user.id,
-                hours=6,
-                reason="no",
-            )
-        except Exception:
-            pass  # не критично
+    def is_repeat() -> bool:
+        # «Не сегодня» повторяем, если кулдаун успел истечь — его надо продлить
+        if status == "no" and chat_id is not None and not cooldowns.is_active(chat_id, user.id):
+            return False
+        return session_service.is_repeat_vote(session_id, user.id, status)
 
-    # обновляем сводку под шапкой сессии
-    if not call.message:
+    # двойное нажатие той же кнопки — ничего не пишем и не перерисовываем
+    if is_repeat():
         await call.answer("Принято")
         return
 
-    session = repo.get_session(session_id)
-    if not session:
-        await call.answer("Сессия не найдена.", show_alert=True)
-        return
-
-    preset = repo.get_preset(session["game_key"])
-    if not preset:
-        await call.answer("Пресет не найден.", show_alert=True)
-        return
+    async def apply() -> None:
+        if is_repeat():  # такой же голос мог уйти в очередь раньше
+            return
+        # голос + кулдаун «Не сегодня» (6ч) + свежая сводка — один запрос к БД
+        try:
+            board = await asyncio.to_thread(
+                repo.vote_rsvp, session_id, user.id, status, 6 if status == "no" else 0
+            )
+        except Exception:
+            raise CallbackError("Не удалось сохранить ответ, попробуйте ещё раз.")
+        if not board:
+            raise CallbackError("Сессия не найдена.")
+
+        session = board["session"]
+        session_service.changed(session_id)
+        session_service.remember_votes(session_id, board["rsvp"])
+        if board.get("cooldown_until"):
+            cooldowns.remember(session["chat_id"], user.id, board["cooldown_until"].timestamp())
+
+        # обновляем сводку под шапкой сессии
+        if chat_id is None:
+            return
+        preset = presets.get(session["game_key"])
+        if not preset:
+            raise CallbackError("Пресет не найден.")
+        await session_service.post_or_get_session_message(
+            chat_id, preset, session, rsvp=board["rsvp"]
+        )
 
-    await session_service.post_or_get_session_message(
-        call.message.chat.id, preset, session
-    )
-    await call.answer("Принято")
+    await _apply_or_queue(call, callback_queue, session_id, apply, ack="Принято")
 
 
 # =========================
@@ -121,6 +219,8 @@ async def cb_change_target(
     call: CallbackQuery,
     repo: SupabaseRepo,
     session_service: SessionService,
+    presets: PresetStore,
+    callback_queue: Optional[SessionQueue] = None,
 ):
     """
     Включаем «режим выбора» чисел (редактируем клавиатуру в шапке).
@@ -135,26 +235,17 @@ async def cb_change_target(
         await call.answer()
         return
 
-    # права
-    if not await is_admin_or_leader(call.message.bot, repo, call.message.chat.id, call.from_user.id):
-        await call.answer("Нет прав.", show_alert=True)
-        return
-
-    session = repo.get_session(session_id)
-    if not session:
-        await call.answer("Сессия не найдена.", show_alert=True)
-        return
+    chat_id = call.message.chat.id
 
-    preset = repo.get_preset(session["game_key"])
-    if not preset:
-        await call.answer("Пресет не найден.", show_alert=True)
-        return
+    async def apply() -> None:
+        await _require_admin(call, repo, chat_id)
+        session, preset = await _load_session(repo, presets, session_id)
+        # включаем режим выбора чисел
+        await session_service.post_or_get_session_message(
+            chat_id, preset, session, show_target_picker=True
+        )
 
-    # включаем режим выбора чисел
-    await session_service.post_or_get_session_message(
-        call.message.chat.id, preset, session, show_target_picker=True
-    )
-    await call.answer()
+    await _apply_or_queue(call, callback_queue, session_id, apply)
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith("set_target:"))
@@ -162,6 +253,8 @@ async def cb_set_target(
     call: CallbackQuery,
     repo: SupabaseRepo,
     session_service: SessionService,
+    presets: PresetStore,
+    callback_queue: Optional[SessionQueue] = None,
 ):
     """
     Сохраняем новую цель и «тихо» перерисовываем шапку без доп. сообщений.
@@ -178,33 +271,23 @@ async def cb_set_target(
         await call.answer()
         return
 
-    # права
-    if not await is_admin_or_leader(call.message.bot, repo, call.message.chat.id, call.from_user.id):
-        await call.answer("Нет прав.", show_alert=True)
-        return
-
-    session = repo.get_session(session_id)
-    if not session:
-        await call.answer("Сессия не найдена.", show_alert=True)
-        return
-
-    preset = repo.get_preset(session["game_key"])
-    if not preset:
-        await call.answer("Пресет не найден.", show_alert=True)
-        return
+    chat_id = call.message.chat.id
 
-    # обновляем цель в БД и перерисовываем «шапку»
-    try:
-        repo.set_session_target(session_id, target)
-        session["target_count"] = target
-        await session_service.post_or_get_session_message(
-            call.message.chat.id, preset, session, show_target_picker=False
-        )
-    except Exception:
-        await call.answer("Не удалось обновить количество.", show_alert=True)
-        return
+    async def apply() -> None:
+        await _require_admin(call, repo, chat_id)
+        session, preset = await _load_session(repo, presets, session_id)
+        # обновляем цель в БД и перерисовываем «шапку»
+        try:
+            await asyncio.to_thread(repo.set_session_target, session_id, target)
+            session["target_count"] = target
+            session_service.changed(session_id)
+            await session_service.post_or_get_session_message(
+                chat_id, preset, session, show_target_picker=False
+            )
+        except Exception:
+            raise CallbackError("Не удалось обновить количество.")
 
-    await call.answer()  # тихо
+    await _apply_or_queue(call, callback_queue, session_id, apply)  # тихо
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith("target_back:"))
@@ -212,6 +295,8 @@ async def cb_target_back(
     call: CallbackQuery,
     repo: SupabaseRepo,
     session_service: SessionService,
+    presets: PresetStore,
+    callback_queue: Optional[SessionQueue] = None,
 ):
     """
     Выходим из режима выбора чисел — возвращаем обычные кнопки.
@@ -226,20 +311,55 @@ async def cb_target_back(
         await call.answer()
         return
 
-    session = repo.get_session(session_id)
-    if not session:
+    chat_id = call.message.chat.id
+
+    async def apply() -> None:
+        try:
+            session, preset = await _load_session(repo, presets, session_id)
+        except CallbackError:
+            return  # шапку трогать нечем — молча
+        await session_service.post_or_get_session_message(
+            chat_id, preset, session, show_target_picker=False
+        )
+
+    await _apply_or_queue(call, callback_queue, session_id, apply)
+
+
+# =========================
+# «Весь список» — постранично в той же шапке
+# =========================
+@router.callback_query(lambda c: c.data and c.data.startswith("rsvp_page:"))
+async def cb_rsvp_page(
+    call: CallbackQuery,
+    repo: SupabaseRepo,
+    session_service: SessionService,
+    presets: PresetStore,
+    callback_queue: Optional[SessionQueue] = None,
+):
+    """
+    Формат: rsvp_page:<session_id>:<page>
+    Назад к сводке — обычная кнопка target_back.
+    """
+    try:
+        _, session_id, n = call.data.split(":", 2)
+        page = int(n)
+    except Exception:
         await call.answer()
         return
 
-    preset = repo.get_preset(session["game_key"])
-    if not preset:
+    if not call.message:
         await call.answer()
         return
 
-    await session_service.post_or_get_session_message(
-        call.message.chat.id, preset, session, show_target_picker=False
-    )
-    await call.answer()
+    chat_id = call.message.chat.id
+
+    async def apply() -> None:
+        session, preset = await _load_session(repo, presets, session_id)
+        await session_service.post_or_get_session_message(
+            chat_id, preset, session, detail_page=page
+        )
+
+    await _apply_or_queue(call, callback_queue, session_id, apply)
 
 
 # =========================
@@ -250,9 +370,12 @@ async def cb_call_all(
     call: CallbackQuery,
     repo: SupabaseRepo,
     tagging: TaggingService,
+    presets: PresetStore,
+    tag_scheduler: TagScheduler,
 ):
     """
     Формат callback_data: callall:<session_id>:<game_key>
+    Сам созыв уходит в пул TagScheduler — хендлер его не ждёт.
     """
     # разбор данных
     try:
@@ -276,12 +399,15 @@ async def cb_call_all(
         return
 
     # проверяем пресет и актуальную сессию
-    preset = repo.get_preset(game_key)
+    preset = presets.get(game_key)
     if not preset:
         await call.answer("Пресет не найден.", show_alert=True)
         return
 
-    session = repo.get_active_session(chat_id, game_key)
+    try:
+        session = await asyncio.to_thread(repo.get_active_session, chat_id, game_key)
+    except Exception:
+        session = None
     if not session:
         await call.answer("Сессия закрыта или отсутствует.", show_alert=True)
         return
@@ -291,22 +417,31 @@ async def cb_call_all(
         await call.answer("Это устаревшее сообщение набора. Откройте актуальное.", show_alert=True)
         return
 
-    # кандидаты к упоминанию (с учётом optout/исключений/кулдауна)
+    # кандидаты к упоминанию (с учётом optout/исключений/кулдауна) — потоком страниц;
+    # первую страницу ждём здесь, чтобы сообщить об ошибке/пустом списке
+    pages = tagging.invitee_pages(chat_id)
     try:
-        invitees = repo.list_invitees(chat_id)
+        first_page = await pages.__anext__()
+    except StopAsyncIteration:
+        first_page = []
     except Exception:
         await call.answer("Ошибка загрузки списка участников.", show_alert=True)
         return
 
-    if not invitees:
+    if not first_page:
         await call.answer("Нет подходящих участников.", show_alert=True)
         return
 
+    async def invitees():
+        yield first_page
+        async for page in pages:
+            yield page
+
+    async def job() -> None:
+        await tagging.batch_tag(chat_id, preset, invitees(), session_id=session_id)
+
+    if not tag_scheduler.submit_batch(job):
+        await pages.aclose()
+        await call.answer("Сейчас идёт слишком много созывов, попробуйте чуть позже.", show_alert=True)
+        return
     await call.answer("Зову всех…")
-    try:
-        await tagging.batch_tag(
-            chat_id, preset, invitees, per_batch=15, pause=1.5, session_id=session_id
-        )
-    except Exception:
-        # не роняем колбэк при сетевых/лимитных ошибках
-        pass
@@ -1,8 +1,14 @@
 from __future__ import annotations
 
-from aiogram import Router, Bot
+import asyncio
+import html
+import time
+from typing import FrozenSet, Optional
+
+from aiogram import Router, Bot, F
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.filters import Command, CommandObject
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # --- устойчивые импорты: корень проекта или подпапки repo/ и services/ ---
@@ -15,6 +21,19 @@ try:
     from sessions import SessionService
 except ModuleNotFoundError:
     from services.sessions import SessionService
+
+try:
+    from eligibility import EligibilityIndex
+except ModuleNotFoundError:
+    from services.eligibility import EligibilityIndex
+
+try:
+    from presets import PresetStore
+except ModuleNotFoundError:
+    from services.presets import PresetStore
+
+from utils.loop_watchdog import LoopWatchdog
+from utils.profiler import MAX_SECONDS, SamplingProfiler
 # -------------------------------------------------------------------------
 
 router = Router()
@@ -23,7 +42,7 @@ router = Router()
 async def is_admin_or_leader(bot: Bot, repo: SupabaseRepo, chat_id: int, user_id: int) -> bool:
     # «Ведущий» из базы
     try:
-        if repo.is_leader(chat_id, user_id):
+        if await asyncio.to_thread(repo.is_leader, chat_id, user_id):
             return True
     except Exception:
         pass
@@ -42,42 +61,47 @@ TARGET_BY_GAME = {"doors": 6}  # Doors хотим 6 человек
 def target_for(game_key: str) -> int:
     return TARGET_BY_GAME.get(game_key, DEFAULT_TARGET)
 
+# Префикс команд-алиасов /call_<game_key>
+CALL_PREFIX = "/call_"
+
 
 # =========================
 # БАЗОВЫЕ КОМАНДЫ
 # =========================
 @router.message(Command("start"))
-async def cmd_start(message: Message, repo: SupabaseRepo):
+async def cmd_start(message: Message, repo: SupabaseRepo, presets: PresetStore):
     u = message.from_user
     if not u:
         return
     repo.upsert_user(u.id, u.username, u.first_name, u.last_name)
+    calls = ", ".join(f"{CALL_PREFIX}{p.game_key}" for p in presets.list_active())
     await message.reply(
         "Привет! Я помогаю тегать участников на быстрые игры.\n\n"
         "• /games — список игр\n"
         "• /call &lt;игра&gt; — начать набор (пример: /call_codenames)\n"
         "• /optout — не упоминать меня\n"
         "• /optin — снова упоминать\n\n"
-        "Также доступны команды: /call_codenames, /call_bunker, /call_alias, "
-        "/call_gartic, /call_mafia, /call_doors."
+        + (f"Также доступны команды: {calls}." if calls else "")
     )
 
 
 @router.message(Command("optout"))
-async def cmd_optout(message: Message, repo: SupabaseRepo):
+async def cmd_optout(message: Message, repo: SupabaseRepo, eligibility: EligibilityIndex):
     u = message.from_user
     if not u:
         return
     repo.set_optout(u.id, True)
+    eligibility.set_opted_out(u.id, True)
     await message.reply("Готово. Больше не буду вас упоминать в наборах.")
 
 
 @router.message(Command("optin"))
-async def cmd_optin(message: Message, repo: SupabaseRepo):
+async def cmd_optin(message: Message, repo: SupabaseRepo, eligibility: EligibilityIndex):
     u = message.from_user
     if not u:
         return
     repo.set_optout(u.id, False)
+    eligibility.set_opted_out(u.id, False)
     await message.reply("Вернул вас в список для упоминаний.")
 
 
@@ -85,14 +109,14 @@ async def cmd_optin(message: Message, repo: SupabaseRepo):
 # СПИСОК ИГР
 # =========================
 @router.message(Command("games"))
-async def cmd_games(message: Message, repo: SupabaseRepo):
-    presets = repo.list_active_presets()
-    if not presets:
+async def cmd_games(message: Message, presets: PresetStore):
+    items = presets.list_active()
+    if not items:
         await message.reply("Список игр пуст.")
         return
 
     lines = ["Доступные игры:"]
-    for p in presets:
+    for p in items:
         lines.append(f"• <b>{p.title}</b>  (<code>{p.game_key}</code>)")
     lines.append("")
     lines.append("Запуск набора: <code>/call &lt;игра&gt;</code>")
@@ -108,6 +132,7 @@ async def cmd_call(
     message: Message,
     repo: SupabaseRepo,
     session_service: SessionService,
+    presets: PresetStore,
     command: CommandObject,
 ):
     if not message.chat or message.chat.type not in {"group", "supergroup"}:
@@ -129,61 +154,43 @@ async def cmd_call(
         await message.reply("Укажи игру: /call codenames | bunker | alias | gartic | mafia | doors")
         return
 
-    preset = _find_preset(repo, query)
+    found = presets.search(query)
+    preset = found.preset
     if not preset:
-        await message.reply("Игра не найдена. Смотри список: /games")
+        hint = ""
+        if found.suggestions:
+            hint = "Возможно: " + ", ".join(
+                f"/call {p.game_key} ({p.title})" for p in found.suggestions
+            ) + "\n"
+        await message.reply(f"Игра не найдена. {hint}Смотри список: /games")
         return
 
-    # закрываем старую активную сессию, чтобы не копилось
-    old = repo.get_active_session(chat_id, preset.game_key)
-    if old:
-        try:
-            repo.close_session(old["session_id"])
-        except Exception:
-            pass
-
-    # создаём новую
-    session = repo.create_session(
-        chat_id, preset.game_key, u.id, target_count=target_for(preset.game_key)
-    )
-
-    # публикуем шапку RSVP и кнопку "Позвать всех"
-    await session_service.post_or_get_session_message(chat_id, preset, session)
-
-    kb = InlineKeyboardBuilder()
-    kb.button(
-        text=f"Позвать всех на {preset.title}",
-        callback_data=f"callall:{session['session_id']}:{preset.game_key}",
-    )
-    await message.answer("Управление набором:", reply_markup=kb.as_markup())
+    await _open_session(message, preset, u.id, repo, session_service)
 
 
 # =========================
-# Алиасы /call_<game>
+# /call_<game> — один хендлер на все игры
 # =========================
-@router.message(Command("call_codenames"))
-async def call_codenames(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("codenames", message, repo, session_service)
-
-@router.message(Command("call_bunker"))
-async def call_bunker(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("bunker", message, repo, session_service)
-
-@router.message(Command("call_alias"))
-async def call_alias(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("alias", message, repo, session_service)
-
-@router.message(Command("call_gartic"))
-async def call_gartic(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("gartic", message, repo, session_service)
-
-@router.message(Command("call_mafia"))
-async def call_mafia(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("mafia", message, repo, session_service)
-
-@router.message(Command("call_doors"))
-async def call_doors(message: Message, repo: SupabaseRepo, session_service: SessionService):
-    await _call_by_key("doors", message, repo, session_service)
+@router.message(F.text.startswith(CALL_PREFIX))
+async def call_by_command(
+    message: Message, repo: SupabaseRepo, session_service: SessionService, presets: PresetStore
+):
+    """
+    Вместо отдельного Command-фильтра на каждую игру — одна проверка префикса
+    и поиск game_key в словаре активных пресетов. Новые игры из gt_game_presets
+    работают без правок кода, стоимость фильтра не зависит от числа игр.
+    """
+    command = message.text.split(maxsplit=1)[0][len(CALL_PREFIX):]
+    game_key, _, mention = command.partition("@")
+    if mention:
+        me = await message.bot.me()
+        if mention.lower() != (me.username or "").lower():
+            raise SkipHandler()  # команда другому боту
+    preset = presets.get(game_key.lower())
+    if not preset:
+        # неизвестная /call_* — не наша команда: без запросов к БД и Bot API
+        raise SkipHandler()
+    await _call_preset(preset, message, repo, session_service)
 
 
 # =========================
@@ -293,22 +300,80 @@ async def cmd_unlead(message: Message, repo: SupabaseRepo):
 
 
 # =========================
-# ВСПОМОГАТЕЛЬНЫЕ
+# ПРЕСЕТЫ: перезагрузка без рестарта
 # =========================
-def _find_preset(repo: SupabaseRepo, query: str) -> Preset | None:
-    q = query.lower().strip()
-    p = repo.get_preset(q)
-    if p:
-        return p
-    for item in repo.list_active_presets():
-        title = (item.title or "").lower()
-        if title == q or q in title:
-            return item
-    return None
+@router.message(Command("reload_presets"))
+async def cmd_reload_presets(message: Message, repo: SupabaseRepo, presets: PresetStore):
+    if not message.chat or message.chat.type not in {"group", "supergroup"}:
+        await message.reply("Эта команда работает только в группах.")
+        return
 
+    bot: Bot = message.bot
+    if not await is_admin_or_leader(bot, repo, message.chat.id, message.from_user.id):
+        await message.reply("⛔ Эту команду могут использовать только админы или ведущие.")
+        return
 
-async def _call_by_key(
-    game_key: str, message: Message, repo: SupabaseRepo, session_service: SessionService
+    try:
+        await presets.reload(force=True)
+    except Exception:
+        await message.reply("Не удалось перечитать пресеты.")
+        return
+    await message.reply(f"Пресеты обновлены: {len(presets.snapshot.presets)} игр.")
+
+
+# =========================
+# ДИАГНОСТИКА: профиль живого процесса (только владельцы бота)
+# =========================
+@router.message(Command("profile"))
+async def cmd_profile(
+    message: Message,
+    command: CommandObject,
+    profiler: SamplingProfiler,
+    owner_ids: FrozenSet[int],
+    watchdog: Optional[LoopWatchdog] = None,
+):
+    """
+    /profile [секунды] — сэмплирующий профиль (потоки + asyncio-задачи).
+    Присылает collapsed-стеки файлом (flamegraph.pl, speedscope) и сводку;
+    если включён LOOP_LAG_MS — в начале сводки лаг loop'а и места блокировок.
+    """
+    if not message.from_user or message.from_user.id not in owner_ids:
+        return  # для остальных команды нет
+
+    try:
+        seconds = int((command.args or "10").strip())
+    except ValueError:
+        await message.reply(f"Формат: /profile &lt;секунды&gt; (1–{MAX_SECONDS}).")
+        return
+    seconds = max(1, min(seconds, MAX_SECONDS))
+
+    if profiler.busy:
+        await message.reply("Профиль уже снимается, подождите.")
+        return
+    await message.reply(f"🔬 Снимаю профиль {seconds} с…")
+
+    prof = await profiler.profile(seconds)
+    summary = prof.summary()
+    if watchdog is not None:
+        summary = watchdog.summary() + "\n\n" + summary
+    if len(summary) > 3800:
+        summary = summary[:3800] + "\n…"
+    name = time.strftime("profile-%Y%m%d-%H%M%S.folded")
+    await message.answer_document(
+        BufferedInputFile(prof.collapsed().encode(), filename=name),
+        caption=f"Профиль {seconds} с — collapsed stacks",
+    )
+    await message.answer(f"<pre>{html.escape(summary)}</pre>")
+
+
+# =========================
+# ВСПОМОГАТЕЛЬНЫЕ
+# =========================
+async def _call_preset(
+    preset: Preset,
+    message: Message,
+    repo: SupabaseRepo,
+    session_service: SessionService,
 ):
     if not message.chat or message.chat.type not in {"group", "supergroup"}:
         await message.reply("Эта команда работает только в группах.")
@@ -319,30 +384,32 @@ async def _call_by_key(
         await message.reply("⛔ Эту команду могут использовать только админы или ведущие.")
         return
 
-    preset = repo.get_preset(game_key)
-    if not preset:
-        await message.reply("Пресет не найден или отключён.")
-        return
+    await _open_session(message, preset, message.from_user.id, repo, session_service)
 
-    # закрываем старую активную сессию
-    old = repo.get_active_session(message.chat.id, game_key)
-    if old:
-        try:
-            repo.close_session(old["session_id"])
-        except Exception:
-            pass
-
-    # создаём новую
-    session = repo.create_session(
-        message.chat.id, game_key, message.from_user.id, target_count=target_for(game_key)
+
+async def _open_session(
+    message: Message,
+    preset: Preset,
+    started_by: int,
+    repo: SupabaseRepo,
+    session_service: SessionService,
+):
+    """
+    Новая сессия набора + шапка RSVP + кнопка «Позвать всех».
+    Старая открытая сессия этой игры закрывается в той же транзакции
+    (gt_open_session), так что два ведущих не откроют дубли.
+    """
+    chat_id = message.chat.id
+    session = await asyncio.to_thread(
+        repo.open_session, chat_id, preset.game_key, started_by, target_for(preset.game_key)
     )
 
-    # публикуем шапку RSVP
-    await session_service.post_or_get_session_message(message.chat.id, preset, session)
+    # публикуем шапку RSVP и кнопку "Позвать всех"
+    await session_service.post_or_get_session_message(chat_id, preset, session)
 
     kb = InlineKeyboardBuilder()
     kb.button(
         text=f"Позвать всех на {preset.title}",
-        callback_data=f"callall:{session['session_id']}:{game_key}",
+        callback_data=f"callall:{session['session_id']}:{preset.game_key}",
     )
     await message.answer("Управление набором:", reply_markup=kb.as_markup())
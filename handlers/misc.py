@@ -2,21 +2,39 @@ from __future__ import annotations
 from aiogram import Router, F
 from aiogram.types import Message, ChatMemberUpdated
 from repo.supabase_repo import SupabaseRepo
+from services.eligibility import EligibilityIndex
+from services.sightings import SightingService
 
 router = Router()
 
-# Любое сообщение в группе — фиксируем пользователя в БД
+# Статусы, при которых человек больше не в чате
+GONE_STATUSES = {"left", "kicked"}
+
+# Сервисные сообщения о входе/выходе — приходят и без прав админа,
+# в отличие от chat_member-апдейтов. Вернувшийся снова становится present.
+@router.message(F.chat.type.in_({"group", "supergroup"}), F.new_chat_members | F.left_chat_member)
+async def on_member_message(message: Message, sightings: SightingService, eligibility: EligibilityIndex):
+    for u in message.new_chat_members or ():
+        sightings.seen(message.chat.id, u.id, u.username, u.first_name, u.last_name)
+    gone = message.left_chat_member
+    if gone is not None:
+        eligibility.set_present(message.chat.id, gone.id, False)
+
+# Любое сообщение в группе — фиксируем пользователя (пачкой, см. SightingService).
+# Обычную болтовню сюда не доводит PrefilterMiddleware — это запасной путь.
 @router.message(F.chat.type.in_({"group", "supergroup"}))
-async def seen_user_in_group(message: Message, repo: SupabaseRepo):
+async def seen_user_in_group(message: Message, sightings: SightingService):
     u = message.from_user
     if not u:
         return
-    repo.upsert_user(u.id, u.username, u.first_name, u.last_name)
+    sightings.seen(message.chat.id, u.id, u.username, u.first_name, u.last_name)
 
 # Вступление/изменение статуса участника
 @router.chat_member()
-async def on_member_update(event: ChatMemberUpdated, repo: SupabaseRepo):
+async def on_member_update(event: ChatMemberUpdated, repo: SupabaseRepo, eligibility: EligibilityIndex):
     u = event.new_chat_member.user if event.new_chat_member else None
     if not u:
         return
     repo.upsert_user(u.id, u.username, u.first_name, u.last_name)
+    status = getattr(event.new_chat_member, "status", None)
+    eligibility.set_present(event.chat.id, u.id, status not in GONE_STATUSES)
@@ -2,6 +2,7 @@ import asyncio
 import logging
 import os
 import sys
+from typing import Any, Dict, List, Tuple
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
@@ -38,11 +39,55 @@ try:
 except ModuleNotFoundError:
     from services.tagging import TaggingService
 
+try:
+    from cooldowns import CooldownService
+except ModuleNotFoundError:
+    from services.cooldowns import CooldownService
+
+try:
+    from eligibility import EligibilityIndex
+except ModuleNotFoundError:
+    from services.eligibility import EligibilityIndex
+
+try:
+    from presets import PresetStore
+except ModuleNotFoundError:
+    from services.presets import PresetStore
+
+try:
+    from callback_queue import SessionQueue
+except ModuleNotFoundError:
+    from services.callback_queue import SessionQueue
+
+try:
+    from tag_scheduler import TagScheduler
+except ModuleNotFoundError:
+    from services.tag_scheduler import TagScheduler
+
+try:
+    from pings import PingBudget
+except ModuleNotFoundError:
+    from services.pings import PingBudget
+
+from utils.sqlite_storage import SQLiteStorage
+from utils.prefilter import PrefilterMiddleware
+from utils.loop_watchdog import LoopWatchdog
+from utils.profiler import SamplingProfiler
+from utils.recorder import UpdateRecorder
+from services.sightings import SightingService
+
 from handlers import commands as commands_handler
 from handlers import callbacks as callbacks_handler
 from handlers import misc as misc_handler
 
 
+def build_storage(settings: Settings):
+    """FSM-хранилище по настройкам: SQLite-файл (по умолчанию) или память."""
+    if settings.fsm_storage == "memory":
+        return MemoryStorage()
+    return SQLiteStorage(settings.fsm_db_path, ttl=settings.fsm_ttl)
+
+
 def setup_logging() -> None:
     """Простая настройка логирования с читаемым форматом."""
     level_name = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -53,6 +98,128 @@ def setup_logging() -> None:
     )
 
 
+def build_dispatcher(settings: Settings, bot: Bot, repo) -> Tuple[Dispatcher, Dict[str, Any]]:
+    """
+    Диспетчер с роутерами и middleware + все сервисы (DI).
+    repo — SupabaseRepo в проде или LocalRepo при прогоне записей
+    (bench/replay_updates.py). Возвращает (dp, зависимости по именам DI).
+    """
+    dp = Dispatcher(storage=build_storage(settings))
+
+    # Зависимости (DI)
+    cooldowns = CooldownService(repo)
+    eligibility = EligibilityIndex(repo, cooldowns)
+    presets = PresetStore(repo)
+    sightings = SightingService(repo, eligibility)
+    session_service = SessionService(bot, repo, presets)
+    tag_scheduler = TagScheduler(workers=settings.tag_workers, rate=settings.tag_send_rate)
+    pings = None
+    if settings.ping_policy != "off" and settings.ping_window > 0:
+        pings = PingBudget(repo, window=settings.ping_window, policy=settings.ping_policy)
+    tagging = TaggingService(
+        bot, repo, cooldowns, eligibility, presets,
+        render_mode=settings.tag_render, scheduler=tag_scheduler, pings=pings,
+    )
+    callback_queue = SessionQueue() if settings.callback_mode == "async" else None
+    profiler = SamplingProfiler()
+    owner_ids = frozenset(settings.owner_ids)
+    recorder = UpdateRecorder(settings.record_updates) if settings.record_updates else None
+    # где и насколько синхронные вызовы останавливают loop — в лог и в /profile
+    watchdog = LoopWatchdog(threshold=settings.loop_lag_ms / 1000) if settings.loop_lag_ms > 0 else None
+
+    # Подключаем роутеры
+    dp.include_router(commands_handler.router)
+    dp.include_router(callbacks_handler.router)
+    dp.include_router(misc_handler.router)
+
+    # Middleware для передачи зависимостей
+    class InjectMiddleware:
+        async def __call__(self, handler, event, data):
+            data.setdefault("repo", repo)
+            data.setdefault("session_service", session_service)
+            data.setdefault("tagging", tagging)
+            data.setdefault("cooldowns", cooldowns)
+            data.setdefault("eligibility", eligibility)
+            data.setdefault("presets", presets)
+            data.setdefault("sightings", sightings)
+            data.setdefault("callback_queue", callback_queue)
+            data.setdefault("profiler", profiler)
+            data.setdefault("owner_ids", owner_ids)
+            data.setdefault("watchdog", watchdog)
+            data.setdefault("tag_scheduler", tag_scheduler)
+            return await handler(event, data)
+
+    # Запись апдейтов — первой, чтобы видеть всё, включая болтовню
+    if recorder is not None:
+        dp.update.outer_middleware(recorder)
+    # Обычная болтовня в группах отсекается до роутеров и DI
+    if settings.prefilter:
+        dp.update.outer_middleware(PrefilterMiddleware(sightings))
+    dp.update.outer_middleware(InjectMiddleware())
+
+    deps: Dict[str, Any] = {
+        "repo": repo,
+        "session_service": session_service,
+        "tagging": tagging,
+        "cooldowns": cooldowns,
+        "eligibility": eligibility,
+        "presets": presets,
+        "sightings": sightings,
+        "callback_queue": callback_queue,
+        "profiler": profiler,
+        "owner_ids": owner_ids,
+        "tag_scheduler": tag_scheduler,
+        "pings": pings,
+        "recorder": recorder,
+        "watchdog": watchdog,
+    }
+    return dp, deps
+
+
+async def load_state(deps: Dict[str, Any]) -> None:
+    """Состояние, которое сервисы держат в памяти, — из БД при старте."""
+    # Активные кулдауны — в память; дальше их читаем без БД
+    try:
+        n = await asyncio.to_thread(deps["cooldowns"].load)
+        logging.info("Loaded %s active cooldowns", n)
+    except Exception as e:
+        logging.warning("Failed to load cooldowns: %r", e)
+
+    # Недавние теги — чтобы не звать тех же людей сразу после рестарта
+    pings = deps["pings"]
+    if pings is not None:
+        try:
+            n = await asyncio.to_thread(pings.load)
+            logging.info("Loaded %s recent pings", n)
+        except Exception as e:
+            logging.warning("Failed to load pings: %r", e)
+
+
+def start_background(settings: Settings, deps: Dict[str, Any]) -> List[asyncio.Task]:
+    """
+    Фоновые задачи. Пока индекс eligibility не прогрет,
+    «Позвать всех» читает invitees из БД страницами.
+    """
+    background = [
+        asyncio.create_task(deps["cooldowns"].run_sweeper()),
+        asyncio.create_task(deps["eligibility"].warm_up()),
+        asyncio.create_task(deps["presets"].run_poller()),
+        asyncio.create_task(deps["sightings"].run_flusher()),
+        asyncio.create_task(deps["tag_scheduler"].run_workers()),
+    ]
+    if deps["pings"] is not None:
+        background.append(asyncio.create_task(deps["pings"].run_flusher()))
+    if deps["recorder"] is not None:
+        background.append(asyncio.create_task(deps["recorder"].run_flusher()))
+    if deps["watchdog"] is not None:
+        background.append(asyncio.create_task(deps["watchdog"].run_monitor()))
+    if settings.session_lifetime > 0:
+        background.append(
+            asyncio.create_task(deps["session_service"].run_expirer(settings.session_lifetime))
+        )
+    return background
+
+
 async def main() -> None:
     # Загружаем .env (на Railway переменные задаются в UI)
     load_dotenv()
@@ -72,33 +239,24 @@ async def main() -> None:
 
     # Создаём бота и диспетчер
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=MemoryStorage())
-
-    # Зависимости (DI)
-    repo = SupabaseRepo()
-    session_service = SessionService(bot, repo)
-    tagging = TaggingService(bot, repo)
-
-    # Подключаем роутеры
-    dp.include_router(commands_handler.router)
-    dp.include_router(callbacks_handler.router)
-    dp.include_router(misc_handler.router)
-
-    # Middleware для передачи зависимостей
-    class InjectMiddleware:
-        async def __call__(self, handler, event, data):
-            data.setdefault("repo", repo)
-            data.setdefault("session_service", session_service)
-            data.setdefault("tagging", tagging)
-            return await handler(event, data)
-
-    dp.update.outer_middleware(InjectMiddleware())
+    dp, deps = build_dispatcher(settings, bot, SupabaseRepo())
+    await load_state(deps)
 
     logging.info("🚀 Bot is starting polling...")
     print("🔥 Bot started and polling...")
 
+    background = start_background(settings, deps)
+
     # Стартуем
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # созывам нужны воркеры пула — ждём их до отмены фоновых задач
+        await deps["tag_scheduler"].drain()
+        for t in background:
+            t.cancel()
+        if deps["callback_queue"] is not None:
+            await deps["callback_queue"].drain()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,385 @@
+# repo/local_repo.py
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from repo.supabase_repo import PAGE_SIZE, Preset
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class LocalRepo:
+    """
+    SupabaseRepo в памяти — тот же интерфейс, без сети и БД.
+    Для прогонов записанного трафика (bench/replay_updates.py) и бенчмарков.
+
+    Поведение повторяет schema.sql там, где оно важно хендлерам:
+    gt_open_session закрывает прошлую сессию игры в чате, gt_rsvp_vote
+    отдаёт сводку в порядке updated_at, «Не сегодня» ставит кулдаун.
+    session_id детерминированы (счётчик), поэтому прогон воспроизводим.
+    """
+
+    def __init__(self, presets: Iterable[Dict[str, Any]] = ()) -> None:
+        self._lock = threading.RLock()
+        self._ids = count(1)
+        self.settings: Dict[str, str] = {}
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.leaders: Dict[Tuple[int, int], Optional[int]] = {}
+        self.exclusions: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self.presets: Dict[str, Dict[str, Any]] = {p["game_key"]: dict(p) for p in presets}
+        self.presets_version = 1
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self._session_ts: Dict[str, List[float]] = {}  # session_id -> [created, updated]
+        # session_id -> user_id -> status; порядок = порядок последних голосов
+        self.rsvp: Dict[str, "OrderedDict[int, str]"] = {}
+        self.cooldowns: Dict[Tuple[int, int], float] = {}
+        self.pings: Dict[Tuple[int, int], str] = {}
+
+    # ---------------------------
+    # App settings
+    # ---------------------------
+
+    def get_app_setting(self, key: str) -> Optional[str]:
+        return self.settings.get(key)
+
+    def set_app_setting(self, key: str, value: str) -> None:
+        self.settings[key] = value
+
+    # ---------------------------
+    # Users
+    # ---------------------------
+
+    def upsert_user(
+        self,
+        user_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+    ) -> None:
+        self.upsert_users(
+            [{"user_id": user_id, "username": username, "first_name": first_name, "last_name": last_name}]
+        )
+
+    def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for r in rows:
+                u = self.users.setdefault(r["user_id"], {"user_id": r["user_id"], "is_opted_out": False})
+                u.update(r)
+
+    def set_optout(self, user_id: int, value: bool) -> None:
+        self.upsert_users([{"user_id": user_id, "is_opted_out": value}])
+
+    def is_opted_out(self, user_id: int) -> bool:
+        return bool(self.users.get(user_id, {}).get("is_opted_out", False))
+
+    def get_user_public(self, user_id: int) -> Optional[Dict[str, Any]]:
+        u = self.users.get(user_id)
+        if u is None:
+            return None
+        return {k: u.get(k) for k in ("user_id", "username", "first_name", "last_name")}
+
+    def get_users_public(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        out: Dict[int, Dict[str, Any]] = {}
+        for uid in user_ids:
+            u = self.get_user_public(uid)
+            if u is not None:
+                out[uid] = u
+        return out
+
+    def iter_user_pages(self, page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        ids = sorted(self.users)
+        for i in range(0, len(ids), page_size):
+            yield [
+                {"user_id": uid, "is_opted_out": bool(self.users[uid].get("is_opted_out"))}
+                for uid in ids[i : i + page_size]
+            ]
+
+    def get_user_id_by_username(self, username: str) -> Optional[int]:
+        uname = (username or "").strip().lstrip("@").lower()
+        if not uname:
+            return None
+        for uid, u in self.users.items():
+            if (u.get("username") or "").lower() == uname:
+                return uid
+        return None
+
+    # ---------------------------
+    # Leaders
+    # ---------------------------
+
+    def is_leader(self, chat_id: int, user_id: int) -> bool:
+        return (chat_id, user_id) in self.leaders
+
+    def add_leader(self, chat_id: int, user_id: int, granted_by: Optional[int]) -> None:
+        self.leaders[(chat_id, user_id)] = granted_by
+
+    def remove_leader(self, chat_id: int, user_id: int) -> None:
+        self.leaders.pop((chat_id, user_id), None)
+
+    def list_leaders(self, chat_id: int) -> List[Dict[str, Any]]:
+        out = []
+        for c, uid in sorted(self.leaders):
+            if c == chat_id and uid in self.users:
+                u = self.users[uid]
+                out.append({"user_id": uid, "username": u.get("username"), "first_name": u.get("first_name")})
+        return out
+
+    # ---------------------------
+    # Exclusions
+    # ---------------------------
+
+    def is_excluded(self, chat_id: int, user_id: int) -> bool:
+        return (chat_id, user_id) in self.exclusions
+
+    def list_excluded_ids(self, chat_id: int) -> set[int]:
+        return {uid for c, uid in self.exclusions if c == chat_id}
+
+    def exclude(
+        self,
+        chat_id: int,
+        user_id: int,
+        created_by: Optional[int],
+        reason: Optional[str] = None,
+    ) -> None:
+        self.exclusions[(chat_id, user_id)] = {"created_by": created_by, "reason": reason}
+
+    def include(self, chat_id: int, user_id: int) -> None:
+        self.exclusions.pop((chat_id, user_id), None)
+
+    # ---------------------------
+    # Presets
+    # ---------------------------
+
+    @staticmethod
+    def _preset(row: Dict[str, Any]) -> Preset:
+        return Preset(
+            game_key=row["game_key"],
+            title=row["title"],
+            invite_lines=row.get("invite_lines") or [],
+            emoji=row.get("emoji"),
+            aliases=row.get("aliases") or [],
+        )
+
+    def get_preset(self, game_key: str) -> Optional[Preset]:
+        row = self.presets.get(game_key)
+        if not row or not row.get("is_active", True):
+            return None
+        return self._preset(row)
+
+    def list_active_presets(self) -> list[Preset]:
+        rows = [r for r in self.presets.values() if r.get("is_active", True)]
+        return [self._preset(r) for r in sorted(rows, key=lambda r: r["title"])]
+
+    def get_presets_version(self) -> str:
+        return f"{len(self.presets)}:{self.presets_version}"
+
+    # ---------------------------
+    # Sessions
+    # ---------------------------
+
+    def _touch(self, session_id: str) -> None:
+        now = time.time()
+        self._session_ts[session_id][1] = now
+        self.sessions[session_id]["updated_at"] = _iso(now)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        s = self.sessions.get(session_id)
+        return dict(s) if s else None
+
+    def _open_sessions(self, chat_id: int, game_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        rows = [
+            s for s in self.sessions.values()
+            if s["chat_id"] == chat_id and not s["is_closed"]
+            and (game_key is None or s["game_key"] == game_key)
+        ]
+        return sorted(rows, key=lambda s: self._session_ts[s["session_id"]][0], reverse=True)
+
+    def get_latest_active_session(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._open_sessions(chat_id)
+        return dict(rows[0]) if rows else None
+
+    def get_active_session(self, chat_id: int, game_key: str) -> Optional[Dict[str, Any]]:
+        rows = self._open_sessions(chat_id, game_key)
+        return dict(rows[0]) if rows else None
+
+    def open_session(
+        self, chat_id: int, game_key: str, started_by: int, target_count: int = 10
+    ) -> Dict[str, Any]:
+        """Как gt_open_session: закрыть открытую сессию (чат, игра) и создать новую."""
+        with self._lock:
+            for s in self._open_sessions(chat_id, game_key):
+                s["is_closed"] = True
+                self._touch(s["session_id"])
+            now = time.time()
+            sid = str(uuid.UUID(int=next(self._ids)))
+            self.sessions[sid] = {
+                "session_id": sid,
+                "chat_id": chat_id,
+                "game_key": game_key,
+                "started_by": started_by,
+                "is_closed": False,
+                "target_count": target_count,
+                "message_id": None,
+                "created_at": _iso(now),
+                "updated_at": _iso(now),
+            }
+            self._session_ts[sid] = [now, now]
+            self.rsvp[sid] = OrderedDict()
+            return dict(self.sessions[sid])
+
+    def _update_session(self, session_id: str, **fields: Any) -> None:
+        with self._lock:
+            s = self.sessions.get(session_id)
+            if s is not None:
+                s.update(fields)
+                self._touch(session_id)
+
+    def set_session_message(self, session_id: str, message_id: int) -> None:
+        self._update_session(session_id, message_id=message_id)
+
+    def set_session_target(self, session_id: str, target_count: int) -> None:
+        self._update_session(session_id, target_count=target_count)
+
+    def close_session(self, session_id: str) -> None:
+        self._update_session(session_id, is_closed=True)
+
+    def close_stale_sessions(self, lifetime_sec: int, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            before = time.time() - lifetime_sec
+            stale = [
+                s for s in self.sessions.values()
+                if not s["is_closed"] and self._session_ts[s["session_id"]][0] < before
+            ][:limit]
+            for s in stale:
+                s["is_closed"] = True
+                self._touch(s["session_id"])
+            return [dict(s) for s in stale]
+
+    def archive_closed_sessions(self, after_sec: int, batch: int = 500) -> int:
+        """Архива в памяти нет — давно закрытые сессии просто удаляются."""
+        with self._lock:
+            before = time.time() - after_sec
+            old = [
+                sid for sid, s in self.sessions.items()
+                if s["is_closed"] and self._session_ts[sid][1] < before
+            ][:batch]
+            for sid in old:
+                del self.sessions[sid]
+                del self._session_ts[sid]
+                self.rsvp.pop(sid, None)
+            return len(old)
+
+    # ---------------------------
+    # RSVP
+    # ---------------------------
+
+    def upsert_rsvp(self, session_id: str, user_id: int, status: str) -> None:
+        with self._lock:
+            votes = self.rsvp.setdefault(session_id, OrderedDict())
+            votes.pop(user_id, None)
+            votes[user_id] = status
+
+    def get_rsvp_lists(self, session_id: str) -> Tuple[List[int], List[int], List[int]]:
+        going: List[int] = []
+        maybe: List[int] = []
+        nope: List[int] = []
+        for uid, st in list(self.rsvp.get(session_id, {}).items()):
+            (going if st == "going" else maybe if st == "maybe" else nope).append(uid)
+        return going, maybe, nope
+
+    def vote_rsvp(
+        self, session_id: str, user_id: int, status: str, cooldown_hours: int = 0
+    ) -> Optional[Dict[str, Any]]:
+        """Как gt_rsvp_vote: голос + кулдаун + сводка."""
+        with self._lock:
+            s = self.sessions.get(session_id)
+            if s is None:
+                return None
+            self.upsert_rsvp(session_id, user_id, status)
+            until = None
+            if cooldown_hours > 0:
+                until = self.set_no_cooldown(s["chat_id"], user_id, hours=cooldown_hours)
+            rsvp = []
+            for uid, st in self.rsvp[session_id].items():
+                u = self.users.get(uid, {})
+                rsvp.append(
+                    {"user_id": uid, "status": st, "username": u.get("username"), "first_name": u.get("first_name")}
+                )
+            return {"session": dict(s), "rsvp": rsvp, "cooldown_until": until}
+
+    # ---------------------------
+    # Cooldowns
+    # ---------------------------
+
+    def set_no_cooldown(
+        self, chat_id: int, user_id: int, hours: int = 6, reason: str = "no"
+    ) -> datetime:
+        until = datetime.now(timezone.utc) + timedelta(hours=hours)
+        self.cooldowns[(chat_id, user_id)] = until.timestamp()
+        return until
+
+    def list_active_cooldowns(self) -> List[Tuple[int, int, float]]:
+        now = time.time()
+        return [(c, u, ts) for (c, u), ts in sorted(self.cooldowns.items()) if ts > now]
+
+    def purge_expired_cooldowns(self) -> int:
+        with self._lock:
+            now = time.time()
+            old = [k for k, ts in self.cooldowns.items() if ts < now]
+            for k in old:
+                del self.cooldowns[k]
+            return len(old)
+
+    # ---------------------------
+    # Pings
+    # ---------------------------
+
+    def upsert_pings(self, rows: List[Dict[str, Any]]) -> None:
+        for r in rows:
+            self.pings[(r["chat_id"], r["user_id"])] = r["pinged_at"]
+
+    def list_recent_pings(self, since: datetime) -> List[Tuple[int, int, float]]:
+        out = []
+        for (c, u), at in sorted(self.pings.items()):
+            ts = datetime.fromisoformat(at).timestamp()
+            if ts > since.timestamp():
+                out.append((c, u, ts))
+        return out
+
+    def purge_old_pings(self, before: datetime) -> int:
+        with self._lock:
+            old = [k for k, at in self.pings.items() if datetime.fromisoformat(at) < before]
+            for k in old:
+                del self.pings[k]
+            return len(old)
+
+    # ---------------------------
+    # Invitees
+    # ---------------------------
+
+    def iter_invitee_pages(
+        self,
+        chat_id: int,
+        page_size: int = PAGE_SIZE,
+        cooldown_ids: Optional[set[int]] = None,
+    ) -> Iterator[List[int]]:
+        excl = self.list_excluded_ids(chat_id)
+        if cooldown_ids is not None:
+            cd = cooldown_ids
+        else:
+            now = time.time()
+            cd = {u for (c, u), ts in self.cooldowns.items() if c == chat_id and ts > now}
+        ids = [
+            uid for uid in sorted(self.users)
+            if not self.users[uid].get("is_opted_out") and uid not in excl and uid not in cd
+        ]
+        for i in range(0, len(ids), page_size):
+            yield ids[i : i + page_size]
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Optional, List, Tuple, Dict, Any
+from dataclasses import dataclass, field
+from typing import Optional, List, Tuple, Dict, Any, Iterator
 from datetime import datetime, timedelta, timezone
 
 from supabase import create_client, Client
@@ -11,6 +11,10 @@ from config import Settings
 # env читается в main.py -> Settings.from_env()
 _settings = Settings.from_env()
 
+# PostgREST по умолчанию отдаёт не больше 1000 строк за запрос —
+# всё, что может оказаться больше, читаем страницами по user_id (keyset).
+PAGE_SIZE = 1000
+
 
 @dataclass
 class Preset:
@@ -18,6 +22,7 @@ class Preset:
     title: str
     invite_lines: List[str]
     emoji: Optional[str] = None
+    aliases: List[str] = field(default_factory=list)
 
 
 class SupabaseRepo:
@@ -27,6 +32,50 @@ class SupabaseRepo:
             _settings.supabase_service_key,
         )
 
+    # ---------------------------
+    # Keyset-пагинация
+    # ---------------------------
+
+    def _iter_keyset(
+        self,
+        table: str,
+        columns: str,
+        filters: Optional[Dict[str, Any]] = None,
+        key: str = "user_id",
+        page_size: int = PAGE_SIZE,
+        build=None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Читает таблицу страницами по возрастанию `key`:
+        WHERE key > <последний ключ> ORDER BY key LIMIT page_size.
+        В отличие от OFFSET, каждая страница — один индексный проход,
+        а строки не теряются на лимите PostgREST.
+        `build` — опциональная доп. настройка запроса (например, .gt(...)).
+        """
+        last = None
+        while True:
+            q = self.client.table(table).select(columns)
+            if filters:
+                q = q.match(filters)
+            if build is not None:
+                q = build(q)
+            if last is not None:
+                q = q.gt(key, last)
+            rows = q.order(key, desc=False).limit(page_size).execute().data or []
+            if not rows:
+                return
+            yield rows
+            if len(rows) < page_size:
+                return
+            last = rows[-1][key]
+
+    def _fetch_ids(self, table: str, filters: Dict[str, Any], build=None) -> set[int]:
+        """Множество user_id из таблицы (все страницы)."""
+        ids: set[int] = set()
+        for rows in self._iter_keyset(table, "user_id", filters, build=build):
+            ids.update(r["user_id"] for r in rows)
+        return ids
+
     # ---------------------------
     # App settings (глобальные)
     # ---------------------------
@@ -74,6 +123,11 @@ class SupabaseRepo:
             }
         ).execute()
 
+    def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        """Пачка профилей {user_id, username, first_name, last_name} одним запросом."""
+        if rows:
+            self.client.table("gt_users").upsert(rows).execute()
+
     def set_optout(self, user_id: int, value: bool) -> None:
         self.client.table("gt_users").upsert(
             {"user_id": user_id, "is_opted_out": value}
@@ -100,6 +154,22 @@ class SupabaseRepo:
         )
         return res.data or None
 
+    def get_users_public(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Карточки нескольких пользователей одним запросом: {user_id: строка}."""
+        if not user_ids:
+            return {}
+        res = (
+            self.client.table("gt_users")
+            .select("user_id,username,first_name,last_name")
+            .in_("user_id", list(user_ids))
+            .execute()
+        )
+        return {r["user_id"]: r for r in res.data or []}
+
+    def iter_user_pages(self, page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """Все пользователи страницами по user_id: [{user_id, is_opted_out}]."""
+        return self._iter_keyset("gt_users", "user_id,is_opted_out", page_size=page_size)
+
     def get_user_id_by_username(self, username: str) -> Optional[int]:
         """
         Возвращает user_id по @username (без @). Поиск регистронезависимый.
@@ -148,24 +218,18 @@ class SupabaseRepo:
         Возвращает список словарей с полями:
         { user_id, username, first_name }
         """
-        # берём все user_id лидеров этого чата
-        res = (
-            self.client.table("gt_leaders")
-            .select("user_id")
-            .eq("chat_id", chat_id)
-            .execute()
-        )
-        ids = [r["user_id"] for r in (res.data or [])]
-        if not ids:
-            return []
-        # подтягиваем карточки пользователей
-        res2 = (
-            self.client.table("gt_users")
-            .select("user_id,username,first_name")
-            .in_("user_id", ids)
-            .execute()
-        )
-        return res2.data or []
+        out: List[Dict[str, Any]] = []
+        # страницы user_id лидеров этого чата -> карточки пользователей
+        for rows in self._iter_keyset("gt_leaders", "user_id", {"chat_id": chat_id}):
+            ids = [r["user_id"] for r in rows]
+            res = (
+                self.client.table("gt_users")
+                .select("user_id,username,first_name")
+                .in_("user_id", ids)
+                .execute()
+            )
+            out.extend(res.data or [])
+        return out
 
     # ---------------------------
     # Exclusions
@@ -180,6 +244,9 @@ class SupabaseRepo:
         )
         return len(res.data or []) > 0
 
+    def list_excluded_ids(self, chat_id: int) -> set[int]:
+        return self._fetch_ids("gt_exclusions", {"chat_id": chat_id})
+
     def exclude(
         self,
         chat_id: int,
@@ -208,7 +275,7 @@ class SupabaseRepo:
     def get_preset(self, game_key: str) -> Optional[Preset]:
         res = (
             self.client.table("gt_game_presets")
-            .select("game_key,title,invite_lines,emoji,is_active")
+            .select("game_key,title,invite_lines,emoji,aliases,is_active")
             .eq("game_key", game_key)
             .maybe_single()
             .execute()
@@ -223,13 +290,14 @@ class SupabaseRepo:
             title=data["title"],
             invite_lines=data.get("invite_lines") or [],
             emoji=data.get("emoji"),
+            aliases=data.get("aliases") or [],
         )
 
     def list_active_presets(self) -> list[Preset]:
         """Список активных игр для /games и /call <игра>."""
         res = (
             self.client.table("gt_game_presets")
-            .select("game_key,title,invite_lines,emoji,is_active")
+            .select("game_key,title,invite_lines,emoji,aliases,is_active")
             .eq("is_active", True)
             .order("title", desc=False)
             .execute()
@@ -242,10 +310,27 @@ class SupabaseRepo:
                     title=row["title"],
                     invite_lines=row.get("invite_lines") or [],
                     emoji=row.get("emoji"),
+                    aliases=row.get("aliases") or [],
                 )
             )
         return items
 
+    def get_presets_version(self) -> str:
+        """
+        Версия таблицы пресетов: число строк + max(updated_at).
+        Меняется при любом insert/update (updated_at ставит триггер) и delete.
+        """
+        res = (
+            self.client.table("gt_game_presets")
+            .select("updated_at", count="exact")
+            .order("updated_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        rows = res.data or []
+        latest = rows[0]["updated_at"] if rows else ""
+        return f"{res.count or 0}:{latest}"
+
     # ---------------------------
     # Sessions
     # ---------------------------
@@ -285,22 +370,24 @@ class SupabaseRepo:
         rows = res.data or []
         return rows[0] if rows else None
 
-    def create_session(
+    def open_session(
         self, chat_id: int, game_key: str, started_by: int, target_count: int = 10
     ) -> Dict[str, Any]:
-        res = (
-            self.client.table("gt_sessions")
-            .insert(
-                {
-                    "chat_id": chat_id,
-                    "game_key": game_key,
-                    "started_by": started_by,
-                    "target_count": target_count,
-                }
-            )
-            .execute()
-        )
-        return (res.data or [])[0]
+        """
+        Одним запросом: закрыть открытую сессию (чат, игра) и создать новую.
+        См. функцию gt_open_session в schema.sql.
+        """
+        res = self.client.rpc(
+            "gt_open_session",
+            {
+                "p_chat_id": chat_id,
+                "p_game_key": game_key,
+                "p_started_by": started_by,
+                "p_target_count": target_count,
+            },
+        ).execute()
+        data = res.data
+        return data[0] if isinstance(data, list) else data
 
     def set_session_message(self, session_id: str, message_id: int) -> None:
         self.client.table("gt_sessions").update(
@@ -318,6 +405,22 @@ class SupabaseRepo:
             {"is_closed": True}
         ).eq("session_id", session_id).execute()
 
+    def close_stale_sessions(self, lifetime_sec: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """Закрывает открытые сессии старше lifetime_sec и возвращает их (gt_close_stale_sessions)."""
+        res = self.client.rpc(
+            "gt_close_stale_sessions",
+            {"p_lifetime_sec": lifetime_sec, "p_limit": limit},
+        ).execute()
+        return res.data or []
+
+    def archive_closed_sessions(self, after_sec: int, batch: int = 500) -> int:
+        """Переносит пачку давно закрытых сессий с RSVP в архив. Возвращает их число."""
+        res = self.client.rpc(
+            "gt_archive_closed_sessions",
+            {"p_after_sec": after_sec, "p_batch": batch},
+        ).execute()
+        return int(res.data or 0)
+
     # ---------------------------
     # RSVP
     # ---------------------------
@@ -348,14 +451,43 @@ class SupabaseRepo:
                 nope.append(uid)
         return going, maybe, nope
 
+    def vote_rsvp(
+        self, session_id: str, user_id: int, status: str, cooldown_hours: int = 0
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Голос + (для «Не сегодня») кулдаун + свежая сводка — одним запросом.
+        См. функцию gt_rsvp_vote в schema.sql.
+        Возвращает {"session", "rsvp", "cooldown_until"} или None, если сессии нет;
+        cooldown_until приводится к datetime.
+        """
+        res = self.client.rpc(
+            "gt_rsvp_vote",
+            {
+                "p_session_id": session_id,
+                "p_user_id": user_id,
+                "p_status": status,
+                "p_cooldown_hours": cooldown_hours,
+            },
+        ).execute()
+        board = res.data
+        if not board:
+            return None
+        until = board.get("cooldown_until")
+        if until:
+            board["cooldown_until"] = datetime.fromisoformat(until.replace("Z", "+00:00"))
+        return board
+
     # ---------------------------
     # Cooldowns (Не сегодня)
     # ---------------------------
 
-    def set_no_cooldown(self, chat_id: int, user_id: int, hours: int = 6, reason: str = "no") -> None:
+    def set_no_cooldown(
+        self, chat_id: int, user_id: int, hours: int = 6, reason: str = "no"
+    ) -> datetime:
         """
         Установить/обновить кулдаун 'не тегать' для пользователя в чате.
         Требуется таблица public.gt_cooldowns (chat_id, user_id, until_at timestamptz, reason).
+        Возвращает момент окончания кулдауна.
         """
         until = datetime.now(timezone.utc) + timedelta(hours=hours)
         self.client.table("gt_cooldowns").upsert(
@@ -366,45 +498,123 @@ class SupabaseRepo:
                 "reason": reason,
             }
         ).execute()
+        return until
 
-    def list_invitees(self, chat_id: int) -> list[int]:
+    def list_active_cooldowns(self) -> List[Tuple[int, int, float]]:
         """
-        Список user_id, которых можно тегать в данном чате:
-        - известные боту (gt_users)
-        - НЕ opted_out
-        - НЕ в gt_exclusions для этого чата
-        - НЕТ активного кулдауна gt_cooldowns.until_at > now()
+        Все активные кулдауны по всем чатам: [(chat_id, user_id, until_ts)].
+        Ключ таблицы составной, поэтому страницы — по range().
         """
-        # 1) все не-опт-аут
-        users = (
-            self.client.table("gt_users")
-            .select("user_id")
-            .eq("is_opted_out", False)
+        now_iso = datetime.now(timezone.utc).isoformat()
+        out: List[Tuple[int, int, float]] = []
+        offset = 0
+        while True:
+            rows = (
+                self.client.table("gt_cooldowns")
+                .select("chat_id,user_id,until_at")
+                .gt("until_at", now_iso)
+                .order("chat_id")
+                .order("user_id")
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute()
+                .data or []
+            )
+            for r in rows:
+                until = datetime.fromisoformat(r["until_at"].replace("Z", "+00:00"))
+                out.append((r["chat_id"], r["user_id"], until.timestamp()))
+            if len(rows) < PAGE_SIZE:
+                return out
+            offset += PAGE_SIZE
+
+    def purge_expired_cooldowns(self) -> int:
+        """Удаляет истёкшие кулдауны одним запросом. Возвращает число строк."""
+        now_iso = datetime.now(timezone.utc).isoformat()
+        res = (
+            self.client.table("gt_cooldowns")
+            .delete()
+            .lt("until_at", now_iso)
             .execute()
-            .data or []
         )
-        user_ids = {u["user_id"] for u in users}
+        return len(res.data or [])
 
-        # 2) исключенные в этом чате
-        excluded = (
-            self.client.table("gt_exclusions")
-            .select("user_id")
-            .eq("chat_id", chat_id)
-            .execute()
-            .data or []
-        )
-        excl = {r["user_id"] for r in excluded}
+    # ---------------------------
+    # Pings (последний тег в чате)
+    # ---------------------------
 
-        # 3) активные кулдауны в этом чате
-        now_iso = datetime.now(timezone.utc).isoformat()
-        cooldowns = (
-            self.client.table("gt_cooldowns")
-            .select("user_id,until_at")
-            .eq("chat_id", chat_id)
-            .gt("until_at", now_iso)
+    def upsert_pings(self, rows: List[Dict[str, Any]]) -> None:
+        """Пачка {chat_id, user_id, pinged_at} одним запросом."""
+        if rows:
+            self.client.table("gt_pings").upsert(rows).execute()
+
+    def list_recent_pings(self, since: datetime) -> List[Tuple[int, int, float]]:
+        """Теги не старше since по всем чатам: [(chat_id, user_id, pinged_ts)]."""
+        out: List[Tuple[int, int, float]] = []
+        offset = 0
+        while True:
+            rows = (
+                self.client.table("gt_pings")
+                .select("chat_id,user_id,pinged_at")
+                .gt("pinged_at", since.isoformat())
+                .order("chat_id")
+                .order("user_id")
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute()
+                .data or []
+            )
+            for r in rows:
+                at = datetime.fromisoformat(r["pinged_at"].replace("Z", "+00:00"))
+                out.append((r["chat_id"], r["user_id"], at.timestamp()))
+            if len(rows) < PAGE_SIZE:
+                return out
+            offset += PAGE_SIZE
+
+    def purge_old_pings(self, before: datetime) -> int:
+        """Удаляет теги старше before. Возвращает число строк."""
+        res = (
+            self.client.table("gt_pings")
+            .delete()
+            .lt("pinged_at", before.isoformat())
             .execute()
-            .data or []
         )
-        cd = {r["user_id"] for r in cooldowns}
+        return len(res.data or [])
+
+    def iter_invitee_pages(
+        self,
+        chat_id: int,
+        page_size: int = PAGE_SIZE,
+        cooldown_ids: Optional[set[int]] = None,
+    ) -> Iterator[List[int]]:
+        """
+        Постранично отдаёт user_id, которых можно тегать в данном чате:
+        - известные боту (gt_users)
+        - НЕ opted_out
+        - НЕ в gt_exclusions для этого чата
+        - НЕТ активного кулдауна gt_cooldowns.until_at > now()
+
+        Исключения и кулдауны per-chat и невелики — читаем их целиком заранее,
+        а gt_users (может быть много) идёт страницами по user_id.
+        cooldown_ids — активные кулдауны из памяти (CooldownService);
+        если переданы, gt_cooldowns не запрашиваем.
+        """
+        # 1) исключенные в этом чате
+        excl = self.list_excluded_ids(chat_id)
+
+        # 2) активные кулдауны в этом чате
+        if cooldown_ids is not None:
+            cd = cooldown_ids
+        else:
+            now_iso = datetime.now(timezone.utc).isoformat()
+            cd = self._fetch_ids(
+                "gt_cooldowns",
+                {"chat_id": chat_id},
+                build=lambda q: q.gt("until_at", now_iso),
+            )
 
-        return [uid for uid in user_ids if uid not in excl and uid not in cd]
+        # 3) не-опт-аут пользователи, страницами
+        for rows in self._iter_keyset(
+            "gt_users", "user_id", {"is_opted_out": False}, page_size=page_size
+        ):
+            page = [r["user_id"] for r in rows]
+            page = [uid for uid in page if uid not in excl and uid not in cd]
+            if page:
+                yield page
@@ -52,6 +52,10 @@ CREATE TABLE IF NOT EXISTS public.gt_game_presets (
   updated_at   timestamptz NOT NULL DEFAULT now()
 );
 
+-- альтернативные названия для /call <игра> (рус/англ, сокращения)
+ALTER TABLE public.gt_game_presets
+  ADD COLUMN IF NOT EXISTS aliases text[] NOT NULL DEFAULT '{}';
+
 -- -----------------------------------------
 -- Сессия набора по игре в конкретном чате
 -- -----------------------------------------
@@ -90,6 +94,18 @@ CREATE TABLE IF NOT EXISTS public.gt_exclusions (
   PRIMARY KEY (chat_id, user_id)
 );
 
+-- -----------------------------------------
+-- Кулдауны «Не сегодня» по чатам (истёкшие чистит бот)
+-- -----------------------------------------
+CREATE TABLE IF NOT EXISTS public.gt_cooldowns (
+  chat_id    bigint NOT NULL,
+  user_id    bigint NOT NULL,
+  until_at   timestamptz NOT NULL,
+  reason     text,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (chat_id, user_id)
+);
+
 -- -----------------------------------------
 -- Индексы
 -- -----------------------------------------
@@ -98,6 +114,212 @@ CREATE INDEX IF NOT EXISTS idx_gt_leaders_chat     ON public.gt_leaders (chat_id
 CREATE INDEX IF NOT EXISTS idx_gt_sessions_chat    ON public.gt_sessions (chat_id, is_closed);
 CREATE INDEX IF NOT EXISTS idx_gt_rsvp_session     ON public.gt_session_rsvp (session_id, status);
 CREATE INDEX IF NOT EXISTS idx_gt_exclusions_chat  ON public.gt_exclusions (chat_id);
+CREATE INDEX IF NOT EXISTS idx_gt_cooldowns_until  ON public.gt_cooldowns (until_at);
+
+-- -----------------------------------------
+-- Не больше одной открытой сессии на (чат, игра)
+-- -----------------------------------------
+-- сначала закрываем дубли, которые могли накопиться до индекса
+UPDATE public.gt_sessions s
+   SET is_closed = true
+ WHERE NOT s.is_closed
+   AND EXISTS (
+     SELECT 1 FROM public.gt_sessions n
+      WHERE n.chat_id = s.chat_id AND n.game_key = s.game_key
+        AND NOT n.is_closed AND n.created_at > s.created_at
+   );
+CREATE UNIQUE INDEX IF NOT EXISTS uq_gt_sessions_open
+  ON public.gt_sessions (chat_id, game_key) WHERE NOT is_closed;
+
+-- Атомарно: закрыть открытую сессию (чат, игра) и создать новую.
+-- Advisory-lock сериализует одновременные /call по одной игре в чате.
+CREATE OR REPLACE FUNCTION public.gt_open_session(
+  p_chat_id bigint, p_game_key text, p_started_by bigint, p_target_count int
+) RETURNS public.gt_sessions
+LANGUAGE plpgsql AS $$
+DECLARE
+  s public.gt_sessions;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtextextended(p_chat_id::text || ':' || p_game_key, 0));
+  UPDATE public.gt_sessions
+     SET is_closed = true
+   WHERE chat_id = p_chat_id AND game_key = p_game_key AND NOT is_closed;
+  INSERT INTO public.gt_sessions (chat_id, game_key, started_by, target_count)
+  VALUES (p_chat_id, p_game_key, p_started_by, p_target_count)
+  RETURNING * INTO s;
+  RETURN s;
+END $$;
+
+-- -----------------------------------------
+-- RSVP одним запросом: голос + кулдаун + сводка для шапки
+-- -----------------------------------------
+-- Возвращает {"session": {...}, "rsvp": [{user_id, status, username, first_name}],
+-- "cooldown_until": timestamptz | null} или NULL, если сессии нет.
+-- p_cooldown_hours > 0 — поставить кулдаун «Не сегодня» в чате сессии.
+CREATE OR REPLACE FUNCTION public.gt_rsvp_vote(
+  p_session_id uuid, p_user_id bigint, p_status gt_rsvp, p_cooldown_hours int DEFAULT 0
+) RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+  s       public.gt_sessions;
+  v_until timestamptz;
+BEGIN
+  SELECT * INTO s FROM public.gt_sessions WHERE session_id = p_session_id;
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO public.gt_session_rsvp (session_id, user_id, status)
+  VALUES (p_session_id, p_user_id, p_status)
+  ON CONFLICT (session_id, user_id)
+  DO UPDATE SET status = EXCLUDED.status, updated_at = now();
+
+  IF p_cooldown_hours > 0 THEN
+    v_until := now() + make_interval(hours => p_cooldown_hours);
+    INSERT INTO public.gt_cooldowns (chat_id, user_id, until_at, reason)
+    VALUES (s.chat_id, p_user_id, v_until, 'no')
+    ON CONFLICT (chat_id, user_id)
+    DO UPDATE SET until_at = EXCLUDED.until_at, reason = EXCLUDED.reason;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'session', to_jsonb(s),
+    'cooldown_until', v_until,
+    'rsvp', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+               'user_id', r.user_id, 'status', r.status,
+               'username', u.username, 'first_name', u.first_name
+             ) ORDER BY r.updated_at)
+        FROM public.gt_session_rsvp r
+        LEFT JOIN public.gt_users u ON u.user_id = r.user_id
+       WHERE r.session_id = p_session_id
+    ), '[]'::jsonb)
+  );
+END $$;
+
+-- -----------------------------------------
+-- updated_at = now() при каждом UPDATE (бот опрашивает версию пресетов)
+-- -----------------------------------------
+CREATE OR REPLACE FUNCTION public.gt_touch_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_gt_game_presets_touch ON public.gt_game_presets;
+CREATE TRIGGER trg_gt_game_presets_touch
+  BEFORE UPDATE ON public.gt_game_presets
+  FOR EACH ROW EXECUTE FUNCTION public.gt_touch_updated_at();
+
+-- -----------------------------------------
+-- Авто-закрытие и архив сессий
+-- -----------------------------------------
+-- updated_at сессии = момент последнего изменения (в т.ч. закрытия)
+DROP TRIGGER IF EXISTS trg_gt_sessions_touch ON public.gt_sessions;
+CREATE TRIGGER trg_gt_sessions_touch
+  BEFORE UPDATE ON public.gt_sessions
+  FOR EACH ROW EXECUTE FUNCTION public.gt_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_gt_sessions_open_created
+  ON public.gt_sessions (created_at) WHERE NOT is_closed;
+CREATE INDEX IF NOT EXISTS idx_gt_sessions_closed_updated
+  ON public.gt_sessions (updated_at) WHERE is_closed;
+
+CREATE TABLE IF NOT EXISTS public.gt_sessions_archive (
+  session_id   uuid PRIMARY KEY,
+  chat_id      bigint NOT NULL,
+  game_key     text NOT NULL,
+  started_by   bigint NOT NULL,
+  is_closed    boolean NOT NULL,
+  target_count int NOT NULL,
+  message_id   bigint,
+  created_at   timestamptz NOT NULL,
+  updated_at   timestamptz NOT NULL,
+  archived_at  timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.gt_session_rsvp_archive (
+  session_id uuid   NOT NULL,
+  user_id    bigint NOT NULL,
+  status     gt_rsvp NOT NULL,
+  updated_at timestamptz NOT NULL,
+  PRIMARY KEY (session_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_gt_sessions_archive_chat ON public.gt_sessions_archive (chat_id, created_at);
+
+-- Закрывает открытые сессии старше p_lifetime_sec (не больше p_limit за вызов)
+-- и возвращает их — бот дорисовывает шапки.
+CREATE OR REPLACE FUNCTION public.gt_close_stale_sessions(
+  p_lifetime_sec int, p_limit int DEFAULT 100
+) RETURNS SETOF public.gt_sessions
+LANGUAGE sql AS $$
+  UPDATE public.gt_sessions s
+     SET is_closed = true
+   WHERE s.session_id IN (
+     SELECT session_id FROM public.gt_sessions
+      WHERE NOT is_closed
+        AND created_at < now() - make_interval(secs => p_lifetime_sec)
+      ORDER BY created_at
+      LIMIT p_limit
+      FOR UPDATE SKIP LOCKED
+   )
+  RETURNING s.*;
+$$;
+
+-- Переносит до p_batch сессий, закрытых раньше чем p_after_sec назад,
+-- вместе с RSVP в архив. Возвращает число перенесённых сессий.
+CREATE OR REPLACE FUNCTION public.gt_archive_closed_sessions(
+  p_after_sec int, p_batch int DEFAULT 500
+) RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+  ids uuid[];
+BEGIN
+  SELECT array_agg(session_id) INTO ids FROM (
+    SELECT session_id FROM public.gt_sessions
+     WHERE is_closed
+       AND updated_at < now() - make_interval(secs => p_after_sec)
+     ORDER BY updated_at
+     LIMIT p_batch
+     FOR UPDATE SKIP LOCKED
+  ) t;
+  IF ids IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  INSERT INTO public.gt_session_rsvp_archive (session_id, user_id, status, updated_at)
+  SELECT session_id, user_id, status, updated_at
+    FROM public.gt_session_rsvp
+   WHERE session_id = ANY(ids)
+  ON CONFLICT DO NOTHING;
+
+  INSERT INTO public.gt_sessions_archive (
+    session_id, chat_id, game_key, started_by, is_closed,
+    target_count, message_id, created_at, updated_at
+  )
+  SELECT session_id, chat_id, game_key, started_by, is_closed,
+         target_count, message_id, created_at, updated_at
+    FROM public.gt_sessions
+   WHERE session_id = ANY(ids)
+  ON CONFLICT DO NOTHING;
+
+  -- RSVP удаляются каскадом
+  DELETE FROM public.gt_sessions WHERE session_id = ANY(ids);
+  RETURN array_length(ids, 1);
+END $$;
+
+-- -----------------------------------------
+-- Последний тег пользователя в чате («Позвать всех»).
+-- Пишется пачками из памяти бота (services/pings.py), старое чистит бот.
+-- -----------------------------------------
+CREATE TABLE IF NOT EXISTS public.gt_pings (
+  chat_id   bigint NOT NULL,
+  user_id   bigint NOT NULL,
+  pinged_at timestamptz NOT NULL,
+  PRIMARY KEY (chat_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_gt_pings_pinged ON public.gt_pings (pinged_at);
 
 -- -----------------------------------------
 -- Стартовые пресеты игр (idempotent)
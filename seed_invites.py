@@ -1,25 +1,54 @@
 # seed_invites.py
+"""
+Генерация и заливка пресетов игр в gt_game_presets.
+
+    python seed_invites.py                   # сгенерировать и залить изменившиеся
+    python seed_invites.py --dry-run         # только показать diff и тайминги
+    python seed_invites.py --lines 1000 --workers 4 --games-file extra_games.json
+
+Пайплайн: генерация всех пресетов (параллельно в процессах) ->
+чтение текущих из БД -> diff -> один bulk upsert только изменённых (чанками).
+Фразы детерминированы (--seed), поэтому повторный запуск без правок ничего не пишет.
+"""
 from __future__ import annotations
+import argparse
+import hashlib
+import json
 import os
-import random
-from supabase import create_client
-from itertools import product
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator, Sequence
+
+# Сколько строк уходит в одном upsert-запросе
+UPSERT_CHUNK = 200
+DEFAULT_SEED = "gametagger"
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
-if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-    raise SystemExit("Set SUPABASE_URL and SUPABASE_SERVICE_KEY env vars.")
+_sb = None
 
-sb = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+def _client():
+    """Клиент Supabase создаётся лениво — воркерам генерации он не нужен."""
+    global _sb
+    if _sb is None:
+        from supabase import create_client
+
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_SERVICE_KEY")
+        if not url or not key:
+            raise SystemExit("Set SUPABASE_URL and SUPABASE_SERVICE_KEY env vars.")
+        _sb = create_client(url, key)
+    return _sb
 
 # ---------- БАЗА: игры, названия и эмодзи заголовка ----------
 GAMES = {
-    "codenames": {"title": "Codenames", "emoji": "🧠"},
-    "bunker":    {"title": "Бункер",    "emoji": "🏚️"},
-    "alias":     {"title": "Alias",     "emoji": "🗣️"},
-    "gartic":    {"title": "Gartic",    "emoji": "🎨"},
-    "mafia":     {"title": "Mafia",     "emoji": "🕵️"},
-    "doors":     {"title": "Doors (захваты и защита)", "emoji": "🚪"},
+    "codenames": {"title": "Codenames", "emoji": "🧠", "aliases": ["Коднеймс", "Кодовые имена"]},
+    "bunker":    {"title": "Бункер",    "emoji": "🏚️", "aliases": ["Bunker"]},
+    "alias":     {"title": "Alias",     "emoji": "🗣️", "aliases": ["Элиас", "Алиас"]},
+    "gartic":    {"title": "Gartic",    "emoji": "🎨", "aliases": ["Гартик", "Gartic Phone"]},
+    "mafia":     {"title": "Mafia",     "emoji": "🕵️", "aliases": ["Мафия"]},
+    "doors":     {"title": "Doors (захваты и защита)", "emoji": "🚪", "aliases": ["Двери", "Дорс"]},
 }
 
 # ---------- ГЕНЕРАЦИЯ ФРАЗ: 100 уникальных на игру ----------
@@ -29,36 +58,108 @@ GAMES = {
 TAILS = ["", " — поехали!", " — 10 минут и старт!", " — залетаем!", " — без разогрева!", " — быстро-быстро!"]
 CLOCKS = ["⏱️", "⏳", "🕒", "⚡", "🔥", "🎯", "⭐", "✅"]
 
-def mix(patterns, emojis, extras=None, need=100):
+class _IndexPermutation:
+    """
+    Псевдослучайная биекция [0, n) -> [0, n) без материализации:
+    сеть Фейстеля на 2^k + cycle-walking до n. Память O(1), ключ — seed.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, n: int, seed: str) -> None:
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        bits += bits & 1  # чётное число бит — делим пополам
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        # ключи раундов из seed; сама раундовая функция — дешёвый 64-битный миксер
+        digest = hashlib.blake2b(seed.encode(), digest_size=8 * self.ROUNDS).digest()
+        self.keys = [int.from_bytes(digest[8 * r : 8 * r + 8], "little") for r in range(self.ROUNDS)]
+
+    def _round(self, r: int, x: int) -> int:
+        x = ((x ^ self.keys[r]) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        x ^= x >> 31
+        x = (x * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        x ^= x >> 29
+        return x & self.mask
+
+    def _feistel(self, x: int) -> int:
+        left, right = x >> self.half, x & self.mask
+        for r in range(self.ROUNDS):
+            left, right = right, left ^ self._round(r, right)
+        return (left << self.half) | right
+
+    def __call__(self, i: int) -> int:
+        x = self._feistel(i)
+        while x >= self.n:  # выпали за n — идём по циклу дальше
+            x = self._feistel(x)
+        return x
+
+
+def iter_product_sample(pools: Sequence[Sequence[str]], seed: str) -> Iterator[tuple]:
+    """
+    Элементы декартова произведения pools в псевдослучайном порядке, без повторов
+    и без построения самого произведения: индекс -> кортеж через смешанную систему счисления.
+    """
+    sizes = [len(p) for p in pools]
+    n = 1
+    for size in sizes:
+        n *= size
+    if not n:
+        return
+    perm = _IndexPermutation(n, seed)
+    for i in range(n):
+        idx = perm(i)
+        item = []
+        for pool, size in zip(reversed(pools), reversed(sizes)):
+            idx, k = divmod(idx, size)
+            item.append(pool[k])
+        yield tuple(reversed(item))
+
+
+_DUP_STRIP = re.compile(r"[\s\-—–.,!?…]+")
+
+
+def _near_dup_key(line: str) -> int:
+    """
+    Ключ «почти дубликата»: регистр, пробелы, тире и пунктуация не различаются.
+    Храним 8-байтный хэш, а не саму строку.
+    """
+    norm = _DUP_STRIP.sub(" ", line.casefold()).strip()
+    return int.from_bytes(hashlib.blake2b(norm.encode(), digest_size=8).digest(), "little")
+
+
+def iter_invites(patterns, emojis, extras=None, seed: str = DEFAULT_SEED) -> Iterator[str]:
+    """
+    Ленивый детерминированный поток уникальных фраз:
+    1) patterns × emojis × extras, 2) когда исчерпано — patterns × emojis × CLOCKS × TAILS.
+    Почти-дубликаты отсекаются по хэш-индексу; память — O(выданных фраз).
+    """
     extras = extras or [""]
-    pool = []
-    for p, e, t in product(patterns, emojis, extras):
-        s = p.replace("{e}", e)
-        if t:
-            s = f"{s} {t}"
-        pool.append(s.strip())
-    random.shuffle(pool)
-    # уникализуем и нарежем до need
-    uniq = []
-    seen = set()
-    for s in pool:
-        if s not in seen:
-            seen.add(s)
-            uniq.append(s)
-        if len(uniq) >= need:
-            break
-    # если всё же < need — добьём вариациями с хвостами/часиками
-    i = 0
-    while len(uniq) < need:
-        base = patterns[i % len(patterns)].replace("{e}", emojis[i % len(emojis)])
-        tail = random.choice(TAILS)
-        clock = random.choice(CLOCKS)
-        candidate = f"{base} {clock} {tail}".strip()
-        if candidate not in seen:
-            seen.add(candidate)
-            uniq.append(candidate)
-        i += 1
-    return uniq[:need]
+    seen: set[int] = set()
+
+    def emit(s: str):
+        s = " ".join(s.split())
+        k = _near_dup_key(s)
+        if k in seen:
+            return None
+        seen.add(k)
+        return s
+
+    for p, e, t in iter_product_sample([patterns, emojis, extras], f"{seed}:base"):
+        s = emit(p.replace("{e}", e) + (f" {t}" if t else ""))
+        if s:
+            yield s
+    # добиваем вариациями с хвостами/часиками
+    for p, e, clock, tail in iter_product_sample([patterns, emojis, CLOCKS, TAILS], f"{seed}:tail"):
+        s = emit(f"{p.replace('{e}', e)} {clock} {tail}")
+        if s:
+            yield s
+
+
+def mix(patterns, emojis, extras=None, need=100, seed: str = DEFAULT_SEED):
+    """Первые need фраз из iter_invites (меньше, если пространство вариантов исчерпано)."""
+    return list(islice(iter_invites(patterns, emojis, extras, seed), need))
 
 # --- Наборы фраз по играм (шаблоны и эмодзи) ---
 PATTERNS = {
@@ -142,24 +243,135 @@ PATTERNS = {
     },
 }
 
-def build_invites_for(game_key: str) -> list[str]:
+def build_invites_for(game_key: str, need: int = 100, seed: str = DEFAULT_SEED) -> list[str]:
     pack = PATTERNS[game_key]
-    return mix(pack["patterns"], pack["emojis"], extras=[*TAILS, *CLOCKS], need=100)
-
-def upsert_preset(game_key: str, title: str, emoji: str, invite_lines: list[str]):
-    sb.table("gt_game_presets").upsert({
-        "game_key": game_key,
-        "title": title,
-        "emoji": emoji,
-        "invite_lines": invite_lines,
+    # детерминированно для пары (seed, игра)
+    return mix(pack["patterns"], pack["emojis"], extras=[*TAILS, *CLOCKS], need=need, seed=f"{seed}:{game_key}")
+
+
+def _build_row(args: tuple) -> dict:
+    """Полная строка пресета (выполняется и в процессах-воркерах)."""
+    key, meta, pack, need, seed = args
+    PATTERNS.setdefault(key, pack)
+    return {
+        "game_key": key,
+        "title": meta["title"],
+        "emoji": meta["emoji"],
+        "aliases": meta.get("aliases", []),
+        "invite_lines": build_invites_for(key, need=need, seed=seed),
         "is_active": True,
-    }).execute()
+    }
+
+
+def generate_all(keys: list[str], need: int, seed: str, workers: int) -> dict[str, dict]:
+    """Генерирует все пресеты заранее; при workers > 1 — в пуле процессов."""
+    jobs = [(k, GAMES[k], PATTERNS[k], need, seed) for k in keys]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_build_row, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        rows = [_build_row(j) for j in jobs]
+    return {r["game_key"]: r for r in rows}
+
+
+def fetch_current(keys: list[str]) -> dict[str, dict]:
+    """Текущие пресеты из БД (чанками по UPSERT_CHUNK ключей)."""
+    cur: dict[str, dict] = {}
+    for i in range(0, len(keys), UPSERT_CHUNK):
+        res = (
+            _client().table("gt_game_presets")
+            .select("game_key,title,emoji,aliases,invite_lines,is_active")
+            .in_("game_key", keys[i : i + UPSERT_CHUNK])
+            .execute()
+        )
+        for r in res.data or []:
+            cur[r["game_key"]] = r
+    return cur
+
+
+def diff_presets(desired: dict[str, dict], current: dict[str, dict]) -> dict[str, list[str]]:
+    """Разбивает ключи на new / changed / unchanged."""
+    out: dict[str, list[str]] = {"new": [], "changed": [], "unchanged": []}
+    fields = ("title", "emoji", "aliases", "invite_lines", "is_active")
+    for key, row in desired.items():
+        old = current.get(key)
+        if old is None:
+            out["new"].append(key)
+        elif any(old.get(f) != row[f] for f in fields):
+            out["changed"].append(key)
+        else:
+            out["unchanged"].append(key)
+    return out
+
+
+def bulk_upsert(rows: list[dict]) -> None:
+    """Один upsert на чанк строк вместо запроса на каждую игру."""
+    for i in range(0, len(rows), UPSERT_CHUNK):
+        _client().table("gt_game_presets").upsert(rows[i : i + UPSERT_CHUNK]).execute()
+
+
+def load_games_file(path: str) -> None:
+    """
+    Доп. игры из JSON:
+    {"<key>": {"title", "emoji", "aliases": [...], "patterns": [...], "emojis": [...]}}.
+    """
+    with open(path, encoding="utf-8") as f:
+        extra = json.load(f)
+    for key, spec in extra.items():
+        GAMES[key] = {
+            "title": spec["title"],
+            "emoji": spec.get("emoji"),
+            "aliases": spec.get("aliases", []),
+        }
+        PATTERNS[key] = {"patterns": spec["patterns"], "emojis": spec["emojis"]}
+
 
 def main():
-    for key, meta in GAMES.items():
-        invites = build_invites_for(key)
-        upsert_preset(key, meta["title"], meta["emoji"], invites)
-        print(f"Upserted {key}: {len(invites)} lines")
+    ap = argparse.ArgumentParser(description="Seed gt_game_presets")
+    ap.add_argument("--dry-run", action="store_true", help="не писать в БД, только diff и тайминги")
+    ap.add_argument("--lines", type=int, default=100, help="фраз на игру")
+    ap.add_argument("--seed", default=DEFAULT_SEED, help="seed генерации фраз")
+    ap.add_argument("--workers", type=int, default=1, help="процессов для генерации")
+    ap.add_argument("--games", help="только эти game_key через запятую")
+    ap.add_argument("--games-file", help="JSON с дополнительными играми")
+    args = ap.parse_args()
+
+    if args.games_file:
+        load_games_file(args.games_file)
+    keys = [k.strip() for k in args.games.split(",") if k.strip()] if args.games else list(GAMES)
+    unknown = [k for k in keys if k not in GAMES]
+    if unknown:
+        ap.error(f"неизвестные game_key: {', '.join(unknown)} (есть: {', '.join(sorted(GAMES))})")
+
+    t0 = time.perf_counter()
+    desired = generate_all(keys, args.lines, args.seed, args.workers)
+    t_gen = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    current = fetch_current(keys)
+    t_fetch = time.perf_counter() - t0
+
+    diff = diff_presets(desired, current)
+    rows = [desired[k] for k in diff["new"] + diff["changed"]]
+
+    for kind in ("new", "changed"):
+        for key in diff[kind]:
+            print(f"{kind:9s} {key}: {len(desired[key]['invite_lines'])} lines")
+    print(
+        f"games={len(keys)} new={len(diff['new'])} changed={len(diff['changed'])} "
+        f"unchanged={len(diff['unchanged'])}"
+    )
+
+    t_write = 0.0
+    if args.dry_run:
+        print("dry-run: nothing written")
+    elif rows:
+        t0 = time.perf_counter()
+        bulk_upsert(rows)
+        t_write = time.perf_counter() - t0
+        print(f"Upserted {len(rows)} presets")
+
+    print(f"timing: generate {t_gen:.3f}s, fetch {t_fetch:.3f}s, write {t_write:.3f}s")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import Optional, Tuple
+
+# Упоминаний в одном сообщении: с чего начинаем и в каких пределах двигаемся.
+# Длину (4096) и число сущностей дополнительно режет сборщик батча.
+BATCH_MIN = 5
+BATCH_START = 15
+BATCH_MAX = 40  # ~85 символов на строку в HTML — ещё влезает в одно сообщение
+BATCH_STEP = 5
+
+# Пауза между сообщениями (сек)
+PAUSE_MIN = 1.0
+PAUSE_START = 1.5
+PAUSE_MAX = 15.0
+
+# После стольких отправок подряд без RetryAfter — ускоряемся
+CALM_STREAK = 5
+# Ждём голоса вместо новых тегов, если при текущем темпе «Иду»
+# цель наберётся быстрее, чем за столько секунд
+VOTE_HORIZON = 20.0
+
+
+class AdaptiveBatcher:
+    """
+    Размер батча и пауза для одного созыва «Позвать всех».
+
+    - RetryAfter: ждём сколько сказал Telegram, паузу удваиваем,
+      батч — до максимума (меньше сообщений при том же охвате);
+    - CALM_STREAK отправок без флуд-лимита — пауза ×0.8, батч +BATCH_STEP;
+    - по голосам «Иду»: доля откликнувшихся на одно упоминание задаёт,
+      сколько ещё людей имеет смысл звать (батч не больше этого);
+      если голоса идут быстро и цель вот-вот наберётся — пауза
+      растягивается до ожидаемого времени набора (до PAUSE_MAX).
+    """
+
+    def __init__(self, batch: Optional[int] = None, pause: Optional[float] = None) -> None:
+        self._size = min(BATCH_MAX, max(BATCH_MIN, int(batch or BATCH_START)))
+        self._pause = min(PAUSE_MAX, max(PAUSE_MIN, float(pause or PAUSE_START)))
+        self._calm = 0
+        self._cap: Optional[int] = None  # сколько ещё стоит звать по отклику
+        self._wait = 0.0  # доп. ожидание голосов перед следующим батчем
+        self._yield: Optional[float] = None  # «Иду» на одно упоминание (сглаженное)
+        self._last: Optional[Tuple[float, int, int]] = None  # (t, going, mentioned)
+        self.retry_afters = 0
+
+    @property
+    def batch_size(self) -> int:
+        if self._cap is None:
+            return self._size
+        return max(BATCH_MIN, min(self._size, self._cap))
+
+    @property
+    def pause(self) -> float:
+        return min(PAUSE_MAX, self._pause + self._wait)
+
+    def on_sent(self) -> None:
+        self._calm += 1
+        if self._calm >= CALM_STREAK:
+            self._calm = 0
+            self._pause = max(PAUSE_MIN, self._pause * 0.8)
+            self._size = min(BATCH_MAX, self._size + BATCH_STEP)
+
+    def on_retry_after(self, seconds: float) -> None:
+        self.retry_afters += 1
+        self._calm = 0
+        self._pause = min(PAUSE_MAX, max(self._pause * 2, PAUSE_MIN))
+        self._size = BATCH_MAX
+
+    def on_progress(self, going: int, target: int, mentioned: int) -> None:
+        """going — сколько «Иду» сейчас, mentioned — скольких уже упомянули в созыве."""
+        now = time.monotonic()
+        remaining = max(0, target - going)
+        velocity = 0.0
+        if self._last is not None:
+            t0, g0, m0 = self._last
+            dg, dm, dt = going - g0, mentioned - m0, now - t0
+            if dm > 0 and dg >= 0:
+                rate = dg / dm
+                self._yield = rate if self._yield is None else (self._yield + rate) / 2
+            if dt > 0 and dg > 0:
+                velocity = dg / dt
+        self._last = (now, going, mentioned)
+
+        if self._yield:
+            self._cap = math.ceil(remaining / self._yield)
+        # голоса идут и цель близко — даём им дойти, а не зовём новых
+        eta = remaining / velocity if velocity > 0 else math.inf
+        self._wait = eta if eta <= VOTE_HORIZON else 0.0
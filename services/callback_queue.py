@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Воркер сессии, простоявший без задач столько секунд, завершается
+IDLE_TIMEOUT = 30.0
+# Не больше стольких ожидающих изменений на одну сессию
+MAX_PENDING = 200
+
+log = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+ErrorHandler = Callable[[BaseException], Awaitable[None]]
+
+
+class SessionQueue:
+    """
+    Отложенное применение нажатий по сессиям набора.
+
+    Хендлер отвечает на колбэк сразу, а само изменение (запись в БД +
+    перерисовка шапки) кладёт сюда. На каждую сессию — своя очередь и
+    свой воркер: изменения одной сессии применяются строго по порядку
+    нажатий, разные сессии не ждут друг друга. Воркер создаётся при
+    первом нажатии и завершается после IDLE_TIMEOUT без работы.
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, max_pending: int = MAX_PENDING) -> None:
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+        self._queues: Dict[str, "asyncio.Queue[Tuple[Job, Optional[ErrorHandler]]]"] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self.counts: Dict[str, int] = {"queued": 0, "done": 0, "failed": 0, "rejected": 0}
+
+    def submit(self, key: str, job: Job, on_error: Optional[ErrorHandler] = None) -> bool:
+        """Ставит изменение в очередь сессии. False — очередь переполнена."""
+        q = self._queues.get(key)
+        if q is None:
+            q = self._queues[key] = asyncio.Queue(maxsize=self.max_pending)
+            self._workers[key] = asyncio.create_task(self._worker(key, q))
+        try:
+            q.put_nowait((job, on_error))
+        except asyncio.QueueFull:
+            self.counts["rejected"] += 1
+            return False
+        self.counts["queued"] += 1
+        return True
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues.values())
+
+    async def _worker(self, key: str, q: "asyncio.Queue[Tuple[Job, Optional[ErrorHandler]]]") -> None:
+        while True:
+            try:
+                job, on_error = await asyncio.wait_for(q.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if q.empty():
+                    # между проверкой и удалением нет await — submit не проскочит
+                    del self._queues[key]
+                    del self._workers[key]
+                    return
+                continue
+            try:
+                await job()
+                self.counts["done"] += 1
+            except Exception as e:
+                self.counts["failed"] += 1
+                if on_error is None:
+                    log.warning("callback_queue: job for %s failed: %r", key, e)
+                else:
+                    try:
+                        await on_error(e)
+                    except Exception as e2:
+                        log.warning("callback_queue: error handler for %s failed: %r", key, e2)
+            finally:
+                q.task_done()
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Дожидается применения всего, что уже в очередях (при остановке бота)."""
+        queues = list(self._queues.values())
+        if not queues:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning("callback_queue: %s changes left unapplied on shutdown", self.pending())
+        for t in list(self._workers.values()):
+            t.cancel()
+        self._queues.clear()
+        self._workers.clear()
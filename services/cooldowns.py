@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+# Устойчивые импорты (корень или подпапки)
+try:
+    from supabase_repo import SupabaseRepo
+except ModuleNotFoundError:
+    from repo.supabase_repo import SupabaseRepo
+
+
+# Как часто (сек) фоновый sweeper чистит просроченные строки gt_cooldowns
+SWEEP_EVERY = 600
+
+log = logging.getLogger(__name__)
+
+
+class CooldownService:
+    """
+    Активные кулдауны («Не сегодня») в памяти процесса.
+
+    - {chat_id: {user_id: until_ts}} — проверка «на кулдауне?» без БД;
+    - min-heap (until_ts, chat_id, user_id) — истёкшие снимаются с вершины
+      за O(log n), без перебора всех записей;
+    - при старте поднимаем активные кулдауны из gt_cooldowns (load);
+    - фоновый sweeper удаляет истёкшие строки в БД одним запросом,
+      чтобы таблица не росла бесконечно.
+
+    Устаревшие записи в куче (кулдаун продлили) не удаляются сразу,
+    а пропускаются при снятии с вершины — сверяемся с until_ts в словаре.
+
+    Подписчики (add_listener) получают (chat_id, user_id, active)
+    при появлении и истечении кулдауна.
+    """
+
+    def __init__(self, repo: SupabaseRepo) -> None:
+        self.repo = repo
+        self._active: Dict[int, Dict[int, float]] = {}
+        self._heap: List[Tuple[float, int, int]] = []
+        self._listeners: List[Callable[[int, int, bool], None]] = []
+        # False — load() не удался: в памяти не все кулдауны, фильтровать по БД
+        self.loaded = False
+
+    def add_listener(self, fn: Callable[[int, int, bool], None]) -> None:
+        self._listeners.append(fn)
+
+    def _notify(self, chat_id: int, user_id: int, active: bool) -> None:
+        for fn in self._listeners:
+            try:
+                fn(chat_id, user_id, active)
+            except Exception as e:
+                log.warning("cooldowns: listener failed: %r", e)
+
+    # ---------- загрузка / запись ----------
+    def load(self) -> int:
+        """Поднимает активные кулдауны из БД. Возвращает их количество."""
+        rows = self.repo.list_active_cooldowns()
+        for chat_id, user_id, until_ts in rows:
+            self.remember(chat_id, user_id, until_ts)
+        self.loaded = True
+        return len(rows)
+
+    def remember(self, chat_id: int, user_id: int, until_ts: float) -> None:
+        """Учитывает кулдаун в памяти (без записи в БД)."""
+        if until_ts <= time.time():
+            return
+        self._active.setdefault(chat_id, {})[user_id] = until_ts
+        heapq.heappush(self._heap, (until_ts, chat_id, user_id))
+        self._notify(chat_id, user_id, True)
+
+    # ---------- чтение ----------
+    def active_ids(self, chat_id: int) -> Set[int]:
+        """user_id с активным кулдауном в чате."""
+        self._expire(time.time())
+        return set(self._active.get(chat_id, ()))
+
+    def is_active(self, chat_id: int, user_id: int) -> bool:
+        until = self._active.get(chat_id, {}).get(user_id)
+        return until is not None and until > time.time()
+
+    # ---------- истечение ----------
+    def expire_due(self) -> None:
+        """Снимает истёкшие кулдауны (подписчики получают уведомления)."""
+        self._expire(time.time())
+
+    def _expire(self, now: float) -> List[Tuple[int, int]]:
+        """Снимает истёкшие кулдауны с вершины кучи. Возвращает [(chat_id, user_id)]."""
+        expired: List[Tuple[int, int]] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            until, chat_id, user_id = heapq.heappop(heap)
+            per_chat = self._active.get(chat_id)
+            if not per_chat or per_chat.get(user_id) != until:
+                continue  # запись устарела — кулдаун продлевали
+            del per_chat[user_id]
+            if not per_chat:
+                del self._active[chat_id]
+            expired.append((chat_id, user_id))
+            self._notify(chat_id, user_id, False)
+        return expired
+
+    async def run_sweeper(self, interval: float = SWEEP_EVERY) -> None:
+        """Фоновая задача: чистит память и пачкой удаляет истёкшие строки в БД."""
+        while True:
+            await asyncio.sleep(interval)
+            self._expire(time.time())
+            try:
+                removed = await asyncio.to_thread(self.repo.purge_expired_cooldowns)
+                if removed:
+                    log.info("cooldowns: purged %s expired rows", removed)
+            except Exception as e:
+                log.warning("cooldowns: purge failed: %r", e)
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from repo.supabase_repo import SupabaseRepo
+    from services.cooldowns import CooldownService
+
+
+log = logging.getLogger(__name__)
+
+# Позиции установленных битов для каждого байта — чтобы разворачивать
+# битсет в список индексов за O(n/8 + k), а не по биту за раз.
+_BITS_OF_BYTE = [tuple(i for i in range(8) if b >> i & 1) for b in range(256)]
+
+
+def _insert_bit(bits: int, pos: int, value: bool) -> int:
+    """Вставляет бит в позицию pos, сдвигая старшие биты влево."""
+    low = bits & ((1 << pos) - 1)
+    high = bits >> pos
+    return low | (high << (pos + 1)) | (int(value) << pos)
+
+
+def _set_bit(bits: int, pos: int, value: bool) -> int:
+    return bits | (1 << pos) if value else bits & ~(1 << pos)
+
+
+def _iter_set_bits(bits: int, nbits: int) -> Iterable[int]:
+    raw = bits.to_bytes((nbits + 7) // 8 or 1, "little")
+    for byte_idx, b in enumerate(raw):
+        if b:
+            base = byte_idx * 8
+            for i in _BITS_OF_BYTE[b]:
+                yield base + i
+
+
+class UserTable:
+    """
+    Все известные боту пользователи: отсортированный array('q') user_id
+    и битсет opted_out (глобальный флаг gt_users). Позиция бита = индекс в ids.
+    """
+
+    __slots__ = ("ids", "opted")
+
+    def __init__(self) -> None:
+        self.ids = array("q")
+        self.opted = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index(self, user_id: int) -> int:
+        """Индекс user_id или -1."""
+        i = bisect_left(self.ids, user_id)
+        return i if i < len(self.ids) and self.ids[i] == user_id else -1
+
+    def all_mask(self) -> int:
+        return (1 << len(self.ids)) - 1
+
+    def memory_bytes(self) -> int:
+        return self.ids.buffer_info()[1] * self.ids.itemsize + sys.getsizeof(self.opted)
+
+
+class ChatEligibility:
+    """
+    Битсеты одного чата поверх общего UserTable:
+    excluded (gt_exclusions), cooldown («Не сегодня»), present (не известно,
+    что вышел из чата). При загрузке чата present все известные; новый
+    пользователь — только в чате, где его увидели (см. _update_chat).
+    """
+
+    __slots__ = ("excluded", "cooldown", "present")
+
+    def __init__(self, nbits: int) -> None:
+        self.excluded = 0
+        self.cooldown = 0
+        self.present = (1 << nbits) - 1
+
+    def insert(self, pos: int) -> None:
+        self.excluded = _insert_bit(self.excluded, pos, False)
+        self.cooldown = _insert_bit(self.cooldown, pos, False)
+        self.present = _insert_bit(self.present, pos, False)
+
+    def memory_bytes(self) -> int:
+        return sum(sys.getsizeof(getattr(self, f)) for f in self.__slots__)
+
+
+class EligibilityIndex:
+    """
+    Кому можно слать теги — без пересборки множеств на каждый «Позвать всех».
+
+    eligible = all & ~opted & ~excluded & ~cooldown & present
+
+    Таблица пользователей грузится один раз (warm_up, страницами из gt_users),
+    битсеты чата — при первом обращении к нему. Дальше всё обновляется
+    точечно: /optout, /optin, «Не сегодня» (через CooldownService),
+    сообщения и chat_member-апдейты. Пока warm_up не закончен, обновления
+    копятся в буфере и применяются поверх загруженной таблицы.
+    """
+
+    def __init__(self, repo: "SupabaseRepo", cooldowns: Optional["CooldownService"] = None) -> None:
+        self.repo = repo
+        self.cooldowns = cooldowns
+        self.users = UserTable()
+        self._chats: Dict[int, ChatEligibility] = {}
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self.ready = False
+        # до конца warm_up: user_id -> явный opted_out (None — просто «видели»);
+        # None вместо словаря — буфер выключен
+        self._early: Optional[Dict[int, Optional[bool]]] = {}
+        if cooldowns is not None:
+            cooldowns.add_listener(self._on_cooldown)
+
+    # ---------- загрузка ----------
+    async def warm_up(self) -> None:
+        """
+        Загружает всех пользователей (страницы идут по возрастанию user_id).
+        Флаг opted_out из gt_users главнее того, что было в таблице до загрузки;
+        после загрузки применяются накопленные за это время обновления.
+        """
+        pages = self.repo.iter_user_pages()
+        try:
+            while True:
+                rows = await asyncio.to_thread(next, pages, None)
+                if rows is None:
+                    break
+                for r in rows:
+                    self.add_user(r["user_id"], bool(r.get("is_opted_out")))
+        except Exception as e:
+            # индекс не используется — дальше обновления идут в таблицу напрямую
+            self._early = None
+            log.warning("eligibility: warm-up failed, staying on DB queries: %r", e)
+            return
+        early, self._early = self._early or {}, None
+        for uid, opted_out in early.items():
+            # /optout и /optin во время загрузки новее прочитанной страницы
+            self.add_user(uid, opted_out)
+        self.ready = True
+        log.info("eligibility: %s users loaded", len(self.users))
+
+    async def _chat(self, chat_id: int) -> ChatEligibility:
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            return chat
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                excluded = await asyncio.to_thread(self.repo.list_excluded_ids, chat_id)
+                chat = ChatEligibility(len(self.users))
+                for uid in excluded:
+                    i = self.users.index(uid)
+                    if i >= 0:
+                        chat.excluded = _set_bit(chat.excluded, i, True)
+                if self.cooldowns is not None:
+                    for uid in self.cooldowns.active_ids(chat_id):
+                        i = self.users.index(uid)
+                        if i >= 0:
+                            chat.cooldown = _set_bit(chat.cooldown, i, True)
+                self._chats[chat_id] = chat
+        return chat
+
+    # ---------- инкрементальные обновления ----------
+    def add_user(self, user_id: int, opted_out: Optional[bool] = None) -> int:
+        """
+        Добавляет пользователя (если его нет). Возвращает индекс.
+        opted_out=None — флаг не трогаем (новому — False), иначе ставим его
+        и уже известному пользователю. В загруженных чатах новый — не present.
+        """
+        users = self.users
+        n = len(users.ids)
+        if not n or users.ids[-1] < user_id:
+            # быстрый путь: загрузка идёт по возрастанию — дописываем в конец
+            pos = n
+            users.ids.append(user_id)
+            if opted_out:
+                users.opted |= 1 << pos
+            return pos
+        pos = bisect_left(users.ids, user_id)
+        if users.ids[pos] == user_id:
+            if opted_out is not None and bool(users.opted >> pos & 1) != opted_out:
+                users.opted = _set_bit(users.opted, pos, opted_out)
+            return pos
+        users.ids.insert(pos, user_id)
+        users.opted = _insert_bit(users.opted, pos, bool(opted_out))
+        for chat in self._chats.values():
+            chat.insert(pos)
+        return pos
+
+    def set_opted_out(self, user_id: int, value: bool) -> None:
+        if self._early is not None:
+            self._early[user_id] = value
+            return
+        self.add_user(user_id, value)
+
+    def _update_chat(self, chat_id: int, user_id: int, field: str, value: bool) -> None:
+        if self._early is not None:
+            # до загрузки чаты не читаются — достаточно запомнить пользователя,
+            # состояние чата возьмём при его загрузке
+            self._early.setdefault(user_id, None)
+            return
+        known = len(self.users)
+        pos = self.add_user(user_id)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return  # чат ещё не загружен — прочитаем актуальное при загрузке
+        if len(self.users) > known and field != "present":
+            # новый пользователь — кандидат только в чате, где его увидели
+            chat.present = _set_bit(chat.present, pos, True)
+        bits = getattr(chat, field)
+        if bool(bits >> pos & 1) != value:  # без лишнего копирования битсета
+            setattr(chat, field, _set_bit(bits, pos, value))
+
+    def set_excluded(self, chat_id: int, user_id: int, value: bool) -> None:
+        self._update_chat(chat_id, user_id, "excluded", value)
+
+    def set_present(self, chat_id: int, user_id: int, value: bool) -> None:
+        self._update_chat(chat_id, user_id, "present", value)
+
+    def _on_cooldown(self, chat_id: int, user_id: int, active: bool) -> None:
+        self._update_chat(chat_id, user_id, "cooldown", active)
+
+    # ---------- выборка ----------
+    async def eligible_mask(self, chat_id: int) -> int:
+        if self.cooldowns is not None:
+            self.cooldowns.expire_due()  # снятые кулдауны придут через _on_cooldown
+        chat = await self._chat(chat_id)
+        users = self.users
+        return users.all_mask() & ~users.opted & ~chat.excluded & ~chat.cooldown & chat.present
+
+    async def eligible_pages(self, chat_id: int, page_size: int = 1000) -> AsyncIterator[List[int]]:
+        """Подходящие user_id чата страницами по page_size (по возрастанию id)."""
+        mask = await self.eligible_mask(chat_id)
+        ids = self.users.ids
+        page: List[int] = []
+        for i in _iter_set_bits(mask, len(ids)):
+            page.append(ids[i])
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Оценка занятой памяти: общая таблица и битсеты по чатам."""
+        return {
+            "users": self.users.memory_bytes(),
+            "chats": sum(c.memory_bytes() for c in self._chats.values()),
+        }
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, List, Tuple
+
+if TYPE_CHECKING:
+    from repo.supabase_repo import SupabaseRepo
+
+
+# Что делать с теми, кого уже тегали в окне:
+# "skip" — не звать; "defer" — звать после всех остальных
+POLICY_SKIP = "skip"
+POLICY_DEFER = "defer"
+
+# Окно по умолчанию (сек): тег раньше этого не мешает звать снова
+WINDOW = 3600
+# Последних тегов на чат в памяти (кольцевой буфер)
+RING_SIZE = 20_000
+# Как часто (сек) сбрасывать накопленные теги в gt_pings одним upsert'ом
+FLUSH_EVERY = 5.0
+# Как часто (сек) удалять из БД теги старше окна
+PURGE_EVERY = 3600.0
+
+log = logging.getLogger(__name__)
+
+
+class _ChatPings:
+    """Кольцо (user_id, ts) в порядке тегов + последний ts каждого пользователя."""
+
+    __slots__ = ("ring", "last")
+
+    def __init__(self, size: int) -> None:
+        self.ring: Deque[Tuple[int, float]] = deque(maxlen=size)
+        self.last: Dict[int, float] = {}
+
+    def add(self, user_id: int, ts: float) -> None:
+        ring = self.ring
+        if len(ring) == ring.maxlen:
+            self._drop(*ring[0])
+        ring.append((user_id, ts))
+        self.last[user_id] = ts
+
+    def expire(self, before: float) -> None:
+        ring = self.ring
+        while ring and ring[0][1] < before:
+            self._drop(*ring.popleft())
+
+    def _drop(self, user_id: int, ts: float) -> None:
+        # в кольце могут быть и более свежие теги того же пользователя
+        if self.last.get(user_id) == ts:
+            del self.last[user_id]
+
+
+class PingBudget:
+    """
+    Кого недавно тегали в чате — чтобы три «Позвать всех» за час
+    не будили одних и тех же людей три раза.
+
+    - на чат — кольцевой буфер последних тегов (не больше RING_SIZE);
+    - отправленные теги копятся и уходят в gt_pings пачкой раз в FLUSH_EVERY;
+    - при старте окно поднимается из БД (load);
+    - тегнутых в окне split() откладывает в конец созыва или выкидывает.
+    """
+
+    def __init__(
+        self,
+        repo: "SupabaseRepo",
+        window: int = WINDOW,
+        policy: str = POLICY_DEFER,
+        ring_size: int = RING_SIZE,
+    ) -> None:
+        self.repo = repo
+        self.window = window
+        self.policy = policy
+        self.ring_size = ring_size
+        self._chats: Dict[int, _ChatPings] = {}
+        self._pending: Dict[Tuple[int, int], float] = {}
+        self.counts: Dict[str, int] = {"pinged": 0, "deferred": 0, "skipped": 0}
+
+    def load(self) -> int:
+        """Поднимает теги за последнее окно из БД. Возвращает их количество."""
+        since = datetime.fromtimestamp(time.time() - self.window, timezone.utc)
+        rows = sorted(self.repo.list_recent_pings(since), key=lambda r: r[2])
+        for chat_id, user_id, ts in rows:
+            self._chat(chat_id).add(user_id, ts)
+        return len(rows)
+
+    def _chat(self, chat_id: int) -> _ChatPings:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatPings(self.ring_size)
+        return chat
+
+    def split(self, chat_id: int, user_ids: Iterable[int]) -> Tuple[List[int], List[int]]:
+        """
+        (кого звать сейчас, кого позвать в конце созыва).
+        При политике skip второй список всегда пуст.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return list(user_ids), []
+        chat.expire(time.time() - self.window)
+        fresh: List[int] = []
+        recent: List[int] = []
+        for uid in user_ids:
+            (recent if uid in chat.last else fresh).append(uid)
+        if self.policy == POLICY_SKIP:
+            self.counts["skipped"] += len(recent)
+            return fresh, []
+        self.counts["deferred"] += len(recent)
+        return fresh, recent
+
+    def mark(self, chat_id: int, user_ids: Iterable[int]) -> None:
+        """Учитывает отправленные теги (в БД — при следующем flush)."""
+        now = time.time()
+        chat = self._chat(chat_id)
+        for uid in user_ids:
+            chat.add(uid, now)
+            self._pending[(chat_id, uid)] = now
+            self.counts["pinged"] += 1
+
+    async def flush(self) -> int:
+        """Пишет накопленные теги одним bulk upsert. Возвращает их число."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [
+            {
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "pinged_at": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            }
+            for (chat_id, user_id), ts in pending.items()
+        ]
+        try:
+            await asyncio.to_thread(self.repo.upsert_pings, rows)
+        except Exception as e:
+            # в памяти теги остались; после рестарта окно будет неполным — не страшно
+            log.warning("pings: flush of %s rows failed: %r", len(rows), e)
+            return 0
+        return len(rows)
+
+    async def run_flusher(self, interval: float = FLUSH_EVERY) -> None:
+        last_purge = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+                if time.monotonic() - last_purge >= PURGE_EVERY:
+                    last_purge = time.monotonic()
+                    before = datetime.fromtimestamp(time.time() - self.window, timezone.utc)
+                    try:
+                        removed = await asyncio.to_thread(self.repo.purge_old_pings, before)
+                        if removed:
+                            log.info("pings: purged %s old rows", removed)
+                    except Exception as e:
+                        log.warning("pings: purge failed: %r", e)
+        finally:
+            await self.flush()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from repo.supabase_repo import Preset
+
+
+# Порог уверенного совпадения и порог «может, вы имели в виду»
+MATCH_SCORE = 0.5
+SUGGEST_SCORE = 0.25
+MAX_SUGGESTIONS = 3
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+# Латиница, звучащая одинаково: Codenames ~ «Коднеймс», Gartic ~ «Гартик»
+_LATIN_FOLD = (("ck", "k"), ("c", "k"), ("q", "k"), ("w", "v"), ("x", "ks"), ("y", "i"))
+_NON_WORD = re.compile(r"[^0-9a-zа-я]+")
+
+
+def fold(text: str) -> str:
+    """
+    Ключ сравнения: casefold, ё->е, транслит кириллицы в латиницу,
+    сведение похожих латинских букв, без пунктуации и пробелов.
+    """
+    s = _NON_WORD.sub("", (text or "").casefold().replace("ё", "е"))
+    s = "".join(_TRANSLIT.get(ch, ch) for ch in s)
+    for a, b in _LATIN_FOLD:
+        s = s.replace(a, b)
+    return s
+
+
+def _trigrams(s: str) -> Set[str]:
+    padded = f"  {s} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    preset: Optional["Preset"] = None
+    suggestions: List["Preset"] = field(default_factory=list)
+
+
+class PresetSearchIndex:
+    """
+    Поиск пресета по game_key / title / aliases для /call <игра>.
+
+    - точное совпадение и префикс — по словарю свёрнутых имён (O(1));
+    - подстрока — по свёрнутым именам (их единицы-десятки);
+    - опечатки — по индексу триграмм: кандидаты набираются из
+      постинг-листов, оценка — коэффициент Дайса.
+    Строится один раз на снимок пресетов и дальше только читается.
+    """
+
+    def __init__(self, presets: Iterable["Preset"]) -> None:
+        self._presets: Dict[str, "Preset"] = {}
+        self._exact: Dict[str, str] = {}
+        self._names: List[Tuple[str, str, Set[str]]] = []  # (folded, game_key, trigrams)
+        self._postings: Dict[str, List[int]] = {}
+
+        for p in presets:
+            self._presets[p.game_key] = p
+            names = [p.game_key, p.title, *(getattr(p, "aliases", None) or [])]
+            for name in names:
+                key = fold(name)
+                if not key:
+                    continue
+                self._exact.setdefault(key, p.game_key)
+                grams = _trigrams(key)
+                idx = len(self._names)
+                self._names.append((key, p.game_key, grams))
+                for g in grams:
+                    self._postings.setdefault(g, []).append(idx)
+
+    def resolve(self, query: str) -> SearchResult:
+        q = fold(query)
+        if not q:
+            return SearchResult()
+
+        hit = self._exact.get(q)
+        if hit:
+            return SearchResult(self._presets[hit])
+
+        # подстрока/префикс: «/call code», «/call захват»
+        if len(q) >= 3:
+            keys = {gk for name, gk, _ in self._names if q in name}
+            if len(keys) == 1:
+                return SearchResult(self._presets[keys.pop()])
+
+        ranked = self._rank(q)
+        if ranked and ranked[0][0] >= MATCH_SCORE and (
+            len(ranked) == 1 or ranked[0][0] > ranked[1][0]
+        ):
+            return SearchResult(self._presets[ranked[0][1]])
+        return SearchResult(
+            suggestions=[self._presets[gk] for score, gk in ranked[:MAX_SUGGESTIONS] if score >= SUGGEST_SCORE]
+        )
+
+    def _rank(self, q: str) -> List[Tuple[float, str]]:
+        """[(score, game_key)] по убыванию, лучший балл на каждую игру."""
+        qgrams = _trigrams(q)
+        shared: Counter = Counter()
+        for g in qgrams:
+            for idx in self._postings.get(g, ()):
+                shared[idx] += 1
+        best: Dict[str, float] = {}
+        for idx, n in shared.items():
+            _, gk, grams = self._names[idx]
+            score = 2.0 * n / (len(qgrams) + len(grams))
+            if score > best.get(gk, 0.0):
+                best[gk] = score
+        return sorted(((s, gk) for gk, s in best.items()), reverse=True)
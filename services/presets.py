@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+# Устойчивые импорты (корень или подпапки)
+try:
+    from supabase_repo import SupabaseRepo, Preset
+except ModuleNotFoundError:
+    from repo.supabase_repo import SupabaseRepo, Preset
+
+import texts
+
+try:
+    from preset_search import PresetSearchIndex, SearchResult
+except ModuleNotFoundError:
+    from services.preset_search import PresetSearchIndex, SearchResult
+
+from utils.entities import Line, md_to_html, md_to_line
+
+
+# Как часто (сек) проверять gt_game_presets.updated_at
+POLL_EVERY = 60
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PresetSnapshot:
+    """
+    Неизменяемый снимок активных пресетов + заранее отрендеренный HTML.
+    Хендлеры и сервисы читают его без блокировок: перезагрузка
+    собирает новый снимок и подменяет ссылку одним присваиванием.
+    """
+
+    version: Optional[str] = None
+    presets: Mapping[str, Preset] = field(default_factory=lambda: MappingProxyType({}))
+    # game_key -> {сырая фраза: HTML}
+    invite_html: Mapping[str, Mapping[str, str]] = field(default_factory=lambda: MappingProxyType({}))
+    # game_key -> {сырая фраза: текст + bold-сущности} для TAG_RENDER=entities
+    invite_entities: Mapping[str, Mapping[str, Line]] = field(default_factory=lambda: MappingProxyType({}))
+    # game_key -> HTML заголовка шапки
+    header_html: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    # поиск для /call <игра>
+    search: PresetSearchIndex = field(default_factory=lambda: PresetSearchIndex(()))
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    @classmethod
+    def build(cls, version: str, presets: List[Preset]) -> "PresetSnapshot":
+        by_key: Dict[str, Preset] = {}
+        invite_html: Dict[str, Mapping[str, str]] = {}
+        invite_entities: Dict[str, Mapping[str, Line]] = {}
+        header_html: Dict[str, str] = {}
+        for p in presets:
+            by_key[p.game_key] = p
+            invite_html[p.game_key] = MappingProxyType(
+                {line: md_to_html(line) for line in p.invite_lines}
+            )
+            invite_entities[p.game_key] = MappingProxyType(
+                {line: md_to_line(line) for line in p.invite_lines}
+            )
+            header_html[p.game_key] = md_to_html(texts.header(p.title, p.emoji))
+        return cls(
+            version=version,
+            presets=MappingProxyType(by_key),
+            invite_html=MappingProxyType(invite_html),
+            invite_entities=MappingProxyType(invite_entities),
+            header_html=MappingProxyType(header_html),
+            search=PresetSearchIndex(presets),
+        )
+
+    def active(self) -> List[Preset]:
+        """Активные пресеты в порядке title (как list_active_presets)."""
+        return list(self.presets.values())
+
+
+class PresetStore:
+    """
+    Актуальные пресеты для хендлеров, SessionService и TaggingService.
+
+    - reload(): читает версию (число строк + max(updated_at)) и, если она
+      изменилась, грузит пресеты в потоке и атомарно подменяет снимок;
+    - run_poller(): фоновая проверка версии раз в POLL_EVERY секунд;
+    - до первой загрузки get() ходит в репозиторий напрямую.
+    """
+
+    def __init__(self, repo: SupabaseRepo) -> None:
+        self.repo = repo
+        self._snapshot = PresetSnapshot()
+        self._lock = asyncio.Lock()
+
+    @property
+    def snapshot(self) -> PresetSnapshot:
+        return self._snapshot
+
+    def get(self, game_key: str) -> Optional[Preset]:
+        snap = self._snapshot
+        if snap.loaded:
+            return snap.presets.get(game_key)
+        return self.repo.get_preset(game_key)
+
+    def list_active(self) -> List[Preset]:
+        snap = self._snapshot
+        if snap.loaded:
+            return snap.active()
+        return self.repo.list_active_presets()
+
+    def search(self, query: str) -> SearchResult:
+        """Пресет по game_key / title / aliases с допуском опечаток."""
+        snap = self._snapshot
+        if snap.loaded:
+            return snap.search.resolve(query)
+        return PresetSearchIndex(self.repo.list_active_presets()).resolve(query)
+
+    async def reload(self, force: bool = False) -> bool:
+        """Перечитывает пресеты, если версия изменилась. True — снимок заменён."""
+        async with self._lock:
+            version = await asyncio.to_thread(self.repo.get_presets_version)
+            if not force and version == self._snapshot.version:
+                return False
+            presets = await asyncio.to_thread(self.repo.list_active_presets)
+            self._snapshot = PresetSnapshot.build(version, presets)
+        log.info("presets: loaded %s active (version %s)", len(presets), version)
+        return True
+
+    async def run_poller(self, interval: float = POLL_EVERY) -> None:
+        while True:
+            try:
+                await self.reload()
+            except Exception as e:
+                log.warning("presets: reload failed: %r", e)
+            await asyncio.sleep(interval)
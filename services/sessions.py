@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 import html
+import logging
+import itertools
 import re
-from typing import List
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -19,28 +23,112 @@ try:
 except ModuleNotFoundError:
     from handlers import texts
 
+try:
+    from presets import PresetStore
+except ModuleNotFoundError:
+    from services.presets import PresetStore
+
+from utils.entities import md_to_html, utf16_len
+
+
+# Как часто (сек) закрывать просроченные сессии и переносить закрытые в архив
+EXPIRE_EVERY = 300
+# Сколько сессий закрывать за проход (дальше — на следующем)
+EXPIRE_BATCH = 100
+# Закрытая сессия живёт в горячих таблицах ещё сутки (поздние клики), потом — в архив
+ARCHIVE_AFTER = 24 * 3600
+ARCHIVE_BATCH = 500
+# Сколько отрендеренных шапок (текст + клавиатура) держать в памяти
+RENDER_CACHE_SIZE = 512
+# Сколько сессий помнить по версиям (старые вытесняются)
+VERSIONS_MAX = 8 * RENDER_CACHE_SIZE
+
+# Бюджет шапки. Telegram режет сообщение длиннее 4096 символов видимого текста
+# (в UTF-16), а при сотнях ссылок-упоминаний — и по числу сущностей.
+# В шапке: счётчики + первые имена каждого списка + «+K», остальное — в «Весь список».
+HEADER_MAX_LEN = 4000
+HEADER_MAX_MENTIONS = 50
+HEADER_NAMES_PER_LIST = 20
+# место под « +K» в конце каждого списка
+TAIL_RESERVE = 8
+# имён на странице «Весь список»
+DETAIL_PAGE_SIZE = 50
+
+log = logging.getLogger(__name__)
+
 
-# ---------- Markdown -> HTML (жирный) ----------
-def _md_to_html(text: str) -> str:
-    """
-    Лёгкая конвертация markdown-**жирного** в HTML <b>…</b>, остальное экранируем.
-    """
-    placeholder_open = "\u0001"
-    placeholder_close = "\u0002"
+# ---------- Упоминание: @username | Имя | «игрок» ----------
+def _label(u: Optional[dict]) -> str:
+    if u and u.get("username"):
+        return f"@{u['username']}"
+    if u and u.get("first_name"):
+        return u["first_name"]
+    return "игрок"
 
-    def mark_bold(m: re.Match) -> str:
-        inner = m.group(1)
-        return f"{placeholder_open}{inner}{placeholder_close}"
 
-    marked = re.sub(r"\*\*(.+?)\*\*", mark_bold, text)
-    escaped = html.escape(marked)
-    return escaped.replace(placeholder_open, "<b>").replace(placeholder_close, "</b>")
+def _mention_html(uid: int, label: str) -> str:
+    return f'<a href="tg://user?id={uid}">{html.escape(label)}</a>'
+
+
+_TAG = re.compile(r"<[^>]+>")
+
+
+def _visible_len(text_html: str) -> int:
+    return utf16_len(html.unescape(_TAG.sub("", text_html)))
 
 
 class SessionService:
-    def __init__(self, bot: Bot, repo: SupabaseRepo) -> None:
+    def __init__(self, bot: Bot, repo: SupabaseRepo, presets: Optional[PresetStore] = None) -> None:
         self.bot = bot
         self.repo = repo
+        self.presets = presets
+        # версия сессии меняется при каждом RSVP/смене цели (changed());
+        # номера берём из общего счётчика, так что вытесненная и заново
+        # заведённая сессия не совпадёт со старым ключом рендера.
+        # (session_id, версия, режим выбора, версия пресетов) -> (HTML, клавиатура)
+        self._seq = itertools.count(1)
+        self._versions: "OrderedDict[str, int]" = OrderedDict()
+        self._rendered: "OrderedDict[tuple, Tuple[str, InlineKeyboardMarkup]]" = OrderedDict()
+        # session_id -> (message_id, ключ рендера), который сейчас в чате
+        self._shown: "OrderedDict[str, Tuple[int, tuple]]" = OrderedDict()
+        # session_id -> {user_id: status} по последней сводке из БД
+        self._votes: "OrderedDict[str, Dict[int, str]]" = OrderedDict()
+        self.counts: Dict[str, int] = {
+            "render_hit": 0,
+            "render_miss": 0,
+            "edit_skipped": 0,
+            # повторные одинаковые голоса: столько записей в БД и правок шапки не сделали
+            "rsvp_noop": 0,
+        }
+
+    def changed(self, session_id: str) -> None:
+        """Содержимое шапки изменилось (RSVP, цель) — прежний рендер больше не годится."""
+        self._versions[session_id] = next(self._seq)
+        self._versions.move_to_end(session_id)
+        if len(self._versions) > VERSIONS_MAX:
+            self._versions.popitem(last=False)
+
+    def remember_votes(self, session_id: str, rsvp: List[dict]) -> None:
+        """Запоминает статусы участников по свежей сводке (gt_rsvp_vote)."""
+        self._votes[session_id] = {r["user_id"]: r["status"] for r in rsvp}
+        self._votes.move_to_end(session_id)
+        if len(self._votes) > RENDER_CACHE_SIZE:
+            self._votes.popitem(last=False)
+
+    def is_repeat_vote(self, session_id: str, user_id: int, status: str) -> bool:
+        """True — такой голос уже записан: ни БД, ни Bot API трогать не нужно."""
+        votes = self._votes.get(session_id)
+        if votes is None or votes.get(user_id) != status:
+            return False
+        self.counts["rsvp_noop"] += 1
+        return True
+
+    def _version(self, session_id: str) -> int:
+        v = self._versions.get(session_id)
+        if v is None:
+            self.changed(session_id)
+            v = self._versions[session_id]
+        return v
 
     # ---------- Публичный метод: создать/обновить «шапку» ----------
     async def post_or_get_session_message(
@@ -49,16 +137,31 @@ class SessionService:
         preset: Preset,
         session: dict,
         show_target_picker: bool = False,
+        rsvp: Optional[List[dict]] = None,
+        detail_page: Optional[int] = None,
     ) -> int:
         """
         Создаёт/обновляет «шапку» набора для сессии.
+        rsvp — готовая сводка из gt_rsvp_vote (тогда в БД за ней не ходим);
+        detail_page — вместо сводки показать страницу «Весь список».
         Возвращает message_id.
         """
-        text_html = self._build_header_text(preset, session)
-        kb = self._build_keyboard(session["session_id"], session["target_count"], show_target_picker)
+        sid = session["session_id"]
+        key = (
+            sid,
+            self._version(sid),
+            show_target_picker,
+            detail_page,
+            self.presets.snapshot.version if self.presets is not None else None,
+        )
+        text_html, kb = await self._render(key, preset, session, show_target_picker, detail_page, rsvp)
 
         msg_id = session.get("message_id")
         if msg_id:
+            if self._shown.get(sid) == (msg_id, key):
+                # в чате ровно это — Telegram всё равно ответил бы «message is not modified»
+                self.counts["edit_skipped"] += 1
+                return msg_id
             try:
                 await self.bot.edit_message_text(
                     chat_id=chat_id,
@@ -68,6 +171,7 @@ class SessionService:
                     reply_markup=kb,
                     disable_web_page_preview=True,
                 )
+                self._remember_shown(sid, msg_id, key)
                 return msg_id
             except Exception:
                 # если редактирование не удалось (удалили/нет прав) — отправим новое
@@ -80,43 +184,223 @@ class SessionService:
             reply_markup=kb,
             disable_web_page_preview=True,
         )
-        self.repo.set_session_message(session["session_id"], sent.message_id)
+        await asyncio.to_thread(self.repo.set_session_message, sid, sent.message_id)
+        self._remember_shown(sid, sent.message_id, key)
         return sent.message_id
 
+    async def _render(
+        self,
+        key: tuple,
+        preset: Preset,
+        session: dict,
+        show_picker: bool,
+        detail_page: Optional[int],
+        rsvp: Optional[List[dict]],
+    ) -> Tuple[str, InlineKeyboardMarkup]:
+        cached = self._rendered.get(key)
+        if cached is not None:
+            self._rendered.move_to_end(key)
+            self.counts["render_hit"] += 1
+            return cached
+        self.counts["render_miss"] += 1
+        if rsvp is None:
+            # сводку и подписи читаем из БД — синхронный клиент, не на loop'е
+            rendered = await asyncio.to_thread(self._build, preset, session, show_picker, detail_page, rsvp)
+        else:
+            rendered = self._build(preset, session, show_picker, detail_page, rsvp)
+        self._rendered[key] = rendered
+        if len(self._rendered) > RENDER_CACHE_SIZE:
+            self._rendered.popitem(last=False)
+        return rendered
+
+    def _build(
+        self,
+        preset: Preset,
+        session: dict,
+        show_picker: bool,
+        detail_page: Optional[int],
+        rsvp: Optional[List[dict]],
+    ) -> Tuple[str, InlineKeyboardMarkup]:
+        """Текст и клавиатура шапки. Кэши не трогает — можно звать из потока."""
+        sid = session["session_id"]
+        if detail_page is not None:
+            text_html, page, pages = self._build_detail_text(preset, session, detail_page, rsvp)
+            return text_html, self._build_detail_keyboard(sid, page, pages)
+        text_html, truncated = self._build_header(preset, session, rsvp)
+        return text_html, self._build_keyboard(sid, session["target_count"], show_picker, show_all=truncated)
+
+    def _remember_shown(self, session_id: str, message_id: int, key: tuple) -> None:
+        self._shown[session_id] = (message_id, key)
+        self._shown.move_to_end(session_id)
+        if len(self._shown) > RENDER_CACHE_SIZE:
+            self._shown.popitem(last=False)
+
+    def _forget(self, session_id: str) -> None:
+        self._versions.pop(session_id, None)
+        self._votes.pop(session_id, None)
+        self._shown.pop(session_id, None)
+
+    # ---------- Авто-закрытие и архив ----------
+    async def expire_stale(self, lifetime_sec: int) -> int:
+        """
+        Закрывает сессии старше lifetime_sec и дорисовывает их шапки:
+        сводка + «Набор завершён», без кнопок. Возвращает число закрытых.
+        """
+        closed = await asyncio.to_thread(self.repo.close_stale_sessions, lifetime_sec, EXPIRE_BATCH)
+        for session in closed:
+            self._forget(session["session_id"])
+            if not session.get("message_id"):
+                continue
+            try:
+                text_html = await asyncio.to_thread(self._build_final_text, session)
+                if text_html is None:
+                    continue
+                await self.bot.edit_message_text(
+                    chat_id=session["chat_id"],
+                    message_id=session["message_id"],
+                    text=text_html,
+                    parse_mode="HTML",
+                    reply_markup=None,
+                    disable_web_page_preview=True,
+                )
+            except Exception as e:
+                # сообщение удалили / бота выгнали — сессия всё равно закрыта
+                log.debug("sessions: finalize %s failed: %r", session["session_id"], e)
+        return len(closed)
+
+    async def archive_closed(self) -> int:
+        """Переносит давно закрытые сессии с RSVP в архив пачками. Возвращает их число."""
+        total = 0
+        while True:
+            n = await asyncio.to_thread(self.repo.archive_closed_sessions, ARCHIVE_AFTER, ARCHIVE_BATCH)
+            total += n
+            if n < ARCHIVE_BATCH:
+                return total
+
+    async def run_expirer(self, lifetime_sec: int, interval: float = EXPIRE_EVERY) -> None:
+        """Фоновая задача: закрытие просроченных сессий + архивирование."""
+        while True:
+            try:
+                closed = await self.expire_stale(lifetime_sec)
+                archived = await self.archive_closed()
+                if closed or archived:
+                    log.info("sessions: closed %s stale, archived %s", closed, archived)
+            except Exception as e:
+                log.warning("sessions: expire/archive failed: %r", e)
+            await asyncio.sleep(interval)
+
+    def _build_final_text(self, session: dict) -> Optional[str]:
+        preset = self.presets.get(session["game_key"]) if self.presets is not None else None
+        if preset is None:
+            preset = self.repo.get_preset(session["game_key"])
+        if preset is None:
+            return None
+        return self._build_header_text(preset, session) + "\n\n" + html.escape(texts.SESSION_EXPIRED)
+
     # ---------- Построение UI ----------
-    def _build_header_text(self, preset: Preset, session: dict) -> str:
+    def _title_html(self, preset: Preset) -> str:
+        if self.presets is not None:
+            # заголовок отрендерен заранее в снимке пресетов
+            title_html = self.presets.snapshot.header_html.get(preset.game_key)
+            if title_html is not None:
+                return title_html
+        return md_to_html(texts.header(preset.title, preset.emoji))
+
+    def _build_header_text(self, preset: Preset, session: dict, rsvp: Optional[List[dict]] = None) -> str:
+        return self._build_header(preset, session, rsvp)[0]
+
+    def _build_header(self, preset: Preset, session: dict, rsvp: Optional[List[dict]] = None) -> Tuple[str, bool]:
         """
         **Название** (Markdown -> HTML) +
         строка «👥 Количество участников — N» +
-        сводка RSVP (HTML).
+        сводка RSVP (HTML) в пределах бюджета шапки.
+        Возвращает (HTML, не все имена поместились).
         """
-        title_html = _md_to_html(texts.header(preset.title, preset.emoji))
+        title_html = self._title_html(preset)
         target = int(session.get("target_count", 10))
+        going, maybe, nope, labels = self._rsvp_board(session, rsvp)
 
-        going_ids, maybe_ids, nope_ids = self.repo.get_rsvp_lists(session["session_id"])
-        going = [self._mention(uid) for uid in going_ids]
-        maybe = [self._mention(uid) for uid in maybe_ids]
-        nope = [self._mention(uid) for uid in nope_ids]
-
-        lines: List[str] = [
+        head: List[str] = [
             title_html,
             f"\n👥 Количество участников — <b>{target}</b>",
             "",
             "<b>Сводка:</b>",
-            f"Иду ({len(going)}/{target}): " + (", ".join(going) if going else "—"),
-            f"Может быть ({len(maybe)}): " + (", ".join(maybe) if maybe else "—"),
-            f"Не сегодня ({len(nope)}): " + (", ".join(nope) if nope else "—"),
         ]
+        tail: List[str] = []
         if len(going) >= target:
-            lines.append("")
-            lines.append(html.escape(texts.FULLY_STAFFED))
+            tail = ["", html.escape(texts.FULLY_STAFFED)]
+        rows = [
+            (f"Иду ({len(going)}/{target}): ", going),
+            (f"Может быть ({len(maybe)}): ", maybe),
+            (f"Не сегодня ({len(nope)}): ", nope),
+        ]
+
+        len_left = HEADER_MAX_LEN - _visible_len("\n".join(head + tail))
+        len_left -= sum(utf16_len(prefix) + 1 + TAIL_RESERVE for prefix, _ in rows)
+        mentions_left = HEADER_MAX_MENTIONS
+        truncated = False
 
-        return "\n".join(lines)
+        self._fill_labels(labels, [uid for _, ids in rows for uid in ids[:HEADER_NAMES_PER_LIST]])
+        lines = list(head)
+        for prefix, ids in rows:
+            shown, used = self._fit_names(ids, labels, len_left, mentions_left)
+            len_left -= used
+            mentions_left -= len(shown)
+            body = ", ".join(shown) if shown else ("" if ids else "—")
+            hidden = len(ids) - len(shown)
+            if hidden:
+                truncated = True
+                body = f"{body} +{hidden}" if shown else f"+{hidden}"
+            lines.append(prefix + body)
+        lines.extend(tail)
 
-    def _build_keyboard(self, session_id: str, target: int, show_picker: bool) -> InlineKeyboardMarkup:
+        return "\n".join(lines), truncated
+
+    def _fit_names(
+        self, ids: List[int], labels: Dict[int, dict], len_left: int, mentions_left: int
+    ) -> Tuple[List[str], int]:
+        """Первые имена списка в пределах бюджета: (HTML-упоминания, занятая длина)."""
+        shown: List[str] = []
+        used = 0
+        for uid in ids[:HEADER_NAMES_PER_LIST]:
+            if len(shown) >= mentions_left:
+                break
+            label = self._label_for(uid, labels)
+            cost = utf16_len(label) + 2  # + ", "
+            if used + cost > len_left:
+                break
+            shown.append(_mention_html(uid, label))
+            used += cost
+        return shown, used
+
+    def _build_detail_text(
+        self, preset: Preset, session: dict, page: int, rsvp: Optional[List[dict]] = None
+    ) -> Tuple[str, int, int]:
+        """Страница «Весь список»: все ответившие по DETAIL_PAGE_SIZE. Возвращает (HTML, страница, страниц)."""
+        going, maybe, nope, labels = self._rsvp_board(session, rsvp)
+        sections = (("Иду", going), ("Может быть", maybe), ("Не сегодня", nope))
+        entries = [(i, uid) for i, (_, ids) in enumerate(sections) for uid in ids]
+        pages = max(1, -(-len(entries) // DETAIL_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        chunk = entries[page * DETAIL_PAGE_SIZE : (page + 1) * DETAIL_PAGE_SIZE]
+        self._fill_labels(labels, [uid for _, uid in chunk])
+
+        lines: List[str] = [self._title_html(preset), "", f"<b>Весь список</b> — стр. {page + 1}/{pages}"]
+        for i, (caption, ids) in enumerate(sections):
+            names = [_mention_html(uid, self._label_for(uid, labels)) for j, uid in chunk if j == i]
+            if names:
+                lines.append(f"<b>{caption} ({len(ids)}):</b> " + ", ".join(names))
+        if not chunk:
+            lines.append("—")
+        return "\n".join(lines), page, pages
+
+    def _build_keyboard(
+        self, session_id: str, target: int, show_picker: bool, show_all: bool = False
+    ) -> InlineKeyboardMarkup:
         """
         Основная клавиатура:
         - ряд RSVP-кнопок;
+        - «Весь список», если в шапку поместились не все имена;
         - отдельная строка с кнопкой «Изменить количество участников» (во всю ширину),
           либо быстрый выбор [3,4,5,6,8,10,12] + «Назад».
         """
@@ -135,6 +419,13 @@ class SessionService:
             kb.row()
             kb.button(text="⬅️ Назад", callback_data=f"target_back:{session_id}")
         else:
+            if show_all:
+                kb.row(
+                    InlineKeyboardButton(
+                        text="📋 Весь список",
+                        callback_data=f"rsvp_page:{session_id}:0",
+                    )
+                )
             # Отдельная строка, одна кнопка — занимает всю ширину
             kb.row(
                 InlineKeyboardButton(
@@ -145,22 +436,62 @@ class SessionService:
 
         return kb.as_markup()
 
+    def _build_detail_keyboard(self, session_id: str, page: int, pages: int) -> InlineKeyboardMarkup:
+        """RSVP-кнопки + листание страниц «Весь список» + «Назад» к сводке."""
+        kb = InlineKeyboardBuilder()
+        kb.button(text=texts.BTN_GO, callback_data=f"rsvp:going:{session_id}")
+        kb.button(text=texts.BTN_MAYBE, callback_data=f"rsvp:maybe:{session_id}")
+        kb.button(text=texts.BTN_NO, callback_data=f"rsvp:no:{session_id}")
+        kb.row()
+
+        nav: List[InlineKeyboardButton] = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(text="◀️", callback_data=f"rsvp_page:{session_id}:{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton(text="▶️", callback_data=f"rsvp_page:{session_id}:{page + 1}"))
+        if nav:
+            kb.row(*nav)
+        kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"target_back:{session_id}"))
+        return kb.as_markup()
+
     # ---------- Хелперы ----------
-    def _mention(self, uid: int) -> str:
+    def _rsvp_board(
+        self, session: dict, rsvp: Optional[List[dict]]
+    ) -> Tuple[List[int], List[int], List[int], Dict[int, dict]]:
         """
-        Возвращает HTML-упоминание: <a href="tg://user?id=...">label</a>
-        label = @username | Имя | "игрок"
+        (going, maybe, nope, {user_id: строка с username/first_name}).
+        Без готовой сводки — списки из БД, подписи дочитываются только для показанных имён.
         """
+        if rsvp is None:
+            going, maybe, nope = self.repo.get_rsvp_lists(session["session_id"])
+            return going, maybe, nope, {}
+        going: List[int] = []
+        maybe: List[int] = []
+        nope: List[int] = []
+        labels: Dict[int, dict] = {}
+        for r in rsvp:
+            uid = r["user_id"]
+            labels[uid] = r
+            st = r["status"]
+            if st == "going":
+                going.append(uid)
+            elif st == "maybe":
+                maybe.append(uid)
+            else:
+                nope.append(uid)
+        return going, maybe, nope, labels
+
+    def _fill_labels(self, labels: Dict[int, dict], ids: List[int]) -> None:
+        """Дочитывает из gt_users подписи, которых нет в сводке, — одним запросом."""
+        missing = [uid for uid in ids if uid not in labels]
+        if not missing:
+            return
         try:
-            u = self.repo.get_user_public(uid)
-        except Exception:
-            u = None
-
-        if u and u.get("username"):
-            label = f"@{u['username']}"
-        elif u and u.get("first_name"):
-            label = u["first_name"]
-        else:
-            label = "игрок"
+            labels.update(self.repo.get_users_public(missing))
+        except Exception as e:
+            log.debug("sessions: labels for %s users failed: %r", len(missing), e)
 
-        return f'<a href="tg://user?id={uid}">{html.escape(label)}</a>'
+    @staticmethod
+    def _label_for(uid: int, labels: Dict[int, dict]) -> str:
+        """label = @username | Имя | "игрок" (из сводки или из gt_users)."""
+        return _label(labels.get(uid))
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from repo.supabase_repo import SupabaseRepo
+    from services.eligibility import EligibilityIndex
+
+
+# Профиль пользователя, записанный в БД не раньше SEEN_TTL сек назад,
+# повторно не пишем; запомненных профилей — не больше MAX_KNOWN (LRU).
+SEEN_TTL = 6 * 3600
+MAX_KNOWN = 50_000
+# Как часто (сек) сбрасывать накопленные профили в gt_users одним upsert'ом
+FLUSH_EVERY = 5.0
+
+log = logging.getLogger(__name__)
+
+Profile = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class SightingService:
+    """
+    Дешёвая фиксация «пользователь писал в чате».
+
+    Раньше каждое сообщение в группе = upsert в gt_users. Теперь:
+    - профиль (username, имя, фамилия), уже записанный недавно, не пишем;
+    - новые/изменившиеся профили копятся и уходят в БД пачкой раз в FLUSH_EVERY;
+    - отметка present в EligibilityIndex — в памяти.
+    """
+
+    def __init__(self, repo: "SupabaseRepo", eligibility: Optional["EligibilityIndex"] = None) -> None:
+        self.repo = repo
+        self.eligibility = eligibility
+        self._known: "OrderedDict[int, Tuple[Profile, float]]" = OrderedDict()
+        self._pending: Dict[int, Dict] = {}
+
+    def seen(self, chat_id: int, user_id: int, username, first_name, last_name) -> bool:
+        """Учитывает сообщение. True — профиль поставлен в очередь на запись."""
+        if self.eligibility is not None:
+            self.eligibility.set_present(chat_id, user_id, True)
+
+        profile: Profile = (username, first_name, last_name)
+        now = time.monotonic()
+        known = self._known.get(user_id)
+        if known is not None and known[0] == profile and now - known[1] < SEEN_TTL:
+            self._known.move_to_end(user_id)
+            return False
+
+        self._known[user_id] = (profile, now)
+        self._known.move_to_end(user_id)
+        if len(self._known) > MAX_KNOWN:
+            self._known.popitem(last=False)
+        self._pending[user_id] = {
+            "user_id": user_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+        }
+        return True
+
+    async def flush(self) -> int:
+        """Пишет накопленные профили одним bulk upsert. Возвращает их число."""
+        if not self._pending:
+            return 0
+        rows, self._pending = list(self._pending.values()), {}
+        try:
+            await asyncio.to_thread(self.repo.upsert_users, rows)
+        except Exception as e:
+            # забываем профили — следующее сообщение поставит их в очередь снова
+            for r in rows:
+                self._known.pop(r["user_id"], None)
+            log.warning("sightings: flush of %s users failed: %r", len(rows), e)
+            return 0
+        return len(rows)
+
+    async def run_flusher(self, interval: float = FLUSH_EVERY) -> None:
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
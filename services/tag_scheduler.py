@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+# Сколько запросов к Bot API выполняется одновременно
+WORKERS = 8
+# Общий бюджет запросов «Позвать всех» в секунду (лимит Telegram ~30/с на бота,
+# часть оставляем шапкам и ответам на колбэки) и допустимый всплеск
+SEND_RATE = 20.0
+SEND_BURST = 5
+# Проверки присутствия (getChatMember) — не сообщения: в бюджет отправок не
+# входят и очередь чата не занимают, общий только предел одновременных
+CHECK_CONCURRENCY = 40
+# Созывы целиком: сколько идут одновременно и сколько ждут своей очереди
+BATCH_WORKERS = 4
+MAX_PENDING_BATCHES = 16
+
+log = logging.getLogger(__name__)
+
+Call = Callable[[], Awaitable[Any]]
+
+
+class TokenBucket:
+    """Общий бюджет запросов: rate в секунду, до burst подряд."""
+
+    def __init__(self, rate: float = SEND_RATE, burst: int = SEND_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # под замком: ожидающие получают токены по очереди, без гонки за каждый
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+                self._at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TagScheduler:
+    """
+    Общий пул запросов к Bot API для всех созывов «Позвать всех».
+
+    У каждого чата — своя очередь отправок тегов. Воркеры обходят чаты
+    по кругу и берут по одному запросу за ход: созыв на 10k участников
+    не задерживает маленький чат больше, чем на один круг. Каждая отправка
+    сначала берёт токен из общего TokenBucket — суммарная скорость
+    не зависит от числа одновременных созывов.
+
+    Проверки присутствия идут отдельной полосой (check): без токенов и без
+    очереди чата, только под общим семафором — иначе отправка ждала бы
+    за сотнями проверок своего же чата.
+
+    Сами созывы (TaggingService.batch_tag целиком) тоже идут через пул:
+    submit_batch кладёт задание в ограниченную очередь, его забирает один
+    из batch_workers воркеров. Одновременно открыто не больше batch_workers
+    конвейеров созыва; переполненная очередь — отказ, а не рост памяти.
+
+    Ошибки запроса (в т.ч. TelegramRetryAfter) возвращаются вызывающему:
+    ожидание и замедление — забота его AdaptiveBatcher.
+    """
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        rate: float = SEND_RATE,
+        burst: int = SEND_BURST,
+        check_concurrency: int = CHECK_CONCURRENCY,
+        batch_workers: int = BATCH_WORKERS,
+        max_pending_batches: int = MAX_PENDING_BATCHES,
+    ) -> None:
+        self.workers = workers
+        self.batch_workers = batch_workers
+        self._batches: "asyncio.Queue[Call]" = asyncio.Queue(maxsize=max_pending_batches)
+        self.bucket = TokenBucket(rate, burst)
+        self._checks = asyncio.Semaphore(check_concurrency)
+        self._chats: Dict[int, Deque[Tuple[Call, asyncio.Future]]] = {}
+        # чаты с непустой очередью, в порядке обхода; чат здесь не больше одного раза
+        self._ready: "asyncio.Queue[int]" = asyncio.Queue()
+        self.counts: Dict[str, int] = {
+            "calls": 0, "failed": 0, "cancelled": 0, "checks": 0,
+            "batches": 0, "batches_failed": 0, "batches_rejected": 0,
+        }
+
+    async def call(self, chat_id: int, fn: Call) -> Any:
+        """Выполняет fn() в свою очередь чата и возвращает его результат."""
+        fut = asyncio.get_running_loop().create_future()
+        dq = self._chats.get(chat_id)
+        if dq is None:
+            dq = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        dq.append((fn, fut))
+        return await fut
+
+    async def check(self, fn: Call) -> Any:
+        """Выполняет проверку fn() в полосе проверок (без бюджета отправок)."""
+        async with self._checks:
+            self.counts["checks"] += 1
+            return await fn()
+
+    def submit_batch(self, job: Call) -> bool:
+        """Ставит созыв в очередь пула. False — очередь переполнена."""
+        try:
+            self._batches.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counts["batches_rejected"] += 1
+            return False
+        return True
+
+    def pending(self) -> int:
+        return sum(len(dq) for dq in self._chats.values())
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Дожидается уже поставленных созывов (при остановке бота)."""
+        try:
+            async with asyncio.timeout(timeout):
+                await self._batches.join()
+        except TimeoutError:
+            log.warning("tag_scheduler: %s batches left unfinished on shutdown", self._batches.qsize())
+
+    async def run_workers(self) -> None:
+        """Фоновая задача: пул воркеров. Отмена останавливает весь пул."""
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        tasks += [asyncio.create_task(self._batch_worker()) for _ in range(self.batch_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            dq = self._chats[chat_id]
+            fn, fut = dq.popleft()
+            # чат уходит в конец круга, пока у него есть запросы
+            if dq:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._chats[chat_id]
+
+            if fut.cancelled():  # созыв уже остановлен
+                self.counts["cancelled"] += 1
+                continue
+            await self.bucket.acquire()
+            if fut.cancelled():
+                self.counts["cancelled"] += 1
+                continue
+            self.counts["calls"] += 1
+            try:
+                res = await fn()
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            except Exception as e:
+                self.counts["failed"] += 1
+                if not fut.cancelled():
+                    fut.set_exception(e)
+            else:
+                if not fut.cancelled():
+                    fut.set_result(res)
+
+    async def _batch_worker(self) -> None:
+        while True:
+            job = await self._batches.get()
+            self.counts["batches"] += 1
+            try:
+                await job()
+            except Exception as e:
+                self.counts["batches_failed"] += 1
+                log.warning("tag_scheduler: batch failed: %r", e)
+            finally:
+                self._batches.task_done()
@@ -2,15 +2,22 @@ from __future__ import annotations
 
 import asyncio
 import html
+import logging
 import random
-import re
-from typing import Optional, List, Dict
+from typing import Optional, List, AsyncIterator, Iterable, Union
 
 from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 # если у тебя импорт из корня — оставь этот
 from repo.supabase_repo import SupabaseRepo, Preset
+from services.batcher import AdaptiveBatcher
+from services.cooldowns import CooldownService
+from services.eligibility import EligibilityIndex
+from services.pings import PingBudget
+from services.presets import PresetStore
+from services.tag_scheduler import TagScheduler
+from utils.entities import Entity, Line, as_message_entities, md_to_html, md_to_line, pack_counted, utf16_len
 # если проект лежит иначе, можно переключить на:
 # try:
 #     from supabase_repo import SupabaseRepo, Preset
@@ -18,10 +25,26 @@ from repo.supabase_repo import SupabaseRepo, Preset
 #     from repo.supabase_repo import SupabaseRepo, Preset
 
 
-BATCH_DEFAULT = 15
-PAUSE_DEFAULT = 1.5
 TG_MAX_MESSAGE_LEN = 4096
 
+# Как рендерить теги: "html" — <a href=...> + parse_mode=HTML;
+# "entities" — чистый текст + готовые MessageEntity (см. utils/entities.py)
+RENDER_HTML = "html"
+RENDER_ENTITIES = "entities"
+
+# invitees для batch_tag: готовый список или поток страниц
+Invitees = Union[Iterable[int], AsyncIterator[List[int]]]
+
+# Конвейер batch_tag: размеры очередей между стадиями и параллелизм проверок
+PRESENCE_CONCURRENCY = 20
+STAGE_QUEUE_SIZE = 100
+# неполный батч уходит, если новых строк не было столько секунд
+BATCH_FLUSH_TIMEOUT = 0.5
+
+_DONE = object()  # маркер конца потока в очередях конвейера
+
+log = logging.getLogger(__name__)
+
 
 class TaggingService:
     """
@@ -36,131 +59,394 @@ class TaggingService:
         last_invite:<game_key>:<user_id>
     - Фильтруем присутствующих в чате (creator/administrator/member).
     - Паузируем между батчами и останавливаемся, если достигнут target.
+    - Всё это — конвейер на ограниченных очередях: проверка присутствия ->
+      лейбл и фраза -> сборка батча -> отправка. Первый батч уходит,
+      как только набрались первые присутствующие, а не после проверки всего чата.
     """
 
-    def __init__(self, bot: Bot, repo: SupabaseRepo) -> None:
+    def __init__(
+        self,
+        bot: Bot,
+        repo: SupabaseRepo,
+        cooldowns: Optional[CooldownService] = None,
+        eligibility: Optional[EligibilityIndex] = None,
+        presets: Optional[PresetStore] = None,
+        render_mode: str = RENDER_HTML,
+        scheduler: Optional[TagScheduler] = None,
+        pings: Optional[PingBudget] = None,
+    ) -> None:
         self.bot = bot
         self.repo = repo
+        self.cooldowns = cooldowns
+        self.eligibility = eligibility
+        self.presets = presets
+        self.render_mode = render_mode
+        # общий пул запросов к Bot API (честная очередь по чатам); None — напрямую
+        self.scheduler = scheduler
+        # недавно тегнутые в чате уходят в конец созыва или пропускаются
+        self.pings = pings
 
     # -------------------------- public API --------------------------
 
+    async def invitee_pages(self, chat_id: int) -> AsyncIterator[List[int]]:
+        """
+        Асинхронный поток страниц invitees (keyset по user_id из репозитория).
+        Следующая страница грузится в фоне, пока вызывающий обрабатывает текущую.
+        Если индекс eligibility прогрет — берём страницы из него, без БД.
+        Пока кулдауны не подняты из БД (load не удался), ни индексу, ни памяти
+        CooldownService не верим — фильтр по gt_cooldowns делает репозиторий.
+        """
+        cooldowns_loaded = self.cooldowns is not None and self.cooldowns.loaded
+        if self.eligibility is not None and self.eligibility.ready and cooldowns_loaded:
+            async for page in self.eligibility.eligible_pages(chat_id):
+                yield page
+            return
+
+        cd = self.cooldowns.active_ids(chat_id) if cooldowns_loaded else None
+        pages = self.repo.iter_invitee_pages(chat_id, cooldown_ids=cd)
+        pending = asyncio.ensure_future(asyncio.to_thread(next, pages, None))
+        try:
+            while True:
+                page = await pending
+                if page is None:
+                    return
+                pending = asyncio.ensure_future(asyncio.to_thread(next, pages, None))
+                yield page
+        finally:
+            if not pending.done():
+                pending.cancel()
+
     async def batch_tag(
         self,
         chat_id: int,
         preset: Preset,
-        invitees: List[int],
-        per_batch: int = BATCH_DEFAULT,
-        pause: float = PAUSE_DEFAULT,
+        invitees: Invitees,
+        per_batch: Optional[int] = None,
+        pause: Optional[float] = None,
         session_id: Optional[str] = None,
     ) -> None:
         """
         Отправляет теги батчами. При session_id между батчами проверяем достижение цели.
+        invitees — список user_id или асинхронный поток страниц (см. invitee_pages).
+        per_batch/pause — только стартовые значения: дальше их подстраивает
+        AdaptiveBatcher по RetryAfter и темпу голосов «Иду».
+
+        Стадии работают одновременно и связаны ограниченными очередями:
+        presence -> render -> assemble -> send. Когда цель достигнута,
+        верхние стадии отменяются и лишних запросов к Telegram/БД не делают.
         """
+        batcher = AdaptiveBatcher(per_batch, pause)
 
-        per_batch = max(1, int(per_batch))
-        # unique + сохранение порядка
-        invitees = list(dict.fromkeys(invitees))
+        present_q: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+        lines_q: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+        # один готовый батч впереди отправки: размер следующего учитывает свежие сигналы
+        batches_q: asyncio.Queue = asyncio.Queue(maxsize=1)
 
-        # Оставляем только реально присутствующих в чате
-        invitees = await self.filter_present_members(chat_id, invitees)
-        if not invitees:
+        stages = [
+            asyncio.create_task(self._stage_presence(chat_id, invitees, present_q)),
+            asyncio.create_task(self._stage_render(preset, present_q, lines_q)),
+            asyncio.create_task(self._stage_assemble(lines_q, batches_q, batcher)),
+        ]
+        try:
+            sent = await self._stage_send(chat_id, batches_q, batcher, session_id)
+        finally:
+            for t in stages:
+                t.cancel()
+            for res in await asyncio.gather(*stages, return_exceptions=True):
+                if isinstance(res, Exception):
+                    log.warning("batch_tag stage failed in chat %s: %r", chat_id, res)
+
+        if not sent:
             await self._safe_send_message(chat_id, "Некого звать: в чате нет подходящих участников.")
-            return
+        else:
+            log.info(
+                "batch_tag: chat %s — %s messages, %s RetryAfter, last batch %s / pause %.1fs",
+                chat_id, sent, batcher.retry_afters, batcher.batch_size, batcher.pause,
+            )
 
-        # Подбираем приглашение ДЛЯ КАЖДОГО пользователя сразу —
-        # чтобы в одном созыве не было повторов между людьми.
-        picks = self._pick_lines_for_users(preset, invitees)
-        # превратим в список строк для отправки (упоминание + фраза)
-        mentions: List[str] = [
-            f'<a href="tg://user?id={uid}">{self._label_for_user(uid)}</a> — {picks[uid]}'
-            for uid in invitees
-        ]
+    # -------------------------- pipeline stages --------------------------
 
-        # Рассылаем батчами
-        for start in range(0, len(mentions), per_batch):
-            batch_lines = mentions[start : start + per_batch]
-            text = "\n".join(batch_lines)
+    async def _stage_presence(
+        self, chat_id: int, invitees: Invitees, out: asyncio.Queue
+    ) -> None:
+        """
+        Стадия 1: уникализуем поток user_id и проверяем присутствие в чате
+        пулом из PRESENCE_CONCURRENCY воркеров. Присутствующие — в out.
+        Тегнутые недавно (PingBudget) идут после всех остальных или никак.
+        """
+        todo: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
 
-            if len(text) > TG_MAX_MESSAGE_LEN:
-                for chunk in self._split_by_lines(text):
-                    await self._safe_send_message(chat_id, chunk)
+        async def feed() -> None:
+            seen: set[int] = set()
+            later: List[int] = []
+            try:
+                async for page in self._as_pages(invitees):
+                    if self.pings is not None:
+                        page, recent = self.pings.split(chat_id, page)
+                        later += recent
+                    for uid in page:
+                        if uid in seen:
+                            continue
+                        seen.add(uid)
+                        await todo.put(uid)
+                for uid in later:
+                    if uid not in seen:
+                        seen.add(uid)
+                        await todo.put(uid)
+            finally:
+                for _ in range(PRESENCE_CONCURRENCY):
+                    await self._close(todo)
+
+        async def check() -> None:
+            while True:
+                uid = await todo.get()
+                if uid is _DONE:
+                    return
+                if await self._is_present(chat_id, uid):
+                    await out.put(uid)
+
+        tasks = [asyncio.create_task(feed())]
+        tasks += [asyncio.create_task(check()) for _ in range(PRESENCE_CONCURRENCY)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await self._close(out)
+
+    async def _stage_render(
+        self, preset: Preset, inp: asyncio.Queue, out: asyncio.Queue
+    ) -> None:
+        """
+        Стадия 2: лейбл + персональная фраза. Синхронные запросы к репозиторию
+        уходят в поток, чтобы не блокировать отправку и проверки.
+        """
+        deck = self._new_deck(preset)
+        render = self._render_entities if self.render_mode == RENDER_ENTITIES else self._render_line
+        idx = 0
+        try:
+            while True:
+                uid = await inp.get()
+                if uid is _DONE:
+                    return
+                line = await asyncio.to_thread(render, preset, deck, idx, uid)
+                idx += 1
+                await out.put((uid, line))
+        finally:
+            await self._close(out)
+
+    async def _stage_assemble(
+        self, inp: asyncio.Queue, out: asyncio.Queue, batcher: AdaptiveBatcher
+    ) -> None:
+        """
+        Стадия 3: собираем строки в батчи по batcher.batch_size. Неполный батч
+        отдаём по таймауту — первые теги не ждут медленный хвост конвейера.
+        В очередь уходят (сообщение, user_id упомянутых в нём).
+        """
+        batch: List = []
+
+        async def flush() -> None:
+            nonlocal batch
+            if not batch:
+                return
+            items, batch = batch, []
+            uids = [uid for uid, _ in items]
+            lines = [line for _, line in items]
+            # одна строка = один упомянутый; упаковщики возвращают число строк
+            # в сообщении — \n внутри фразы пресета счёт не сбивает
+            if isinstance(lines[0], Line):
+                # режем по точной длине в UTF-16 и по числу сущностей
+                packed = [((text, entities), k) for text, entities, k in pack_counted(lines)]
             else:
-                await self._safe_send_message(chat_id, text)
-
-            if session_id and await self._reached_target(session_id):
-                break
-
-            await asyncio.sleep(pause)
+                packed = [("\n".join(group), len(group)) for group in self._chunk_lines(lines)]
+            for msg, k in packed:
+                await out.put((msg, uids[:k]))
+                uids = uids[k:]
 
-    # -------------------------- presence filter --------------------------
+        try:
+            while True:
+                try:
+                    # asyncio.timeout, а не wait_for: в 3.11 wait_for может проглотить
+                    # отмену, если строка пришла в тот же момент, — и стадия
+                    # навсегда ждёт _DONE, который отменённая стадия выше не пришлёт
+                    async with asyncio.timeout(BATCH_FLUSH_TIMEOUT if batch else None):
+                        line = await inp.get()
+                except TimeoutError:
+                    await flush()
+                    continue
+                if line is _DONE:
+                    await flush()
+                    return
+                batch.append(line)  # (user_id, строка)
+                if len(batch) >= batcher.batch_size:
+                    await flush()
+        finally:
+            await self._close(out)
+
+    async def _stage_send(
+        self,
+        chat_id: int,
+        inp: asyncio.Queue,
+        batcher: AdaptiveBatcher,
+        session_id: Optional[str],
+    ) -> int:
+        """
+        Стадия 4: отправка с паузой между сообщениями и проверкой цели.
+        Итог каждой отправки и прогресс «Иду» уходят в batcher,
+        упомянутые в доставленном сообщении — в PingBudget.
+        Недоставленные не считаются упомянутыми и паузы после себя не ждут
+        (_safe_send_message уже выждал RetryAfter).
+        Возвращает число отправленных сообщений (с попытками).
+        """
+        sent = 0
+        mentioned = 0
+        pause_next = False
+        while True:
+            item = await inp.get()
+            if item is _DONE:
+                return sent
+            msg, uids = item
+            if pause_next:
+                await asyncio.sleep(batcher.pause)
+            if isinstance(msg, tuple):
+                ok = await self._safe_send_message(chat_id, msg[0], entities=msg[1], batcher=batcher)
+            else:
+                ok = await self._safe_send_message(chat_id, msg, batcher=batcher)
+            sent += 1
+            pause_next = ok
+            if ok:
+                mentioned += len(uids)
+                if self.pings is not None:
+                    self.pings.mark(chat_id, uids)
+            if session_id:
+                progress = await asyncio.to_thread(self._progress_sync, session_id)
+                if progress is not None:
+                    going, target = progress
+                    if going >= target:
+                        return sent
+                    if ok:
+                        batcher.on_progress(going, target, mentioned)
 
-    async def filter_present_members(self, chat_id: int, user_ids: List[int]) -> List[int]:
+    @staticmethod
+    async def _close(q: asyncio.Queue) -> None:
         """
-        Возвращает только тех user_id, кто реально состоит в чате:
-        creator/administrator/member. Остальные (left/kicked/restricted) отбрасываются.
+        Маркер конца потока для следующей стадии. Если стадию отменили
+        (цель набрана), ниже тоже всё отменено — ждать места в полной
+        очереди незачем, иначе gather в batch_tag не дождётся стадии.
         """
-        ok_status = {"creator", "administrator", "member"}
-        sem = asyncio.Semaphore(20)  # ограничим параллелизм
+        task = asyncio.current_task()
+        if task is not None and task.cancelling():
+            return
+        await q.put(_DONE)
 
-        async def check(uid: int) -> tuple[int, bool]:
-            async with sem:
-                try:
-                    m = await self.bot.get_chat_member(chat_id, uid)
-                    return uid, (getattr(m, "status", None) in ok_status)
-                except TelegramBadRequest:
-                    return uid, False
-                except Exception:
-                    return uid, False
+    @staticmethod
+    async def _as_pages(invitees: Invitees) -> AsyncIterator[List[int]]:
+        if hasattr(invitees, "__aiter__"):
+            async for page in invitees:
+                yield page
+        else:
+            yield list(invitees)
+
+    # -------------------------- presence --------------------------
 
-        results = await asyncio.gather(*(check(uid) for uid in user_ids))
-        return [uid for uid, ok in results if ok]
+    async def _is_present(self, chat_id: int, uid: int) -> bool:
+        try:
+            m = await self._check_api(lambda: self.bot.get_chat_member(chat_id, uid))
+        except TelegramBadRequest:
+            return False
+        except Exception:
+            return False
+        ok = getattr(m, "status", None) in {"creator", "administrator", "member"}
+        # запоминаем ответ Telegram: вышедших не проверяем в следующих созывах
+        if self.eligibility is not None:
+            self.eligibility.set_present(chat_id, uid, ok)
+        return ok
 
     # -------------------------- picking logic --------------------------
 
-    def _pick_lines_for_users(self, preset: Preset, user_ids: List[int]) -> Dict[int, str]:
+    @staticmethod
+    def _new_deck(preset: Preset) -> tuple[List[str], int]:
         """
-        Раздаёт фразы пользователям так, чтобы:
-        - внутри ЭТОГО созыва повторы между людьми не встречались, пока хватает вариантов,
-        - если людей больше, чем фраз — фразы идут по циклу (в случайном порядке),
-        - «анти-повтор для пользователя»: если выданная фраза совпадает с его последней,
-          сдвигаем на следующую в цикле,
-        - результат: {user_id: invite_html}.
+        «Колода» фраз на один созыв: перетасованные фразы + случайный стартовый сдвиг,
+        чтобы разные созывы начинались с разных мест.
         """
         lines_raw = (preset.invite_lines or [])[:]
         if not lines_raw:
             lines_raw = ["заглядывай!"]  # страховка
-
-        # Для справедливости перетасуем «колоду» фраз
         random.shuffle(lines_raw)
-        n = len(lines_raw)
+        return lines_raw, random.randrange(len(lines_raw))
 
-        # Случайный стартовый сдвиг, чтобы разные созывы начинались с разных мест
-        start = random.randrange(n)
-
-        picked: Dict[int, str] = {}
-        for idx, uid in enumerate(user_ids):
-            base_idx = (start + idx) % n
-            phrase = lines_raw[base_idx]
+    def _pick_line(
+        self, preset: Preset, deck: tuple[List[str], int], idx: int, uid: int
+    ) -> str:
+        """
+        Фраза (HTML) для idx-го пользователя созыва. Внутри созыва фразы не
+        повторяются, пока хватает вариантов (дальше — по кругу колоды);
+        совпавшую с последней фразой пользователя сдвигаем на следующую.
+        """
+        return self._phrase_html(preset, self._pick_phrase(preset, deck, idx, uid))
 
-            # анти-повтор для КОНКРЕТНОГО пользователя
-            last_key = f"last_invite:{preset.game_key}:{uid}"
-            last_line = None
-            try:
-                last_line = self.repo.get_app_setting(last_key)
-            except Exception:
-                pass
+    def _pick_phrase(
+        self, preset: Preset, deck: tuple[List[str], int], idx: int, uid: int
+    ) -> str:
+        """Сырая фраза (markdown) для idx-го пользователя созыва."""
+        lines_raw, start = deck
+        n = len(lines_raw)
+        base_idx = (start + idx) % n
+        phrase = lines_raw[base_idx]
 
-            if n > 1 and last_line == phrase:
-                phrase = lines_raw[(base_idx + 1) % n]
+        # анти-повтор для КОНКРЕТНОГО пользователя
+        last_key = f"last_invite:{preset.game_key}:{uid}"
+        last_line = None
+        try:
+            last_line = self.repo.get_app_setting(last_key)
+        except Exception:
+            pass
 
-            # сохраняем пользователю и фиксируем «последнюю»
-            picked[uid] = self._md_to_html(phrase)
-            try:
-                self.repo.set_app_setting(last_key, phrase)
-            except Exception:
-                pass
+        if n > 1 and last_line == phrase:
+            phrase = lines_raw[(base_idx + 1) % n]
 
-        return picked
+        # фиксируем «последнюю» фразу пользователя
+        try:
+            self.repo.set_app_setting(last_key, phrase)
+        except Exception:
+            pass
+        return phrase
+
+    def _phrase_html(self, preset: Preset, phrase: str) -> str:
+        """HTML фразы: из снимка пресетов (отрендерен при загрузке) или на лету."""
+        if self.presets is not None:
+            rendered = self.presets.snapshot.invite_html.get(preset.game_key, {}).get(phrase)
+            if rendered is not None:
+                return rendered
+        return md_to_html(phrase)
+
+    def _render_line(
+        self, preset: Preset, deck: tuple[List[str], int], idx: int, uid: int
+    ) -> str:
+        """Готовая строка батча: упоминание + фраза."""
+        phrase = self._pick_line(preset, deck, idx, uid)
+        return f'<a href="tg://user?id={uid}">{self._label_for_user(uid)}</a> — {phrase}'
+
+    def _render_entities(
+        self, preset: Preset, deck: tuple[List[str], int], idx: int, uid: int
+    ) -> Line:
+        """То же, что _render_line, но текстом + сущностями: без экранирования и HTML."""
+        phrase = self._phrase_line(preset, self._pick_phrase(preset, deck, idx, uid))
+        label = self._raw_label(uid)
+        n = utf16_len(label)
+        base = n + 3  # " — "
+        entities = (("text_link", 0, n, f"tg://user?id={uid}"),) + tuple(
+            (k, base + off, ln, url) for k, off, ln, url in phrase.entities
+        )
+        return Line(f"{label} — {phrase.text}", entities, base + phrase.length)
+
+    def _phrase_line(self, preset: Preset, phrase: str) -> Line:
+        if self.presets is not None:
+            rendered = self.presets.snapshot.invite_entities.get(preset.game_key, {}).get(phrase)
+            if rendered is not None:
+                return rendered
+        return md_to_line(phrase)
 
     # -------------------------- helpers --------------------------
 
@@ -168,86 +454,100 @@ class TaggingService:
         """
         Красивый лейбл: @username -> Имя -> 'игрок'. Всё экранируем.
         """
+        return html.escape(self._raw_label(user_id))
+
+    def _raw_label(self, user_id: int) -> str:
         try:
             u = self.repo.get_user_public(user_id)
         except Exception:
             u = None
 
         if u and u.get("username"):
-            return html.escape(f"@{u['username']}")
+            return f"@{u['username']}"
         if u and u.get("first_name"):
-            return html.escape(u["first_name"])
-        return html.escape("игрок")
+            return u["first_name"]
+        return "игрок"
 
-    @staticmethod
-    def _md_to_html(text: str) -> str:
-        """
-        Лёгкая конвертация markdown-**жирного** в HTML <b>…</b>,
-        остальное экранируем.
-        """
-        placeholder_open = "\u0001"
-        placeholder_close = "\u0002"
-
-        def mark_bold(m: re.Match) -> str:
-            return f"{placeholder_open}{m.group(1)}{placeholder_close}"
-
-        marked = re.sub(r"\*\*(.+?)\*\*", mark_bold, text)
-        escaped = html.escape(marked)
-        return escaped.replace(placeholder_open, "<b>").replace(placeholder_close, "</b>")
-
-    async def _reached_target(self, session_id: str) -> bool:
-        """
-        Проверяем, достигнут ли target_count по 'going' для сессии.
-        """
+    def _progress_sync(self, session_id: str) -> Optional[tuple[int, int]]:
+        """(сколько «Иду», target_count) или None, если сессии нет / ошибка."""
         try:
-            sess = (
-                self.repo.client.table("gt_sessions")
-                .select("session_id,target_count")
-                .eq("session_id", session_id)
-                .maybe_single()
-                .execute()
-                .data
-            )
+            sess = self.repo.get_session(session_id)
             if not sess:
-                return False
+                return None
             going, _, _ = self.repo.get_rsvp_lists(session_id)
-            return len(going) >= int(sess.get("target_count", 10))
+            return len(going), int(sess.get("target_count", 10))
         except Exception:
-            return False
+            return None
 
-    async def _safe_send_message(self, chat_id: int, text: str) -> None:
-        try:
-            await self.bot.send_message(
-                chat_id,
-                text,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
-        except Exception:
-            await asyncio.sleep(0.5)
+    async def _safe_send_message(
+        self,
+        chat_id: int,
+        text: str,
+        entities: Optional[List[Entity]] = None,
+        batcher: Optional[AdaptiveBatcher] = None,
+    ) -> bool:
+        """True — сообщение доставлено (не больше двух попыток)."""
+        if entities is None:
+            kwargs = {"parse_mode": "HTML"}
+        else:
+            # parse_mode=None явно — иначе подставится HTML из DefaultBotProperties
+            kwargs = {"parse_mode": None, "entities": as_message_entities(entities)}
+        for _ in range(2):
             try:
-                await self.bot.send_message(
+                await self._api(
                     chat_id,
-                    text,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True,
+                    lambda: self.bot.send_message(
+                        chat_id,
+                        text,
+                        disable_web_page_preview=True,
+                        **kwargs,
+                    ),
                 )
+                if batcher is not None:
+                    batcher.on_sent()
+                return True
+            except TelegramRetryAfter as e:
+                # флуд-лимит: ждём сколько сказали и замедляем созыв
+                if batcher is not None:
+                    batcher.on_retry_after(e.retry_after)
+                await asyncio.sleep(e.retry_after)
             except Exception:
-                pass
+                await asyncio.sleep(0.5)
+        return False
+
+    async def _api(self, chat_id: int, fn):
+        """Отправка в Bot API — через общий пул, если он есть."""
+        if self.scheduler is None:
+            return await fn()
+        return await self.scheduler.call(chat_id, fn)
+
+    async def _check_api(self, fn):
+        """Проверка присутствия — в отдельной полосе пула, мимо очереди отправок."""
+        if self.scheduler is None:
+            return await fn()
+        return await self.scheduler.check(fn)
 
     @staticmethod
     def _split_by_lines(text: str) -> List[str]:
         """
         Режем длинное сообщение по строкам, чтобы уложиться в 4096 символов.
         """
-        parts: List[str] = []
+        return ["\n".join(group) for group in TaggingService._chunk_lines(text.splitlines())]
+
+    @staticmethod
+    def _chunk_lines(lines: List[str]) -> List[List[str]]:
+        """
+        Группы строк, каждая склеивается через \\n не длиннее 4096 символов.
+        Строка целиком попадает в одну группу, даже если сама содержит \\n.
+        """
+        parts: List[List[str]] = []
         current: List[str] = []
         current_len = 0
 
-        for line in text.splitlines():
+        for line in lines:
             add = len(line) + 1  # +\n
             if current_len + add > TG_MAX_MESSAGE_LEN and current:
-                parts.append("\n".join(current))
+                parts.append(current)
                 current = [line]
                 current_len = len(line) + 1
             else:
@@ -255,5 +555,5 @@ class TaggingService:
                 current_len += add
 
         if current:
-            parts.append("\n".join(current))
+            parts.append(current)
         return parts
@@ -36,6 +36,9 @@ def summary_lines(going: List[str], maybe: List[str], nope: List[str], target: i
 # Плашка «укомплектовано» (без разметки — sessions.py экранирует)
 FULLY_STAFFED = "✅ Набор укомплектован."
 
+# Плашка под шапкой сессии, закрытой по времени (без разметки)
+SESSION_EXPIRED = "⌛ Набор завершён."
+
 # Динамическая подпись кнопки «Позвать всех на …»
 def button_call_all(game_title: str) -> str:
     return f"Позвать всех на {game_title}"
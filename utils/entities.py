@@ -0,0 +1,162 @@
+# utils/entities.py
+from __future__ import annotations
+
+import html
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram.types import MessageEntity
+
+# Лимиты Telegram на одно сообщение: длина текста (UTF-16) и число сущностей
+MAX_MESSAGE_LEN = 4096
+MAX_ENTITIES = 100
+
+# (type, offset, length, url) — offset/length в кодовых единицах UTF-16
+Entity = Tuple[str, int, int, Optional[str]]
+
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+
+
+def utf16_len(text: str) -> int:
+    """Длина строки так, как её считает Telegram."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+@dataclass(frozen=True)
+class Line:
+    """Строка без разметки + сущности относительно её начала."""
+
+    text: str
+    entities: Tuple[Entity, ...] = ()
+    length: int = 0  # utf16_len(text), посчитана один раз
+
+
+class LineBuilder:
+    """
+    Собирает Line по кусочкам, сразу считая смещения в UTF-16:
+    не нужно ни экранировать текст, ни разбирать HTML на стороне Telegram.
+    """
+
+    __slots__ = ("_parts", "_entities", "_len")
+
+    def __init__(self) -> None:
+        self._parts: List[str] = []
+        self._entities: List[Entity] = []
+        self._len = 0
+
+    def text(self, s: str) -> "LineBuilder":
+        self._parts.append(s)
+        self._len += utf16_len(s)
+        return self
+
+    def _span(self, kind: str, s: str, url: Optional[str] = None) -> "LineBuilder":
+        n = utf16_len(s)
+        self._entities.append((kind, self._len, n, url))
+        self._parts.append(s)
+        self._len += n
+        return self
+
+    def bold(self, s: str) -> "LineBuilder":
+        return self._span("bold", s)
+
+    def mention(self, user_id: int, label: str) -> "LineBuilder":
+        """Упоминание по id — то же, что <a href="tg://user?id=...">."""
+        return self._span("text_link", label, f"tg://user?id={user_id}")
+
+    def line(self, other: Line) -> "LineBuilder":
+        """Дописывает готовую Line (например, фразу из снимка пресетов)."""
+        base = self._len
+        self._entities.extend((k, base + off, n, url) for k, off, n, url in other.entities)
+        self._parts.append(other.text)
+        self._len += other.length
+        return self
+
+    def build(self) -> Line:
+        return Line("".join(self._parts), tuple(self._entities), self._len)
+
+
+def md_to_line(text: str) -> Line:
+    """Markdown-**жирный** -> Line с bold-сущностями (аналог md_to_html)."""
+    b = LineBuilder()
+    pos = 0
+    for m in _BOLD.finditer(text):
+        if m.start() > pos:
+            b.text(text[pos : m.start()])
+        b.bold(m.group(1))
+        pos = m.end()
+    if pos < len(text):
+        b.text(text[pos:])
+    return b.build()
+
+
+def md_to_html(text: str) -> str:
+    """Markdown-**жирный** -> HTML <b>…</b>, остальное экранируем."""
+    out: List[str] = []
+    pos = 0
+    for m in _BOLD.finditer(text):
+        out.append(html.escape(text[pos : m.start()]))
+        out.append(f"<b>{html.escape(m.group(1))}</b>")
+        pos = m.end()
+    out.append(html.escape(text[pos:]))
+    return "".join(out)
+
+
+def pack(
+    lines: Iterable[Line],
+    max_len: int = MAX_MESSAGE_LEN,
+    max_entities: int = MAX_ENTITIES,
+) -> List[Tuple[str, List[Entity]]]:
+    """
+    Склеивает строки через \\n в сообщения, не превышая лимиты длины
+    и числа сущностей. Смещения сущностей пересчитываются на месте.
+    Строка длиннее max_len уходит отдельным сообщением как есть.
+    """
+    return [(text, entities) for text, entities, _ in pack_counted(lines, max_len, max_entities)]
+
+
+def pack_counted(
+    lines: Iterable[Line],
+    max_len: int = MAX_MESSAGE_LEN,
+    max_entities: int = MAX_ENTITIES,
+) -> List[Tuple[str, List[Entity], int]]:
+    """
+    То же, что pack, плюс число строк в каждом сообщении: сама строка
+    может содержать \\n (фраза пресета), по тексту их не посчитать.
+    """
+    out: List[Tuple[str, List[Entity], int]] = []
+    parts: List[str] = []
+    entities: List[Entity] = []
+    size = 0
+
+    for ln in lines:
+        sep = 1 if parts else 0
+        if parts and (
+            size + sep + ln.length > max_len or len(entities) + len(ln.entities) > max_entities
+        ):
+            out.append(("\n".join(parts), entities, len(parts)))
+            parts, entities, size, sep = [], [], 0, 0
+        base = size + sep
+        entities.extend((k, base + off, n, url) for k, off, n, url in ln.entities)
+        parts.append(ln.text)
+        size = base + ln.length
+
+    if parts:
+        out.append(("\n".join(parts), entities, len(parts)))
+    return out
+
+
+def as_dicts(entities: Iterable[Entity]) -> List[Dict]:
+    """Сущности в виде, в котором их принимает Bot API."""
+    res = []
+    for kind, off, n, url in entities:
+        d = {"type": kind, "offset": off, "length": n}
+        if url is not None:
+            d["url"] = url
+        res.append(d)
+    return res
+
+
+def as_message_entities(entities: Iterable[Entity]) -> List[MessageEntity]:
+    """Сущности как aiogram MessageEntity — для bot.send_message(entities=...)."""
+    return [MessageEntity(**d) for d in as_dicts(entities)]
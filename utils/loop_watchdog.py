@@ -0,0 +1,193 @@
+# utils/loop_watchdog.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Шаг пульса event loop'а (сек): насколько позже он проснулся — это и есть лаг
+BEAT_EVERY = 0.05
+# Лаг больше этого (сек) считаем блокировкой и ищем виновника
+THRESHOLD = 0.1
+# Как часто (сек) писать в лог сводку по лагу и местам блокировок
+REPORT_EVERY = 300.0
+# Сколько последних замеров лага держать для перцентилей
+SAMPLES = 2000
+# Мест блокировки в сводке
+REPORT_TOP = 5
+
+# Корень проекта: всё, что ниже (кроме виртуальных окружений), — «наш» код
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUR_DIRS = ("handlers", "services", "repo", "utils")
+
+log = logging.getLogger(__name__)
+
+Site = Tuple[str, str]  # (где блокирует, из какого хендлера/сервиса)
+
+
+def _rel(filename: str) -> Optional[str]:
+    """Путь относительно корня проекта, если файл наш, иначе None."""
+    path = os.path.abspath(filename)
+    if not path.startswith(ROOT + os.sep) or "site-packages" in path:
+        return None
+    rel = os.path.relpath(path, ROOT)
+    # файлы в корне (main.py, config.py) и наши пакеты; bench/ и прочее — нет
+    if os.sep in rel and rel.split(os.sep, 1)[0] not in OUR_DIRS:
+        return None
+    return rel
+
+
+def attribute(stack: traceback.StackSummary) -> Site:
+    """
+    Самый глубокий наш кадр — место блокировки (обычно метод SupabaseRepo),
+    самый внешний кадр из handlers/ (или services/) — кто его вызвал.
+    """
+    ours = [(rel, f.name) for f in stack if (rel := _rel(f.filename)) is not None]
+    if not ours:
+        return ("<library>", "<unknown>")
+    rel, name = ours[-1]
+    where = f"{rel}:{name}"
+    owner = "<unknown>"
+    for prefix in ("handlers", "services"):
+        hit = next(((r, n) for r, n in ours if r.startswith(prefix + os.sep)), None)
+        if hit is not None:
+            owner = f"{hit[0]}:{hit[1]}"
+            break
+    return (where, owner)
+
+
+class LoopWatchdog:
+    """
+    Сторож event loop'а: синхронные вызовы (SupabaseRepo и т.п.) внутри
+    корутин останавливают весь бот, и это надо видеть.
+
+    - корутина-пульс (run_monitor) просыпается каждые BEAT_EVERY сек
+      и меряет, насколько опоздала;
+    - поток-сторож раз в BEAT_EVERY/2 проверяет, давно ли был пульс; если
+      дольше THRESHOLD — снимает стек потока loop'а (sys._current_frames)
+      прямо во время блокировки;
+    - когда loop оживает, длительность блокировки приписывается месту из
+      снятого стека (attribute): WARNING в лог + счётчики в sites.
+    Раз в REPORT_EVERY — сводка: перцентили лага и топ мест.
+    """
+
+    def __init__(
+        self,
+        threshold: float = THRESHOLD,
+        beat: float = BEAT_EVERY,
+        report_every: float = REPORT_EVERY,
+    ) -> None:
+        self.threshold = threshold
+        self.beat = beat
+        self.report_every = report_every
+        self.samples: Deque[float] = deque(maxlen=SAMPLES)
+        # (где, кто) -> {"count", "total", "max"} (сек)
+        self.sites: Dict[Site, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {"stalls": 0, "captured": 0}
+        self._seq = 0
+        self._last_beat = time.monotonic()
+        self._captured: Optional[Tuple[int, Site, str]] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+
+    # ---------- поток-сторож ----------
+    def _watch(self) -> None:
+        while not self._stop.wait(self.beat / 2):
+            seq = self._seq
+            if time.monotonic() - self._last_beat < self.beat + self.threshold:
+                continue
+            cap = self._captured
+            if cap is not None and cap[0] == seq:
+                continue  # эту блокировку уже сняли
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self._captured = (seq, attribute(stack), "".join(stack.format()[-8:]).rstrip())
+
+    # ---------- пульс в loop'е ----------
+    async def run_monitor(self) -> None:
+        """Фоновая задача: пульс + поток-сторож (останавливается вместе с задачей)."""
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        watcher.start()
+        next_report = time.monotonic() + self.report_every
+        try:
+            while True:
+                await asyncio.sleep(self.beat)
+                now = time.monotonic()
+                lag = max(0.0, now - self._last_beat - self.beat)
+                self.samples.append(lag)
+                if lag > self.threshold:
+                    self._on_stall(lag)
+                self._seq += 1
+                self._last_beat = now
+                if now >= next_report:
+                    next_report = now + self.report_every
+                    self.report()
+        finally:
+            self._stop.set()
+
+    def _on_stall(self, lag: float) -> None:
+        self.counts["stalls"] += 1
+        cap = self._captured
+        if cap is not None and cap[0] == self._seq:
+            self.counts["captured"] += 1
+            site, stack = cap[1], cap[2]
+        else:
+            # блокировка короче шага сторожа — места не знаем
+            site, stack = ("<missed>", "<unknown>"), ""
+        s = self.sites.setdefault(site, {"count": 0, "total": 0.0, "max": 0.0})
+        s["count"] += 1
+        s["total"] += lag
+        s["max"] = max(s["max"], lag)
+        log.warning(
+            "loop blocked %.0f ms in %s (from %s)%s",
+            lag * 1000, site[0], site[1], "\n" + stack if stack else "",
+        )
+
+    # ---------- метрики ----------
+    def snapshot(self) -> Dict:
+        """Перцентили лага (мс), счётчики и места блокировок по суммарному времени."""
+        lags = sorted(self.samples)
+
+        def pct(p: float) -> float:
+            return lags[min(len(lags) - 1, int(p * len(lags)))] * 1000 if lags else 0.0
+
+        top: List[Tuple[Site, Dict[str, float]]] = sorted(
+            self.sites.items(), key=lambda kv: kv[1]["total"], reverse=True
+        )
+        return {
+            "lag_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": lags[-1] * 1000 if lags else 0.0},
+            **self.counts,
+            "sites": [
+                {"where": w, "from": o, "count": int(s["count"]),
+                 "total_ms": s["total"] * 1000, "max_ms": s["max"] * 1000}
+                for (w, o), s in top
+            ],
+        }
+
+    def summary(self, top: int = REPORT_TOP) -> str:
+        """Текстовая сводка snapshot(): для лога и для /profile."""
+        snap = self.snapshot()
+        lag = snap["lag_ms"]
+        lines = [
+            f"loop lag p50={lag['p50']:.1f}ms p99={lag['p99']:.1f}ms max={lag['max']:.1f}ms, "
+            f"stalls={snap['stalls']} (located {snap['captured']})"
+        ]
+        for s in snap["sites"][:top]:
+            lines.append(
+                f"  {s['total_ms']:8.0f}ms total  {s['count']:5d}x  max {s['max_ms']:6.0f}ms  "
+                f"{s['where']}  <- {s['from']}"
+            )
+        return "\n".join(lines)
+
+    def report(self) -> None:
+        log.info(self.summary())
@@ -0,0 +1,67 @@
+# utils/prefilter.py
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.types import Update
+
+from services.sightings import SightingService
+
+GROUP_TYPES = {"group", "supergroup"}
+
+# Классы апдейтов
+COMMAND = "command"
+CALLBACK = "callback"
+MEMBER = "member"
+CHATTER = "chatter"
+OTHER = "other"
+
+
+def classify(update: Update) -> str:
+    """
+    Быстрая классификация апдейта по полям, без фильтров роутеров.
+    chatter — обычное сообщение в группе (не команда, не сервисное):
+    ни один роутер кроме «видели пользователя» его не обрабатывает.
+    """
+    if update.callback_query is not None:
+        return CALLBACK
+    if update.chat_member is not None or update.my_chat_member is not None:
+        return MEMBER
+    m = update.message
+    if m is None or m.chat.type not in GROUP_TYPES:
+        return OTHER
+    text = m.text or m.caption
+    if text and text[0] == "/":
+        return COMMAND
+    if m.new_chat_members or m.left_chat_member:
+        return MEMBER
+    return CHATTER
+
+
+class PrefilterMiddleware:
+    """
+    Outer-middleware на dp.update, которое стоит первым в цепочке.
+    Обычные сообщения в группах не идут через роутеры: сразу фиксируем
+    пользователя в SightingService и выходим. Остальное — как обычно.
+    """
+
+    def __init__(self, sightings: SightingService) -> None:
+        self.sightings = sightings
+        self.counts: Dict[str, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = classify(event)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if kind != CHATTER:
+            return await handler(event, data)
+
+        m = event.message
+        u = m.from_user
+        if u is not None:
+            self.sightings.seen(m.chat.id, u.id, u.username, u.first_name, u.last_name)
+        return None
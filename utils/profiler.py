@@ -0,0 +1,172 @@
+# utils/profiler.py
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, List, Optional
+
+# Частота опроса стеков потоков (сек) — 100 Гц почти не нагружает процесс
+INTERVAL = 0.01
+# Как часто (сек) снимать стеки ожидающих asyncio-задач (это делает сам loop)
+TASK_INTERVAL = 0.05
+# Дольше этого профиль не снимаем
+MAX_SECONDS = 120
+# Строк в каждой таблице сводки
+TOP_N = 15
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+THREAD = "thread"
+TASK = "task"
+
+
+def _label(code: CodeType) -> str:
+    """«файл:функция»; наш код — от корня проекта, чужой — последние 2 части пути."""
+    path = os.path.abspath(code.co_filename)
+    if path.startswith(ROOT + os.sep) and "site-packages" not in path:
+        where = os.path.relpath(path, ROOT)
+    else:
+        where = "/".join(path.split(os.sep)[-2:])
+    return f"{where}:{code.co_name}"
+
+
+def _thread_stack(frame: Optional[FrameType]) -> List[str]:
+    out: List[str] = []
+    while frame is not None:
+        out.append(_label(frame.f_code))
+        frame = frame.f_back
+    out.reverse()
+    return out
+
+
+def _task_stack(task: asyncio.Task) -> List[str]:
+    """Цепочка await'ов задачи от корутины-корня до места, где она ждёт."""
+    out: List[str] = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        out.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return out
+
+
+class Profile:
+    """Результат: стеки в формате collapsed (flamegraph.pl / speedscope) + сводка."""
+
+    def __init__(self, stacks: Counter, seconds: float, samples: Dict[str, int]) -> None:
+        self.stacks = stacks
+        self.seconds = seconds
+        self.samples = samples
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self, top: int = TOP_N) -> str:
+        """
+        Потоки: self — где стек был последним кадром (жжёт CPU или висит
+        в блокирующем вызове), total — где функция была в стеке вообще.
+        Задачи: на чём ждут asyncio-задачи (batch_tag, хендлеры и т.п.).
+        """
+        self_c: Counter = Counter()
+        total_c: Counter = Counter()
+        wait_c: Counter = Counter()
+        for stack, n in self.stacks.items():
+            kind, _, rest = stack.partition(":")
+            frames = rest.split(";")[1:]  # первый элемент — имя потока/задачи
+            if not frames:
+                continue
+            if kind == THREAD:
+                self_c[frames[-1]] += n
+                for f in set(frames):
+                    total_c[f] += n
+            else:
+                wait_c[";".join(frames[-2:])] += n
+
+        def table(title: str, c: Counter, denom: int) -> List[str]:
+            rows = [title]
+            for name, n in c.most_common(top):
+                rows.append(f"{100 * n / max(1, denom):5.1f}%  {name}")
+            return rows
+
+        lines = [
+            f"{self.seconds:.0f}s, thread samples: {self.samples[THREAD]}, task samples: {self.samples[TASK]}",
+            "",
+        ]
+        lines += table("threads / self:", self_c, self.samples[THREAD])
+        lines += [""] + table("threads / total:", total_c, self.samples[THREAD])
+        lines += [""] + table("asyncio tasks / awaiting:", wait_c, self.samples[TASK])
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер живого процесса, без перезапуска и без
+    вмешательства в код.
+
+    - отдельный поток раз в INTERVAL снимает sys._current_frames():
+      что выполняется в каждом потоке (loop, пул to_thread и т.д.);
+    - корутина в самом loop'е раз в TASK_INTERVAL проходит по
+      asyncio.all_tasks() и записывает цепочку await'ов каждой задачи —
+      видно, где ждут batch_tag, хендлеры и фоновые задачи.
+    Одновременно идёт только один профиль.
+    """
+
+    def __init__(self, interval: float = INTERVAL, task_interval: float = TASK_INTERVAL) -> None:
+        self.interval = interval
+        self.task_interval = task_interval
+        self.busy = False
+
+    async def profile(self, seconds: float) -> Profile:
+        if self.busy:
+            raise RuntimeError("profile already running")
+        seconds = max(1.0, min(float(seconds), MAX_SECONDS))
+        self.busy = True
+        try:
+            return await self._run(seconds)
+        finally:
+            self.busy = False
+
+    async def _run(self, seconds: float) -> Profile:
+        # у потока-сэмплера и loop'а свои счётчики — без гонок на +=
+        thread_stacks: Counter = Counter()
+        task_stacks: Counter = Counter()
+        samples = {THREAD: 0, TASK: 0}
+        deadline = time.monotonic() + seconds
+        stop = threading.Event()
+
+        def sample_threads() -> None:
+            me = threading.get_ident()
+            while not stop.wait(self.interval) and time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    name = names.get(ident, str(ident))
+                    thread_stacks[";".join([f"{THREAD}:{name}"] + _thread_stack(frame))] += 1
+                samples[THREAD] += 1
+
+        sampler = threading.Thread(target=sample_threads, name="profiler", daemon=True)
+        sampler.start()
+        current = asyncio.current_task()
+        try:
+            while time.monotonic() < deadline:
+                for task in asyncio.all_tasks():
+                    if task is current or task.done():
+                        continue
+                    frames = _task_stack(task)
+                    if frames:
+                        # имя задачи (Task-123) не стабильно — берём корневую корутину
+                        task_stacks[";".join([f"{TASK}:{frames[0]}"] + frames)] += 1
+                samples[TASK] += 1
+                await asyncio.sleep(self.task_interval)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+        return Profile(thread_stacks + task_stacks, seconds, samples)
@@ -0,0 +1,109 @@
+# utils/recorder.py
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List
+
+from aiogram.types import Update
+
+from utils.prefilter import classify
+
+# Как часто (сек) дописывать накопленные апдейты в файл
+FLUSH_EVERY = 2.0
+# Больше стольких записей в памяти не держим (диск не успевает) — новые теряем
+MAX_BUFFER = 50_000
+
+log = logging.getLogger(__name__)
+
+
+class UpdateRecorder:
+    """
+    Outer-middleware на dp.update: записывает входящие апдейты (сообщения,
+    колбэки, chat_member и т.д.) для последующего прогона через
+    bench/replay_updates.py.
+
+    Запись — строка JSON: {"ts": время прихода (unix), "ms": сколько
+    обрабатывался, "kind": класс из prefilter.classify, "ok": без исключения,
+    "update": Update как его прислал Telegram}.
+    Файл — gzip, только дописывается: каждый сброс — отдельный gzip-член,
+    gzip.open читает такой файл целиком. path может содержать strftime-шаблон
+    (data/updates-%Y%m%d.jsonl.gz — файл на день).
+    Стоит первым в цепочке, чтобы видеть и то, что отсекает PrefilterMiddleware.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._buffer: List[str] = []
+        self.counts: Dict[str, int] = {"recorded": 0, "dropped": 0, "written": 0}
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        ts = time.time()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            res = await handler(event, data)
+            ok = True
+            return res
+        finally:
+            self._record(event, ts, (time.perf_counter() - t0) * 1000, ok)
+
+    def _record(self, event: Update, ts: float, ms: float, ok: bool) -> None:
+        if len(self._buffer) >= MAX_BUFFER:
+            self.counts["dropped"] += 1
+            return
+        rec = {
+            "ts": round(ts, 3),
+            "ms": round(ms, 2),
+            "kind": classify(event),
+            "ok": ok,
+            "update": event.model_dump(mode="json", exclude_none=True, by_alias=True),
+        }
+        self._buffer.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+        self.counts["recorded"] += 1
+
+    def _write(self, lines: List[str]) -> None:
+        path = time.strftime(self.path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> int:
+        if not self._buffer:
+            return 0
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            self.counts["dropped"] += len(lines)
+            log.warning("recorder: failed to write %s updates: %r", len(lines), e)
+            return 0
+        self.counts["written"] += len(lines)
+        return len(lines)
+
+    async def run_flusher(self, interval: float = FLUSH_EVERY) -> None:
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+def read_records(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Записи из одного или нескольких файлов записи, в порядке файлов."""
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
@@ -0,0 +1,139 @@
+# utils/sqlite_storage.py
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+# Сколько живёт запись FSM после последней записи (сек). 0 — без TTL.
+DEFAULT_TTL = 24 * 3600
+# Как часто (сек) чистить просроченные записи.
+PURGE_EVERY = 300
+# Ограничение page cache SQLite (в KiB, отрицательное значение — «в килобайтах»)
+CACHE_KIB = 2048
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram на локальном файле SQLite.
+
+    - переживает рестарты: состояние и data лежат в файле;
+    - несколько процессов могут работать с одним файлом (WAL + busy_timeout);
+    - память ограничена: в процессе ничего не кэшируется, page cache SQLite
+      ограничен CACHE_KIB;
+    - TTL: запись, которую не обновляли ttl секунд, считается отсутствующей
+      и периодически удаляется.
+
+    Запросы точечные по первичному ключу, но файл может быть занят другим
+    процессом (ждём до busy_timeout), поэтому они идут в пуле потоков,
+    а не в event loop; соединение одно, под замком.
+    """
+
+    def __init__(self, path: str, ttl: int = DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = max(0, int(ttl))
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+
+        self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fsm (
+              key        TEXT PRIMARY KEY,
+              state      TEXT,
+              data       TEXT,
+              expires_at REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_expires ON fsm (expires_at)")
+
+    # ---------- ключи / TTL ----------
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            getattr(key, "thread_id", None),
+            getattr(key, "business_connection_id", None),
+            key.destiny,
+        ]
+        return ":".join("" if p is None else str(p) for p in parts)
+
+    def _expires(self, now: float) -> Optional[float]:
+        return now + self.ttl if self.ttl else None
+
+    def _maybe_purge(self, now: float) -> None:
+        if not self.ttl or now - self._last_purge < PURGE_EVERY:
+            return
+        self._last_purge = now
+        self._db.execute("DELETE FROM fsm WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+
+    def _read(self, key: StorageKey) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            self._maybe_purge(now)
+            row = self._db.execute(
+                "SELECT state, data, expires_at FROM fsm WHERE key = ?", (self._key(key),)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[2] is not None and row[2] < now:
+            return None
+        return row
+
+    def _write(self, key: StorageKey, column: str, value: Optional[str]) -> None:
+        now = time.time()
+        k = self._key(key)
+        with self._lock:
+            self._maybe_purge(now)
+            # просроченная запись не должна «воскреснуть» второй колонкой
+            self._db.execute("DELETE FROM fsm WHERE key = ? AND expires_at < ?", (k, now))
+            self._db.execute(
+                f"""
+                INSERT INTO fsm (key, {column}, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column},
+                                               expires_at = excluded.expires_at
+                """,
+                (k, value, self._expires(now)),
+            )
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._write, key, "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await asyncio.to_thread(self._read, key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False) if data else None
+        await asyncio.to_thread(self._write, key, "data", value)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await asyncio.to_thread(self._read, key)
+        if not row or not row[1]:
+            return {}
+        return json.loads(row[1])
+
+    def _close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)